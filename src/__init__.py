@@ -1,6 +1,38 @@
-from .lcu import *
-from .lsu import *
-from .kmem import *
-from .mxcu import *
-from .rc import *
-from .imem import *
\ No newline at end of file
+"""DISCO-CGRA simulator. The submodules are only imported when one of their names is used, so that importing one
+of them (for example src.simulator) does not import the others. The package exports the public names of the same
+modules as before, in the same order: a later module wins when two of them define a name"""
+
+import sys
+import importlib
+import importlib.util
+
+# Modules whose public names are exported by the package
+EXPORTED_MODULES = ("lcu", "lsu", "kmem", "mxcu", "rc", "imem", "trace")
+
+def __getattr__(name):
+    if name == "__all__":
+        return export_names()
+    if name.startswith("_"):
+        raise AttributeError("module " + __name__ + " has no attribute " + name)
+    # A submodule, as if it had been imported by the star imports
+    if importlib.util.find_spec("." + name, __name__) is not None:
+        return importlib.import_module("." + name, __name__)
+    for module_name in reversed(EXPORTED_MODULES):
+        module = importlib.import_module("." + module_name, __name__)
+        if hasattr(module, name):
+            value = getattr(module, name)
+            globals()[name] = value
+            return value
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
+
+def __dir__():
+    return sorted(set(globals()) | set(export_names()))
+
+def export_names():
+    '''Names of "from src import *": the public names of the exported modules and the loaded submodules'''
+    names = []
+    for module_name in EXPORTED_MODULES:
+        module = importlib.import_module("." + module_name, __name__)
+        names += [name for name in vars(module) if not name.startswith("_")]
+    names += [name.split(".")[-1] for name in sys.modules if name.startswith(__name__ + ".") and name.count(".") == 1]
+    return list(dict.fromkeys(names))
@@ -1,5 +1,16 @@
 from .params import *
-from ctypes import *
+
+# All the bits of a 32-bit word
+MASK_32b = 0xFFFFFFFF
+
+# Bit reversal of each byte value, used by bitrev
+BITREV_8b = [int("{:08b}".format(byte)[::-1], 2) for byte in range(256)]
+
+def int32(value):
+    '''Wrap an integer to 32-bit two's complement, as c_int32(value).value does, without a ctypes object.
+    The hot ALU operations inline this same expression'''
+    return ((value + 0x80000000) & MASK_32b) - 0x80000000
+
 class ALU():
     def __init__(self):
         self.res = 0
@@ -20,47 +31,49 @@ class ALU():
         pass # Intentional
 
     def sadd(self, val1, val2 ):
-        self.newRes = c_int32( val1 + val2 ).value
+        self.newRes = ((val1 + val2 + 0x80000000) & MASK_32b) - 0x80000000
 
     def ssub(self,  val1, val2 ):
-        self.newRes = c_int32( val1 - val2 ).value
+        self.newRes = ((val1 - val2 + 0x80000000) & MASK_32b) - 0x80000000
 
     def sll(self,  val1, val2 ):
-        mask = (1 << 3) - 1 # Get the three last bits of val2 for the shift
-        shift_n = val2 & mask
-        self.newRes = c_int32(val1 << shift_n).value
+        shift_n = val2 & 7 # Get the three last bits of val2 for the shift
+        self.newRes = (((val1 << shift_n) + 0x80000000) & MASK_32b) - 0x80000000
 
     def srl(self,  val1, val2 ):
         # Python shifts are always arithmetic so...
-        mask = (1 << 3) - 1 # Get the three last bits of val2 for the shift
-        shift_n = val2 & mask
+        shift_n = val2 & 7 # Get the three last bits of val2 for the shift
         if val1 >= 0:
-            interm_result = (c_int32(val1).value & MAX_32b)
-            self.newRes = c_int32(interm_result >> shift_n).value
+            # The lowest 31 bits of the wrapped value, so the shifted result is positive
+            self.newRes = (val1 & MAX_32b) >> shift_n
         else:
-            res_pos = c_int32((-val1) >> shift_n).value
+            res_pos = int32((-val1) >> shift_n)
             self.newRes = - res_pos
-        
+
 
     def sra(self,  val1, val2 ):
-        mask = (1 << 3) - 1 # Get the three last bits of val2 for the shift
-        shift_n = val2 & mask
-        self.newRes = c_int32(val1 >> shift_n).value
+        shift_n = val2 & 7 # Get the three last bits of val2 for the shift
+        self.newRes = (((val1 >> shift_n) + 0x80000000) & MASK_32b) - 0x80000000
 
     def lor(self,  val1, val2 ):
-        self.newRes = c_int32( val1 | val2).value
+        self.newRes = (((val1 | val2) + 0x80000000) & MASK_32b) - 0x80000000
 
     def land(self,  val1, val2 ):
-        self.newRes = c_int32( val1 & val2).value
+        self.newRes = (((val1 & val2) + 0x80000000) & MASK_32b) - 0x80000000
 
     def lxor(self,  val1, val2 ):
-        self.newRes = c_int32( val1 ^ val2).value
+        self.newRes = (((val1 ^ val2) + 0x80000000) & MASK_32b) - 0x80000000
     
     def smul(self,  val1, val2):
-        self.newRes = c_int32(val1 * val2).value & MAX_32b
+        # The lowest 31 bits of the wrapped product
+        self.newRes = (val1 * val2) & MAX_32b
 
     def sdiv(self,  val1, val2):
-        self.newRes = c_int32(val1 / val2).value
+        # Truncated towards zero, as the division of C
+        quotient = abs(val1) // abs(val2)
+        if (val1 < 0) != (val2 < 0):
+            quotient = -quotient
+        self.newRes = int32(quotient)
     
     def saddh(self,  val1, val2 ):
         val1_high = (val1 >> 16) & 0xFFFF  
@@ -119,7 +132,7 @@ class ALU():
         raise Exception("Half precision div not supported.")
 
     def mul_fp(self, val1, val2):
-        print("Fixed point mul to be done.")
+        # Fixed point mul is not implemented yet, its result is 0
         self.newRes = 0
 
     def div_fp(self, val1, val2):
@@ -134,21 +147,15 @@ class ALU():
         else: self.newRes = val2
 
     def bitrev(self, val1, val2):
-        # Reverse bit order of val1
-        val1 = (( val1 & 0x55555555) << 1) | (( val1 & 0xAAAAAAAA) >> 1)
-        val1 = (( val1 & 0x33333333) << 2) | (( val1 & 0xCCCCCCCC) >> 2)
-        val1 = (( val1 & 0x0F0F0F0F) << 4) | (( val1 & 0xF0F0F0F0) >> 4)
-        val1 = (( val1 & 0x00FF00FF) << 8) | (( val1 & 0xFF00FF00) >> 8)
-        val1 = (( val1 & 0x0000FFFF) << 16) | (( val1 & 0xFFFF0000) >> 16)
-        # Then shift it right 
-        mask = (1 << 3) - 1 # Get the three last bits of val2 for the shift
-        shift_n = val2 & mask
-        interm_result = (c_int32(val1).value & MAX_32b)
-        self.newRes = c_int32(interm_result >> shift_n).value
+        # Reverse bit order of the lowest 32 bits of val1, one byte at a time
+        val1 = (BITREV_8b[val1 & 0xFF] << 24) | (BITREV_8b[(val1 >> 8) & 0xFF] << 16) | \
+               (BITREV_8b[(val1 >> 16) & 0xFF] << 8) | BITREV_8b[(val1 >> 24) & 0xFF]
+        # Then shift right its lowest 31 bits
+        shift_n = val2 & 7 # Get the three last bits of val2 for the shift
+        self.newRes = (val1 & MAX_32b) >> shift_n
     
     def mac(self, val1, val2, val3):
-        self.newRes = c_int32(val1 * val2).value + val3
-        print(f"{val1} * {val2} + {val3}") # DEBUG
+        self.newRes = ((val1 * val2 + 0x80000000) & MASK_32b) - 0x80000000 + val3
 
     def mach(self, val1, val2, val3):
         val1_high = (val1 >> 16) & 0xFFFF  
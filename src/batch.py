@@ -0,0 +1,507 @@
+"""batch.py: Many instances of a kernel of the DISCO-CGRA executed in lockstep on NumPy arrays, one row per instance"""
+
+import numpy as np
+
+from .params import *
+from .alu import ALU, BITREV_8b
+from .spm import copyWords
+from .lsu import SHUFFLE_INDICES
+from .rc_array import RC_ARRAY_OPS, RC_ARRAY_OP_NAMES, RC_ARRAY_CONSTS, wrap32, contiguous
+
+# Instances that run in lockstep at most, the next ones wait for another batch. The state of an instance takes
+# about 70 KB
+BATCH_SIZE = 256
+
+BITREV_8b_TABLE = np.array(BITREV_8b, dtype=np.int64)
+
+def bitrev32(a, b):
+    '''Same as ALU.bitrev for each element'''
+    rev = (BITREV_8b_TABLE[a & 0xFF] << 24) | (BITREV_8b_TABLE[(a >> 8) & 0xFF] << 16) | \
+          (BITREV_8b_TABLE[(a >> 16) & 0xFF] << 8) | BITREV_8b_TABLE[(a >> 24) & 0xFF]
+    return (rev & MAX_32b) >> (b & 7)
+
+# ALU operations of the LSUs, MXCUs and LCUs on arrays, by ALU method
+UNIT_ALU_OPS = { name: (lambda op: lambda a, b: op(a, b, None, None))(RC_ARRAY_OPS[name])
+                 for name in ("sadd", "ssub", "sll", "srl", "sra", "land", "lor", "lxor") }
+UNIT_ALU_OPS["bitrev"] = bitrev32
+
+# ALU method of each operation code of the LSU, MXCU and LCU (see their runAlu). None is a NOP
+LSU_ALU_METHODS = ["land", "lor", "lxor", "sadd", "ssub", "sll", "srl", "bitrev"]
+MXCU_ALU_METHODS = [None, "sadd", "ssub", "sll", "srl", "land", "lor", "lxor"]
+LCU_ALU_METHODS = [None, "sadd", "ssub", "sll", "srl", "sra", "land", "lor", "lxor"]
+
+def failing(error):
+    '''A step that raises error, for the encodings that the units do not recognize'''
+    def step(data, rows):
+        raise error
+    return step
+
+class CGRA_BATCH:
+    '''The kernel loaded in the IMEMs of the units of a CGRA, executed on many instances at once. The state of each
+    instance is a row of an int64 array (see new_data) that starts with the data of CGRA.get_data, so the SPM,
+    VWRs, SRFs, registers, ALUs and LCU branch and exit of all the instances have a leading batch axis, followed
+    by the constant inputs of the RCs.
+
+    The instructions of each pc are compiled into a step that executes them on a group of rows with array
+    operations, in the order of SIMULATOR.compile_rc_array_kernel. In each cycle the instances at the same pc take
+    its step together: all of them while their control flow does not diverge, otherwise one group per pc. The
+    result of each instance is the same as the one of SIMULATOR.run. As in RC_ARRAY the values are int64, and the
+    words written to the SPM and the VWRs are wrapped to 32 bits as the int32 memories keep them.
+    '''
+    def __init__(self, disco_cgra, ini_col, end_col, n_instr_per_col):
+        self.disco_cgra = disco_cgra
+        self.cols = range(ini_col, end_col+1)
+        self.n_instr_per_col = n_instr_per_col
+        # Layout of the data of get_data: SPM, VWRs, SRFs, registers and ALUs of each unit and LCU exit, branch and
+        # branch_pc. The units are in the order of get_units: LCUs, LSUs, MXCUs and RCs
+        units = disco_cgra.get_units()
+        self.vwr_base = SPM_NLINES*SPM_NWORDS
+        self.srf_base = self.vwr_base + CGRA_COLS*N_VWR_PER_COL*N_ELEMS_PER_VWR
+        self.reg_base = []
+        pos = self.srf_base + CGRA_COLS*SRF_N_REGS
+        for unit in units:
+            self.reg_base.append(pos)
+            pos += len(unit.regs)
+        self.alu_base = pos
+        self.n_units = len(units)
+        self.lcu_base = self.alu_base + 4*self.n_units
+        self.data_size = self.lcu_base + 3*CGRA_COLS
+        self.const_base = self.data_size
+        self.width = self.const_base + len(RC_ARRAY_CONSTS)
+        # Unit of the ALU of each RC, for their neighbours
+        self.alu_unit = { id(unit.alu): idx for idx, unit in enumerate(units) }
+        self.steps = [self.compile(pc) for pc in range(n_instr_per_col)]
+
+    # Unit of each LCU, LSU, MXCU and RC, in the order of get_units
+    def lcu(self, col):
+        return col
+
+    def lsu(self, col):
+        return CGRA_COLS + col
+
+    def mxcu(self, col):
+        return 2*CGRA_COLS + col
+
+    def rc(self, col, row):
+        return 3*CGRA_COLS + col*CGRA_ROWS + row
+
+    # Columns of the data of each value
+    def reg(self, unit, n):
+        return self.reg_base[unit] + n
+
+    def res(self, unit):
+        return self.alu_base + 4*unit
+
+    def new_res(self, unit):
+        return self.alu_base + 4*unit + 1
+
+    def flag(self, unit, zero):
+        '''Column of the zero flag of a unit if zero, of its sign flag otherwise'''
+        return self.alu_base + 4*unit + (2 if zero else 3)
+
+    def srf(self, col, n):
+        return self.srf_base + col*SRF_N_REGS + n
+
+    def vwr(self, col, vwr):
+        '''Column of the first word of a VWR'''
+        return self.vwr_base + (col*N_VWR_PER_COL + vwr)*N_ELEMS_PER_VWR
+
+    def exit(self, col):
+        return self.lcu_base + 3*col
+
+    def branch(self, col):
+        return self.lcu_base + 3*col + 1
+
+    def branch_pc(self, col):
+        return self.lcu_base + 3*col + 2
+
+    def new_data(self, initial_data, n, srf_spm_bank):
+        '''The rows of n instances that start from initial_data (given by CGRA.get_data), with R7 of the LSUs of the
+        used columns at the SRF line of the SPM, as SIMULATOR.run starts'''
+        data = np.empty((n, self.width), dtype=np.int64)
+        data[:, :self.data_size] = initial_data
+        data[:, self.const_base:] = RC_ARRAY_CONSTS
+        for col in self.cols:
+            data[:, self.reg(self.lsu(col), 7)] = srf_spm_bank
+        return data
+
+    def spm(self, data):
+        '''View of the SPMs of the rows of data, of shape (n, SPM_NLINES, SPM_NWORDS)'''
+        return data[:, :self.vwr_base].reshape(len(data), SPM_NLINES, SPM_NWORDS)
+
+    def set_lines(self, data, first_line, lines):
+        '''Copy lines, of shape (m, SPM_NWORDS) or (n, m, SPM_NWORDS) for each of the n rows of data, into the SPM
+        lines from first_line on, wrapped to 32-bit words as SPM.setLines does'''
+        lines = np.asarray(lines)
+        self.disco_cgra.spm.checkLines(first_line, lines.shape[-2])
+        words = np.empty(lines.shape, dtype=np.int32)
+        copyWords(words, lines)
+        self.spm(data)[:, first_line:first_line+lines.shape[-2]] = words
+
+    def run(self, data, max_iter):
+        '''Execute the kernel from pc 0 on each row of data (see new_data), changed in place into the final state
+        of its instance. Return the number of cycles of each instance, an int64 array'''
+        n = len(data)
+        pc = np.zeros(n, dtype=np.int64)
+        cycles = np.zeros(n, dtype=np.int64)
+        cols = list(self.cols)
+        branch_cols = np.array([self.branch(col) for col in cols], dtype=np.int64)
+        branch_pc_cols = np.array([self.branch_pc(col) for col in cols], dtype=np.int64)
+        exit_cols = np.array([self.exit(col) for col in cols], dtype=np.int64)
+        active = np.arange(n if max_iter > 0 and self.n_instr_per_col > 0 else 0)
+        while len(active):
+            pcs = pc[active]
+            if (pcs == pcs[0]).all():
+                self.steps[int(pcs[0])](data, active)
+            else:
+                # The control flow diverged, one group of instances per pc
+                for group_pc in np.unique(pcs):
+                    self.steps[int(group_pc)](data, active[pcs == group_pc])
+            self.update(data, active)
+            pcs += 1
+            # Check branches
+            taken = data[active[:, None], branch_cols] == 1
+            n_taken = taken.sum(axis=1)
+            assert((n_taken <= 1).all()), "More than one branch at the same cycle"
+            branching = np.flatnonzero(n_taken)
+            if len(branching):
+                pcs[branching] = data[active[branching], branch_pc_cols[taken[branching].argmax(axis=1)]]
+            # Check exit
+            exits = (data[active[:, None], exit_cols] == 1).any(axis=1)
+            pc[active] = pcs
+            cycles[active] += 1
+            active = active[(pcs < self.n_instr_per_col) & (cycles[active] < max_iter) & ~exits]
+        return cycles
+
+    def update(self, data, rows):
+        '''Same as CGRA.updateSharedValues for the instances of rows'''
+        alus = data[rows, self.alu_base:self.lcu_base].reshape(len(rows), self.n_units, 4)
+        alus[:, :, 0] = alus[:, :, 1]
+        alus[:, :, 2] = alus[:, :, 1] == 0
+        alus[:, :, 3] = alus[:, :, 1] < 0
+        data[rows, self.alu_base:self.lcu_base] = alus.reshape(len(rows), -1)
+
+    def compile(self, pc):
+        '''Get the step of pc: a function of the data and the rows of the instances at pc that executes the
+        instructions of pc of the used columns on them'''
+        unit_steps = []
+        ctrls = { col: self.disco_cgra.mxcus[col].imem.get_control(pc) for col in self.cols }
+        for col in self.cols:
+            unit_steps.append(self.compile_lsu(pc, col, ctrls[col]))
+        rc_step = self.compile_rcs(pc, ctrls)
+        if rc_step is not None:
+            unit_steps.append(rc_step)
+        for col in self.cols:
+            unit_steps.append(self.compile_mxcu(pc, col, ctrls[col]))
+            unit_steps.append(self.compile_lcu(pc, col, ctrls[col]))
+
+        def step(data, rows):
+            for unit_step in unit_steps:
+                unit_step(data, rows)
+        return step
+
+    def reader(self, column=None, value=0, dec=0):
+        '''Function of the data and rows that reads a column of them minus dec, or the constant value if no column'''
+        if column is None:
+            value -= dec
+            return lambda data, rows: np.full(len(rows), value, dtype=np.int64)
+        if dec:
+            return lambda data, rows: data[rows, column] - dec
+        return lambda data, rows: data[rows, column]
+
+    def compile_lsu(self, pc, col, ctrl):
+        '''Step of the LSU of a column, see LSU.run'''
+        rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel, vwr_sel_shuf_op, mem_op = self.disco_cgra.lsus[col].imem.fields[pc].tolist()
+        unit = self.lsu(col)
+        muxes = []
+        for mux in (muxa_sel, muxb_sel):
+            if mux <= 7: # Rx
+                muxes.append(self.reader(self.reg(unit, mux)))
+            elif mux == 8: # SRF
+                muxes.append(self.reader(self.srf(col, ctrl.srf_sel)))
+            elif mux <= 11: # ZERO, ONE or TWO
+                muxes.append(self.reader(value=mux - 9))
+            else:
+                return failing(Exception("LSU: Mux value not recognized"))
+        get_a, get_b = muxes
+        alu_fn = UNIT_ALU_OPS[LSU_ALU_METHODS[alu_op]]
+        line_col = self.reg(unit, 7)
+        new_res_col = self.new_res(unit)
+        rf_col = self.reg(unit, rf_wsel)
+        words = np.arange(SPM_NWORDS)
+        if vwr_sel_shuf_op < 3: # VWR_A, B or C
+            mem_first = self.vwr(col, vwr_sel_shuf_op)
+            mem_size = N_ELEMS_PER_VWR
+        else: # SRF, only its first SRF_N_REGS words
+            mem_first = self.srf(col, 0)
+            mem_size = SRF_N_REGS
+        vwr_a = self.vwr(col, 0)
+        vwr_c = self.vwr(col, 2)
+        shuffle = SHUFFLE_INDICES[vwr_sel_shuf_op]
+
+        def get_lines(data, rows):
+            '''Columns of the words of the SPM line of R7 of each instance'''
+            lines = data[rows, line_col]
+            bad = (lines < 0) | (lines >= SPM_NLINES)
+            if bad.any():
+                raise Exception("SPM: Number of SPM line " + str(lines[bad][0]) + " out of bounds. It should be >= 0 and < " + str(SPM_NLINES) + ".")
+            return lines[:, None]*SPM_NWORDS + words
+
+        def step(data, rows):
+            # IMPORTANT: First mem op
+            if mem_op == 1: # LOAD
+                data[rows, mem_first:mem_first+mem_size] = data[rows[:, None], get_lines(data, rows)[:, :mem_size]]
+            elif mem_op == 2: # STORE
+                spm_line = np.zeros((len(rows), SPM_NWORDS), dtype=np.int64)
+                spm_line[:, :mem_size] = wrap32(data[rows, mem_first:mem_first+mem_size])
+                data[rows[:, None], get_lines(data, rows)] = spm_line
+            elif mem_op == 3: # SHUFFLE
+                # VWRs A and B are consecutive
+                data[rows, vwr_c:vwr_c+N_ELEMS_PER_VWR] = data[rows, vwr_a:vwr_a+2*N_ELEMS_PER_VWR][:, shuffle]
+            res = alu_fn(get_a(data, rows), get_b(data, rows))
+            data[rows, new_res_col] = res
+            if rf_we == 1:
+                data[rows, rf_col] = res
+        return step
+
+    def compile_rcs(self, pc, ctrls):
+        '''Step of the RCs of all the used columns, see RC_ARRAY.compile. None if all of them are NOPs without
+        register writes'''
+        srcs = []       # Column of each mux input of the active RCs, all the muxes A and then all the muxes B
+        vwr_reads = {}  # Positions in srcs of the reads of each VWR, by (col, vwr), and their offsets in the VWR
+        active = []     # Units of the RCs that run an ALU operation
+        ops = {}        # Positions in active of the RCs of each operation
+        flag_cols = []  # Column of the flag that each active RC reads (only used by SFGA and ZFGA)
+        rf_src = []
+        rf_dst = []
+        a_srcs = []
+        b_srcs = []
+        error = None
+        for col in self.cols:
+            for row in range(CGRA_ROWS):
+                unit = self.rc(col, row)
+                rc = self.disco_cgra.rcs[col][row]
+                rf_wsel, rf_we, muxf_sel, alu_op, op_mode, muxb_sel, muxa_sel = rc.imem.fields[pc].tolist()
+                if rf_we == 1:
+                    rf_src.append(self.new_res(unit))
+                    rf_dst.append(self.reg(unit, rf_wsel))
+                if alu_op == 0 or error is not None: # NOP, it does not use the muxes
+                    continue
+                mux_srcs = []
+                for mux, mux_list in ((muxa_sel, a_srcs), (muxb_sel, b_srcs)):
+                    if mux <= 2: # VWR_A, VWR_B or VWR_C
+                        offset = int(SPM_NWORDS/CGRA_ROWS)*row
+                        vwr_reads.setdefault((col, mux), []).append((mux_list, len(mux_list), offset))
+                        mux_list.append(self.vwr(col, mux) + offset)
+                    elif mux == 3: # SRF
+                        mux_list.append(self.srf(col, ctrls[col].srf_sel))
+                    elif mux <= 5: # R0 or R1
+                        mux_list.append(self.reg(unit, mux - 4))
+                    elif mux <= 9: # RCT, RCB, RCL or RCR
+                        mux_list.append(self.res(self.alu_unit[id(rc.neighbours[mux-6])]))
+                    elif mux <= 13: # ZERO, ONE, MAX_INT or MIN_INT
+                        mux_list.append(self.const_base + mux - 10)
+                    else:
+                        error = Exception("RC: Mux value not recognized")
+                if (alu_op == 11 or alu_op == 12) and muxf_sel > 4:
+                    error = IndexError("list index out of range")
+                if error is not None:
+                    continue
+                op = RC_ARRAY_OP_NAMES[alu_op, op_mode]
+                ops.setdefault(op, []).append(len(active))
+                active.append(unit)
+                flag_unit = unit if muxf_sel == 0 or op not in ("sfga", "zfga") else self.alu_unit[id(rc.neighbours[muxf_sel-1])]
+                flag_cols.append(self.flag(flag_unit, op == "zfga"))
+        if error is not None:
+            return failing(error)
+        if not active and not rf_src:
+            return None
+        n_active = len(active)
+        ab_cols = np.array(a_srcs + b_srcs, dtype=np.int64)
+        # Positions in ab_cols and offsets in the VWR of the reads of each VWR, with the MXCU registers of its index
+        vwr_reads = [(np.array([pos + (n_active if mux_list is b_srcs else 0) for mux_list, pos, offset in reads], dtype=np.int64),
+                      np.array([offset for mux_list, pos, offset in reads], dtype=np.int64),
+                      self.reg(self.mxcu(col), 0), self.reg(self.mxcu(col), 5 + vwr))
+                     for (col, vwr), reads in vwr_reads.items()]
+        groups = []
+        for op, positions in ops.items():
+            groups.append((self.compile_rc_op(op, [flag_cols[pos] for pos in positions], [self.reg(active[pos], 0) for pos in positions]),
+                           contiguous(positions)))
+        new_res_cols = np.array([self.new_res(unit) for unit in active], dtype=np.int64)
+        rf_src = np.array(rf_src, dtype=np.int64)
+        rf_dst = np.array(rf_dst, dtype=np.int64)
+
+        def step(data, rows):
+            grid = rows[:, None]
+            if n_active:
+                # All the mux inputs of this pc in one gather, the VWR words at the index of each instance
+                cols = ab_cols
+                if vwr_reads:
+                    cols = np.repeat(ab_cols[None, :], len(rows), axis=0)
+                    for positions, offsets, r0_col, mask_col in vwr_reads:
+                        slice_idx = (data[rows, r0_col] & data[rows, mask_col])[:, None]
+                        idx = slice_idx + offsets
+                        bad = (idx < 0) | (idx >= N_ELEMS_PER_VWR)
+                        if bad.any():
+                            raise Exception("The indexed accesed " + str(idx[bad][0]) + " should be >= 0 and < " + str(N_ELEMS_PER_VWR) + ".")
+                        cols[:, positions] += slice_idx
+                ab = data[grid, cols]
+                a = ab[:, :n_active]
+                b = ab[:, n_active:]
+                new_res = np.empty((len(rows), n_active), dtype=np.int64)
+                for run_op, positions in groups:
+                    new_res[:, positions] = run_op(data, grid, a[:, positions], b[:, positions])
+                data[grid, new_res_cols] = new_res
+            # Write results locally
+            if rf_dst.size:
+                data[grid, rf_dst] = data[grid, rf_src]
+        return step
+
+    def compile_rc_op(self, op, flag_cols, r0_cols):
+        '''Get the function of the data, the rows (as a column) and the operands of a group of RCs that returns the
+        results of an ALU operation, see RC_ARRAY.compile_op. flag_cols are the columns of the flags that SFGA and
+        ZFGA read, and r0_cols the columns of the R0 of the RCs, read by MAC'''
+        if op == "sfga" or op == "zfga":
+            flag_cols = np.array(flag_cols, dtype=np.int64)
+            return lambda data, grid, a, b: np.where(data[grid, flag_cols] != 0, a, b)
+        if op == "mac" or op == "mach":
+            mac = RC_ARRAY_OPS[op]
+            r0_cols = np.array(r0_cols, dtype=np.int64)
+            return lambda data, grid, a, b: mac(a, b, None, data[grid, r0_cols])
+        if op in RC_ARRAY_OPS:
+            array_op = RC_ARRAY_OPS[op]
+            return lambda data, grid, a, b: array_op(a, b, None, None)
+        if op == "mul_fp": # Not implemented yet, see ALU.mul_fp
+            return lambda data, grid, a, b: np.zeros(a.shape, dtype=np.int64)
+        # Operations that fail or are not vectorized (the divisions), run them one by one on an ALU
+        def scalar_op(data, grid, a, b):
+            alu = ALU()
+            res = np.zeros(a.shape, dtype=np.int64)
+            for pos in np.ndindex(a.shape):
+                getattr(alu, op)(int(a[pos]), int(b[pos]))
+                res[pos] = alu.newRes
+            return res
+        return scalar_op
+
+    def compile_mxcu(self, pc, col, ctrl):
+        '''Step of the MXCU of a column, see MXCU.run'''
+        rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel = self.disco_cgra.mxcus[col].imem.fields[pc, 5:].tolist()
+        unit = self.mxcu(col)
+        constants = { 9: 0, 10: 1, 11: 2, 12: int(SPM_NWORDS/CGRA_ROWS/2) -1, 13: int(SPM_NWORDS/CGRA_ROWS) -1 } # ZERO, ONE, TWO, HALF, LAST
+        muxes = []
+        for mux in (muxa_sel, muxb_sel):
+            if mux <= 7: # Rx
+                muxes.append(self.reader(self.reg(unit, mux)))
+            elif mux == 8: # SRF
+                muxes.append(self.reader(self.srf(col, ctrl.srf_sel)))
+            elif mux in constants:
+                muxes.append(self.reader(value=constants[mux]))
+            else:
+                return failing(Exception("MXCU: Mux value not recognized"))
+        get_a, get_b = muxes
+        if alu_op >= len(MXCU_ALU_METHODS):
+            return failing(Exception("MXCU: ALU op not recognized"))
+        alu_fn = None if alu_op == 0 else UNIT_ALU_OPS[MXCU_ALU_METHODS[alu_op]]
+        vwr_sel = ctrl.vwr_sel
+        if ctrl.vwr_row_we and vwr_sel >= N_VWR_PER_COL:
+            return failing(IndexError("list index out of range"))
+        new_res_col = self.new_res(unit)
+        rf_col = self.reg(unit, rf_wsel)
+        # SRF store control: the ALU whose result is written
+        srf_col = self.srf(col, ctrl.srf_sel)
+        srf_source = None
+        if ctrl.srf_we == 1:
+            srf_source = self.new_res([self.lcu(col), self.rc(col, 0), unit, self.lsu(col)][ctrl.alu_srf_write]) # LCU, RC0, MXCU or LSU
+        # VWR store control: the offsets in the VWR of the rows written and the results of their RCs
+        vwr_first = self.vwr(col, vwr_sel) if vwr_sel < N_VWR_PER_COL else 0
+        r0_col = self.reg(unit, 0) # VWR_IDX
+        mask_col = self.reg(unit, 5 + vwr_sel) if vwr_sel < N_VWR_PER_COL else 0 # R5, 6 or 7 for VWR_A, B or C
+        vwr_rows = [row for row in range(CGRA_ROWS) if (ctrl.vwr_row_we >> row) & 1]
+        vwr_offsets = np.array([int(SPM_NWORDS/CGRA_ROWS)*row for row in vwr_rows], dtype=np.int64)
+        rc_cols = np.array([self.new_res(self.rc(col, row)) for row in vwr_rows], dtype=np.int64)
+
+        def step(data, rows):
+            if alu_fn is not None:
+                data[rows, new_res_col] = alu_fn(get_a(data, rows), get_b(data, rows))
+            if srf_source is not None:
+                data[rows, srf_col] = data[rows, srf_source]
+            if vwr_rows:
+                grid = rows[:, None]
+                idx = (data[rows, r0_col] & data[rows, mask_col])[:, None] + vwr_offsets
+                # Indexed as the int32 array of the VWR
+                bad = (idx < -N_ELEMS_PER_VWR) | (idx >= N_ELEMS_PER_VWR)
+                if bad.any():
+                    raise IndexError("index " + str(idx[bad][0]) + " is out of bounds for axis 0 with size " + str(N_ELEMS_PER_VWR))
+                data[grid, vwr_first + idx % N_ELEMS_PER_VWR] = wrap32(data[grid, rc_cols])
+            if rf_we == 1:
+                data[rows, rf_col] = data[rows, new_res_col]
+        return step
+
+    def compile_lcu(self, pc, col, ctrl):
+        '''Step of the LCU of a column, see LCU.run'''
+        imm, rf_wsel, rf_we, alu_op, br_mode, muxb_sel, muxa_sel = self.disco_cgra.lcus[col].imem.fields[pc].tolist()
+        unit = self.lcu(col)
+        bgepd = alu_op == 11 # Especial case BGEPD
+        muxes = []
+        for mux, muxA in ((muxa_sel, True), (muxb_sel, False)):
+            dec = 1 if bgepd and muxA else 0 # BGEPD decrements muxA
+            if mux <= 3: # Rx
+                muxes.append(self.reader(self.reg(unit, mux), dec=dec))
+            elif mux == 4: # SRF
+                muxes.append(self.reader(self.srf(col, ctrl.srf_sel), dec=dec))
+            elif mux == 5: # LAST
+                muxes.append(self.reader(value=int(SPM_NWORDS/CGRA_ROWS) -1, dec=dec))
+            elif mux == 6: # ZERO
+                muxes.append(self.reader(value=0, dec=dec))
+            elif mux == 7: # IMM or ONE
+                muxes.append(self.reader(value=imm if muxA else 1, dec=dec))
+            else:
+                return failing(Exception("LCU: Mux value not recognized"))
+        get_a, get_b = muxes
+        if alu_op > 14:
+            return failing(Exception("LCU: ALU op not recognized"))
+        new_res_col = self.new_res(unit)
+        rf_col = self.reg(unit, rf_wsel)
+        branch_col = self.branch(col)
+        branch_pc_col = self.branch_pc(col)
+        exit_col = self.exit(col)
+        rc_cols = np.array([self.new_res(self.rc(col, row)) for row in range(CGRA_ROWS)], dtype=np.int64)
+        if alu_op <= 8: # NOP, SADD, SSUB, SLL, SRL, SRA, LAND, LOR or LXOR
+            alu_fn = None if alu_op == 0 else UNIT_ALU_OPS[LCU_ALU_METHODS[alu_op]]
+            def execute(data, rows):
+                data[rows, branch_col] = 0
+                if alu_fn is not None:
+                    data[rows, new_res_col] = alu_fn(get_a(data, rows), get_b(data, rows))
+        elif alu_op <= 12: # BEQ, BNE, BGEPD or BLT
+            def execute(data, rows):
+                muxa_val = get_a(data, rows)
+                muxb_val = get_b(data, rows)
+                if br_mode == 0:
+                    res = wrap32(muxa_val - muxb_val)
+                    data[rows, new_res_col] = res
+                    equal = res == 0
+                    greater = res > 0
+                else: # Get the flags from the rcs
+                    rc_res = data[rows[:, None], rc_cols]
+                    equal = (rc_res == 0).any(axis=1)
+                    greater = (rc_res > 0).any(axis=1)
+                taken = [equal, ~equal, greater | equal, ~(greater | equal)][alu_op-9]
+                data[rows, branch_col] = taken
+                taken_rows = rows[taken]
+                data[taken_rows, branch_pc_col] = imm
+                if bgepd:
+                    data[taken_rows, new_res_col] = wrap32(muxa_val[taken]) # The ALU result is the decrement that it is already in muxA
+        elif alu_op == 13: # JUMP
+            def execute(data, rows):
+                data[rows, branch_col] = 1
+                data[rows, branch_pc_col] = get_b(data, rows) + get_a(data, rows)
+        else: # EXIT
+            def execute(data, rows):
+                data[rows, branch_col] = 0
+                data[rows, exit_col] = 1
+        if rf_we == 1:
+            def step(data, rows):
+                execute(data, rows)
+                data[rows, rf_col] = data[rows, new_res_col]
+            return step
+        return execute
@@ -0,0 +1,265 @@
+"""benchmark.py: Throughput of the simulator itself on a fixed set of kernels of the kernels/ directory"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+
+import numpy as np
+
+from .params import *
+from .simulator import SIMULATOR, ENGINES
+from .trace import TRACE_LEVEL, LIST_SINK
+from .regression import KERNELS_DIR, discover_kernels, default_manifest, case_inputs
+
+# Change it when the measures or the layout of the report change, so that reports are only compared to reports
+# of the same version
+BENCHMARK_VERSION = 2
+
+# Kernels of the benchmark, each one runs the first case of its manifest (its inputs are fixed by the manifest)
+BENCHMARK_KERNELS = ("add_vectors", "mmul", "fft", "mf_q64_erosion", "median_32", "fir_filter_2_col", "mean_64")
+
+# Instances of each kernel in the batch that the "numpy" engine runs in lockstep (see SIMULATOR.run_batch)
+BENCHMARK_BATCH = 64
+
+# The report is a JSON object:
+#
+#     {
+#         "version": 2, "python": "3.11.4", "numpy": "2.0.0", "machine": "x86_64", "repeat": 5, "engines": ["jit"],
+#         "grid": [4, 2],                          # CGRA_ROWS and CGRA_COLS
+#         "results": [
+#             {
+#                 "kernel": "mmul", "case": "autogen", "version": "_autogen", "cycles": 52, "error": null,
+#                 "construct_time": 0.05,          # SIMULATOR()
+#                 "kernel_load_time": 0.01,        # kernel_load of the hex file
+#                 "engines": {
+#                     "jit": {
+#                         "first_run_time": 0.02,  # Includes the translation of the kernel
+#                         "run_time": 0.001,       # Median of the repeated runs
+#                         "cycles_per_second": 52000.0
+#                     }
+#                 },
+#                 "numpy_batch": {                 # Only when the "numpy" engine is measured
+#                     "instances": 64,             # All of them with the inputs of the case
+#                     "run_time": 0.05,            # run_batch of all the instances
+#                     "cycles_per_second": 66560.0, # Cycles of all the instances per second
+#                     "speedup_over_interpreter": 4.2, # Over the cycles per second of the "interpreter" engine, if measured
+#                     "error": null
+#                 },
+#                 "hex_to_asm": {"instructions": 11, "time": 0.01, "instructions_per_second": 1100.0, "error": null},
+#                 "asm_to_hex": {"instructions": 11, "time": 0.02, "instructions_per_second": 550.0, "error": null},
+#                 "peak_memory": 1234567           # Bytes allocated by Python at most while building, loading and running
+#             }
+#         ],
+#         "max_rss": 123456                        # Peak resident memory of the process, in KiB
+#     }
+#
+# Times are in seconds. Every measure is the median of repeat measures.
+
+def median_time(function, repeat):
+    '''Median wall time of repeat calls to function, in seconds'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+def rate(n, seconds):
+    '''n per second, None if it cannot be measured'''
+    return n/seconds if seconds > 0 else None
+
+def load_case(kernels_dir, kernel, case):
+    '''Build a simulator with the kernel of a case loaded and the inputs of the case in the SPM'''
+    sim = SIMULATOR()
+    sim.kernel_config(case["column_usage"], case["num_instructions_per_col"], case["imem_add_start"], case["srf_spm_address"], 1)
+    sim.loadSPMData(case_inputs(case))
+    sim.kernel_load(os.path.join(kernels_dir, kernel) + "/", version=case["version"], kernel_number=1)
+    return sim
+
+def bench_engines(kernels_dir, kernel, case, engines, repeat):
+    '''Number of cycles of a case, its error (None if it does not fail) and the run times of each engine. Every run
+    starts from the state after loading the case'''
+    max_iter = case.get("max_iter", 1500)
+    sim = load_case(kernels_dir, kernel, case)
+    snap = sim.snapshot()
+    cycles = None
+    error = None
+    times = {}
+    for engine in engines:
+        sink = LIST_SINK()
+        def run(trace_level=TRACE_LEVEL.NONE):
+            sim.restore(snap)
+            sim.run(1, max_iter=max_iter, trace_level=trace_level, trace_sink=sink, engine=engine)
+        try:
+            # The summary event of the first run gives the number of cycles
+            first_run_time = median_time(lambda: run(TRACE_LEVEL.SUMMARY), 1)
+            run_time = median_time(run, repeat)
+        except Exception as e:
+            error = type(e).__name__ + ": " + str(e)
+            break
+        cycles = sink.events[-1].cycle
+        times[engine] = { "first_run_time": first_run_time, "run_time": run_time, "cycles_per_second": rate(cycles, run_time) }
+    return cycles, error, times
+
+def bench_batch(kernels_dir, kernel, case, repeat, n=BENCHMARK_BATCH):
+    '''Run time of run_batch on the "numpy" engine for n instances of a case, all of them with the inputs of the
+    case so that they run in lockstep from the first to the last cycle. Every run starts from the state after
+    loading the case'''
+    sim = load_case(kernels_dir, kernel, case)
+    snap = sim.snapshot()
+    spm_batch = np.repeat(sim.disco_cgra.spm.lines[None], n, axis=0)
+    result = { "instances": n, "run_time": None, "cycles_per_second": None, "error": None }
+    cycles = None
+    def run():
+        nonlocal cycles
+        sim.restore(snap)
+        cycles = sim.run_batch(1, spm_batch, max_iter=case.get("max_iter", 1500), engine="numpy")[1]
+    try:
+        result["run_time"] = median_time(run, repeat)
+        result["cycles_per_second"] = rate(int(cycles.sum()), result["run_time"])
+    except Exception as e:
+        result["error"] = type(e).__name__ + ": " + str(e)
+    return result
+
+def bench_assembler(kernels_dir, kernel, case, repeat):
+    '''Times of compileHexToAsm on the hex file of a case and of compileAsmToHex on the asm file it writes. Both
+    write files in the kernel directory, so they run on a copy of it'''
+    results = {}
+    n_cols = sum(1 for used in case["column_usage"] if used)
+    with tempfile.TemporaryDirectory() as tmp:
+        kernel_path = os.path.join(tmp, kernel) + "/"
+        shutil.copytree(os.path.join(kernels_dir, kernel), kernel_path)
+        with open(kernel_path + "instructions_hex" + case["version"] + ".csv") as f:
+            n_hex = sum(1 for _ in f) - 1
+        sim = SIMULATOR()
+        sim.kernel_config(case["column_usage"], case["num_instructions_per_col"], case["imem_add_start"], case["srf_spm_address"], 1)
+        steps = (("hex_to_asm", n_hex, lambda: sim.compileHexToAsm(kernel_path, version=case["version"])),
+                 ("asm_to_hex", n_cols*case["num_instructions_per_col"], lambda: sim.compileAsmToHex(kernel_path, 1, version=case["version"])))
+        for name, n_instr, step in steps:
+            result = { "instructions": n_instr, "time": None, "instructions_per_second": None, "error": None }
+            try:
+                result["time"] = median_time(step, repeat)
+                result["instructions_per_second"] = rate(n_instr, result["time"])
+            except Exception as e:
+                result["error"] = type(e).__name__ + ": " + str(e)
+            results[name] = result
+    return results
+
+def peak_memory(kernels_dir, kernel, case, engine):
+    '''Bytes allocated by Python at most while building the simulator, loading a case and running it'''
+    tracemalloc.start()
+    try:
+        sim = load_case(kernels_dir, kernel, case)
+        sim.run(1, max_iter=case.get("max_iter", 1500), engine=engine)
+    except Exception:
+        pass # The error is reported by bench_engines
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def bench_case(kernels_dir, kernel, case, engines=ENGINES, repeat=5):
+    '''Measure one case of a kernel. Return its entry of the report'''
+    kernel_path = os.path.join(kernels_dir, kernel) + "/"
+    result = { "kernel": kernel, "case": case["name"], "version": case["version"] }
+    result["construct_time"] = median_time(SIMULATOR, repeat)
+    sim = SIMULATOR()
+    sim.kernel_config(case["column_usage"], case["num_instructions_per_col"], case["imem_add_start"], case["srf_spm_address"], 1)
+    result["kernel_load_time"] = median_time(lambda: sim.kernel_load(kernel_path, version=case["version"], kernel_number=1), repeat)
+    result["cycles"], result["error"], result["engines"] = bench_engines(kernels_dir, kernel, case, engines, repeat)
+    if "numpy" in engines:
+        batch = bench_batch(kernels_dir, kernel, case, repeat)
+        interpreter = result["engines"].get("interpreter")
+        if interpreter is not None and batch["cycles_per_second"] and interpreter["cycles_per_second"]:
+            batch["speedup_over_interpreter"] = batch["cycles_per_second"]/interpreter["cycles_per_second"]
+        result["numpy_batch"] = batch
+    result.update(bench_assembler(kernels_dir, kernel, case, repeat))
+    result["peak_memory"] = peak_memory(kernels_dir, kernel, case, engines[0])
+    return result
+
+def run_benchmark(kernels_dir=KERNELS_DIR, kernels=BENCHMARK_KERNELS, engines=ENGINES, repeat=5):
+    '''Measure the first case of the manifest of each kernel (one is made with the regression defaults if there is
+    none). Return the report'''
+    for engine in engines:
+        if engine not in ENGINES:
+            raise ValueError("Engine not recognized: " + str(engine) + ". It should be one of " + str(ENGINES) + ".")
+    available = { name: (versions, manifest) for name, versions, manifest in discover_kernels(kernels_dir) }
+    results = []
+    for kernel in kernels:
+        if kernel not in available:
+            raise ValueError("Kernel not found in " + kernels_dir + ": " + kernel)
+        versions, manifest = available[kernel]
+        if manifest is None:
+            manifest = default_manifest(kernels_dir, kernel, versions)
+        # The simulator prints the files it loads and other messages, keep the report clean
+        with contextlib.redirect_stdout(io.StringIO()):
+            results.append(bench_case(kernels_dir, kernel, manifest["cases"][0], engines, repeat))
+    max_rss = None
+    if sys.platform != "win32":
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return { "version": BENCHMARK_VERSION, "python": platform.python_version(), "numpy": np.__version__,
+             "machine": platform.machine(), "repeat": repeat, "engines": list(engines), "grid": [CGRA_ROWS, CGRA_COLS],
+             "results": results, "max_rss": max_rss }
+
+def compare(report, baseline):
+    '''Lines with the speed-up of each measure of a report over a baseline report (> 1 is faster)'''
+    if baseline.get("version") != report["version"]:
+        return ["Baseline of benchmark version " + str(baseline.get("version")) + ", not " + str(report["version"]) + ". Not compared."]
+    old_results = { (r["kernel"], r["case"]): r for r in baseline["results"] }
+    lines = []
+    for result in report["results"]:
+        old = old_results.get((result["kernel"], result["case"]))
+        if old is None:
+            continue
+        measures = [("construct", result["construct_time"], old["construct_time"]),
+                    ("kernel_load", result["kernel_load_time"], old["kernel_load_time"])]
+        for engine, times in result["engines"].items():
+            if engine in old["engines"]:
+                measures.append((engine, times["run_time"], old["engines"][engine]["run_time"]))
+        if "numpy_batch" in result and "numpy_batch" in old:
+            measures.append(("numpy_batch", result["numpy_batch"]["run_time"], old["numpy_batch"]["run_time"]))
+        for step in ("hex_to_asm", "asm_to_hex"):
+            measures.append((step, result[step]["time"], old[step]["time"]))
+        speedups = [name + " x" + "{:.2f}".format(old_time/new_time) for name, new_time, old_time in measures if new_time and old_time]
+        lines.append(result["kernel"] + " (" + str(result["case"]) + "): " + ", ".join(speedups))
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the throughput of the DISCO-CGRA simulator on a fixed set of kernels.")
+    parser.add_argument("kernels", nargs="*", help="Names of the kernels to measure (default: " + ", ".join(BENCHMARK_KERNELS) + ")")
+    parser.add_argument("--kernels-dir", default=KERNELS_DIR, help="Directory of the kernels")
+    parser.add_argument("--engine", action="append", choices=ENGINES, help="Engine of SIMULATOR.run, can be repeated (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of measures of which the median is taken")
+    parser.add_argument("--report", default=None, help="Write the JSON report to this file (default: standard output)")
+    parser.add_argument("--baseline", default=None, help="JSON report of an earlier run to compare with")
+    args = parser.parse_args(argv)
+    report = run_benchmark(args.kernels_dir, tuple(args.kernels) or BENCHMARK_KERNELS, tuple(args.engine or ENGINES), args.repeat)
+    if args.report is None:
+        json.dump(report, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+    else:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+    for result in report["results"]:
+        if result["error"] is not None:
+            print(result["kernel"] + " (" + str(result["case"]) + "): " + result["error"], file=sys.stderr)
+        elif "speedup_over_interpreter" in result.get("numpy_batch", {}):
+            print(result["kernel"] + " (" + str(result["case"]) + "): numpy batch of " + str(result["numpy_batch"]["instances"]) + " x" +
+                  "{:.2f}".format(result["numpy_batch"]["speedup_over_interpreter"]) + " cycles per second over the interpreter", file=sys.stderr)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for line in compare(report, baseline):
+            print(line, file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
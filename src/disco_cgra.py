@@ -1,11 +1,24 @@
 
 # Imports
-from src import *
+import numpy as np
 from .params import *
+from .lcu import LCU
+from .lsu import LSU
+from .mxcu import MXCU
+from .rc import RC
+from .kmem import KMEM, KER_CONF_N_REG, KMEM_IMEM_WIDTH
+from .imem import IMEM, IMEM_N_LINES
 from .spm import SPM
 from .srf import SRF
 from .vwr import VWR
 
+# Version of the layout of CGRA.snapshot, part of its header so that restore rejects other layouts
+SNAPSHOT_VERSION = 1
+
+def snapshot_header():
+    '''First values of a snapshot: its version and the sizes of the CGRA it was taken from'''
+    return [SNAPSHOT_VERSION, CGRA_ROWS, CGRA_COLS, N_VWR_PER_COL, SPM_NLINES, SPM_NWORDS, N_ELEMS_PER_VWR, IMEM_N_LINES, KER_CONF_N_REG]
+
 class CGRA:
     def __init__(self):
         self.lcus = [LCU() for _ in range(CGRA_COLS)]
@@ -43,28 +56,171 @@ class CGRA:
         for col in range(CGRA_COLS):
             for _ in range(N_VWR_PER_COL):
                 self.vwrs[col].append(VWR())
+        # All the ALUs, whose result and flags are updated at the end of each cycle
+        self.alus = []
+        for col in range(CGRA_COLS):
+            self.alus += [self.lcus[col].alu, self.lsus[col].alu, self.mxcus[col].alu]
+            self.alus += [self.rcs[col][row].alu for row in range(CGRA_ROWS)]
+
+    def get_units(self):
+        '''Units with registers, ALU and IMEM, in the order of get_state and snapshot: LCUs, LSUs, MXCUs and RCs'''
+        units = [self.lcus[col] for col in range(CGRA_COLS)] + [self.lsus[col] for col in range(CGRA_COLS)]
+        units += [self.mxcus[col] for col in range(CGRA_COLS)]
+        units += [self.rcs[col][row] for col in range(CGRA_COLS) for row in range(CGRA_ROWS)]
+        return units
+
+    def get_state(self):
+        '''Copy of the data that running a kernel changes: SPM, VWRs, SRFs, registers, ALUs and LCU branch and exit'''
+        units = self.get_units()
+        return {
+            "spm": self.spm.lines.copy(),
+            "vwrs": [[vwr.values.copy() for vwr in self.vwrs[col]] for col in range(CGRA_COLS)],
+            "srfs": [list(self.srfs[col].regs) for col in range(CGRA_COLS)],
+            "regs": [list(unit.regs) for unit in units],
+            "alus": [[unit.alu.res, unit.alu.newRes, unit.alu.zero_flag, unit.alu.sign_flag] for unit in units],
+            "lcus": [[lcu.exit, lcu.branch, lcu.branch_pc] for lcu in self.lcus],
+        }
+
+    def set_state(self, state):
+        '''Go back to a state given by get_state'''
+        units = self.get_units()
+        # In place, the compiled instructions keep references to the SPM, VWRs and registers
+        np.copyto(self.spm.lines, state["spm"])
+        for col in range(CGRA_COLS):
+            for vwr, values in zip(self.vwrs[col], state["vwrs"][col]):
+                np.copyto(vwr.values, values)
+            self.srfs[col].regs[:] = state["srfs"][col]
+        for unit, regs, alu in zip(units, state["regs"], state["alus"]):
+            unit.regs[:] = regs
+            unit.alu.res, unit.alu.newRes, unit.alu.zero_flag, unit.alu.sign_flag = alu
+        for lcu, (exit, branch, branch_pc) in zip(self.lcus, state["lcus"]):
+            lcu.exit = exit
+            lcu.branch = branch
+            lcu.branch_pc = branch_pc
+
+    def get_data(self):
+        '''The data of get_state in one int64 array: SPM, VWRs, SRFs, registers, ALU results and flags (res, newRes,
+        zero_flag, sign_flag of each unit) and LCU exit, branch and branch_pc'''
+        units = self.get_units()
+        parts = [self.spm.lines.ravel()]
+        parts += [vwr.values for col in range(CGRA_COLS) for vwr in self.vwrs[col]]
+        parts += [np.array(self.srfs[col].regs, dtype=np.int64) for col in range(CGRA_COLS)]
+        parts += [np.array(unit.regs, dtype=np.int64) for unit in units]
+        parts.append(np.array([[unit.alu.res, unit.alu.newRes, unit.alu.zero_flag, unit.alu.sign_flag] for unit in units], dtype=np.int64).ravel())
+        parts.append(np.array([[lcu.exit, lcu.branch, lcu.branch_pc] for lcu in self.lcus], dtype=np.int64).ravel())
+        return np.concatenate(parts).astype(np.int64, copy=False)
+
+    def set_data(self, data):
+        '''Go back to the data given by get_data'''
+        units = self.get_units()
+        pos = 0
+        def take(n):
+            nonlocal pos
+            pos += n
+            return data[pos-n:pos]
+        # In place, the compiled instructions keep references to the SPM, VWRs and registers
+        np.copyto(self.spm.lines, take(self.spm.lines.size).reshape(self.spm.lines.shape), casting="unsafe")
+        for col in range(CGRA_COLS):
+            for vwr in self.vwrs[col]:
+                np.copyto(vwr.values, take(len(vwr.values)), casting="unsafe")
+        for col in range(CGRA_COLS):
+            self.srfs[col].regs[:] = take(len(self.srfs[col].regs)).tolist()
+        for unit in units:
+            unit.regs[:] = take(len(unit.regs)).tolist()
+        for unit, alu in zip(units, take(4*len(units)).reshape(-1, 4).tolist()):
+            unit.alu.res, unit.alu.newRes, unit.alu.zero_flag, unit.alu.sign_flag = alu
+        for lcu, (exit, branch, branch_pc) in zip(self.lcus, take(3*len(self.lcus)).reshape(-1, 3).tolist()):
+            lcu.exit = exit
+            lcu.branch = branch
+            lcu.branch_pc = branch_pc
+
+    def reset(self, keep_imem=True, keep_spm=False):
+        '''Go back to the state of a new CGRA: zero the VWRs, SRFs, registers, ALUs and LCU branch and exit, and the
+        SPM unless keep_spm. The IMEMs and the KMEM, with the loaded kernels, are kept unless keep_imem is False'''
+        # In place, the compiled instructions keep references to the SPM, VWRs and registers
+        if not keep_spm:
+            self.spm.lines.fill(0)
+        for col in range(CGRA_COLS):
+            for vwr in self.vwrs[col]:
+                vwr.values.fill(0)
+            self.srfs[col].regs[:] = [0]*len(self.srfs[col].regs)
+        for unit in self.get_units():
+            unit.regs[:] = [0]*len(unit.regs)
+            unit.alu.res, unit.alu.newRes, unit.alu.zero_flag, unit.alu.sign_flag = 0, 0, 0, 0
+        for lcu in self.lcus:
+            lcu.exit = 0
+            lcu.branch = 0
+            lcu.branch_pc = 0
+        if not keep_imem:
+            for unit in self.get_units():
+                np.copyto(unit.imem.IMEM, type(unit.imem).default_imem)
+                np.copyto(unit.imem.fields, type(unit.imem).default_fields)
+            for words in self.general_imem():
+                words.clear()
+            self.kmem.imem.IMEM[:] = np.binary_repr(0, width=KMEM_IMEM_WIDTH)
+
+    def data_size(self):
+        '''Number of values of get_data'''
+        units = self.get_units()
+        size = self.spm.lines.size + sum(len(vwr.values) for col in range(CGRA_COLS) for vwr in self.vwrs[col])
+        return size + sum(len(srf.regs) for srf in self.srfs) + sum(len(unit.regs) + 4 for unit in units) + 3*len(self.lcus)
+
+    def snapshot(self):
+        '''Every architectural element of the CGRA in one int64 array: a header with SNAPSHOT_VERSION and the sizes
+        of the CGRA, then the data of get_data, the instructions of the IMEM of each unit, the general IMEM and the
+        KMEM. Copying it (or saving it with NumPy) is cheap, restore goes back to it'''
+        parts = [np.array(snapshot_header(), dtype=np.int64), self.get_data()]
+        parts += [np.array([int(word, 2) for word in unit.imem.IMEM], dtype=np.int64) for unit in self.get_units()]
+        parts += [np.array(words.get_ints(), dtype=np.int64) for words in self.general_imem()]
+        parts.append(np.array([int(word, 2) for word in self.kmem.imem.IMEM], dtype=np.int64))
+        return np.concatenate(parts)
+
+    def restore(self, snap):
+        '''Go back to a state given by snapshot. Only the words of the unit IMEMs that changed since then are decoded again'''
+        snap = np.asarray(snap)
+        header = snapshot_header()
+        if snap.ndim != 1 or snap[:len(header)].tolist() != header:
+            raise ValueError("Snapshot not valid for this CGRA. Its header should be " + str(header) + ".")
+        if len(snap) != self.snapshot_size():
+            raise ValueError("Snapshot not valid for this CGRA. It has " + str(len(snap)) + " values instead of " + str(self.snapshot_size()) + ".")
+        pos = len(header) + self.data_size()
+        self.set_data(snap[len(header):pos])
+        def take(n):
+            nonlocal pos
+            pos += n
+            return snap[pos-n:pos]
+        for unit in self.get_units():
+            for i, word in enumerate(take(len(unit.imem.IMEM)).tolist()):
+                if int(unit.imem.IMEM[i], 2) != word:
+                    unit.imem.set_word(word, i)
+        for words in self.general_imem():
+            words.set_ints(0, take(len(words)))
+        for i, word in enumerate(take(len(self.kmem.imem.IMEM)).tolist()):
+            self.kmem.imem.IMEM[i] = np.binary_repr(word, width=KMEM_IMEM_WIDTH)
+
+    def snapshot_size(self):
+        '''Number of values of a snapshot of this CGRA'''
+        size = len(snapshot_header()) + self.data_size() + sum(len(unit.imem.IMEM) for unit in self.get_units())
+        return size + sum(len(words) for words in self.general_imem()) + len(self.kmem.imem.IMEM)
+
+    def general_imem(self):
+        '''IMEM_LINES of the general IMEM, in the order of snapshot'''
+        return [self.imem.lcu_imem, self.imem.lsu_imem, self.imem.mxcu_imem] + self.imem.rcs_imem
 
     def setSPMLine(self, nline, vector):
         self.spm.setLine(nline, vector)
     
-    def loadSPMData(self, data):
-        nline = 0
-        for vector in data:
-            self.spm.setLine(nline, vector)
-            nline+=1
+    def loadSPMData(self, data, first_line=0):
+        '''Copy the lines of data (an array, for example a numpy.memmap, or a list of lists) into the SPM from first_line on'''
+        self.spm.setLines(first_line, data)
     
     def kernel_config(self, col_one_hot, num_instructions_per_col, imem_add_start, srf_spm_addres, kernel_number):
         self.kmem.addKernel(num_instructions_per_col=num_instructions_per_col, imem_add_start=imem_add_start, col_one_hot=col_one_hot, srf_spm_addres=srf_spm_addres, nKernel=kernel_number)
         
     def updateSharedValues(self):
         # ALUs
-        for col in range(CGRA_COLS):
-            self.lcus[col].alu.updateALUValues()
-            self.lsus[col].alu.updateALUValues()
-            self.mxcus[col].alu.updateALUValues()
-            for col in range(CGRA_COLS):
-                for row in range(CGRA_ROWS):
-                    self.rcs[col][row].alu.updateALUValues()
+        for alu in self.alus:
+            alu.updateALUValues()
         # Write on SRF
                     
         # Write on VWRs
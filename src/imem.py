@@ -1,3 +1,4 @@
+import numpy as np
 from .rc import RC_IMEM_WORD
 from .mxcu import MXCU_IMEM_WORD
 from .lsu import LSU_IMEM_WORD
@@ -7,11 +8,78 @@ from .params import CGRA_ROWS
 # Number of lines in the instruction memory (i.e. max number of instrucitons in all kernels)
 IMEM_N_LINES = 512
 
+class IMEM_LINES:
+    '''Words of one specialized slot in the general IMEM, used as a list of word_type objects. Each line is kept
+    as the integer value of its word (ints) and its word object is only built when the line is read. A line
+    written with a word object keeps that object until it is written again'''
+    # Integer value of the default word of each word type
+    default_ints = {}
+
+    def __init__(self, word_type, n_lines=IMEM_N_LINES):
+        self.word_type = word_type
+        self.ints = np.full(n_lines, self.default_int(), dtype=np.int64)
+        self.words = [None]*n_lines
+
+    def default_int(self):
+        '''Integer value of the default word of word_type'''
+        default = IMEM_LINES.default_ints.get(self.word_type)
+        if default is None:
+            default = int(self.word_type().get_word(), 2)
+            IMEM_LINES.default_ints[self.word_type] = default
+        return default
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(len(self.words)))]
+        word = self.words[pos]
+        if word is None:
+            word = self.word_type(hex_word=hex(self.ints[pos]))
+            self.words[pos] = word
+        return word
+
+    def __setitem__(self, pos, word):
+        if isinstance(pos, slice):
+            word = list(word)
+            if len(word) != len(range(*pos.indices(len(self.words)))):
+                raise ValueError("IMEM lines can not be added or removed.")
+        self.words[pos] = word
+
+    def __iter__(self):
+        for pos in range(len(self.words)):
+            yield self[pos]
+
+    def clear(self):
+        '''Set every line back to the default word'''
+        self.ints.fill(self.default_int())
+        self.words[:] = [None]*len(self.words)
+
+    def get_int(self, pos):
+        '''Integer value of the word of line pos, without building its word object'''
+        word = self.words[pos]
+        if word is None:
+            return int(self.ints[pos])
+        return int(word.get_word(), 2)
+
+    def get_ints(self):
+        '''Integer value of the word of each line, without building the word objects'''
+        return [self.get_int(pos) for pos in range(len(self.words))]
+
+    def set_ints(self, start, values):
+        '''Write the integer words of values (an array, for example part of a numpy.memmap) from line start on'''
+        end = start + len(values)
+        if start < 0 or end > len(self.words):
+            raise ValueError("IMEM lines " + str(start) + " to " + str(end - 1) + " out of range.")
+        self.ints[start:end] = values
+        self.words[start:end] = [None]*(end - start)
+
 # GLOBAL INSTRUCTION MEMORY (IMEM) #
 class IMEM:
     '''Instruction memory of the CGRA'''
     def __init__(self):
-        self.lcu_imem = [LCU_IMEM_WORD() for _ in range(IMEM_N_LINES)]
-        self.lsu_imem = [LSU_IMEM_WORD() for _ in range(IMEM_N_LINES)]
-        self.mxcu_imem = [MXCU_IMEM_WORD() for _ in range(IMEM_N_LINES)]
-        self.rcs_imem = [[RC_IMEM_WORD() for _ in range(IMEM_N_LINES)] for _ in range(CGRA_ROWS)]
+        self.lcu_imem = IMEM_LINES(LCU_IMEM_WORD)
+        self.lsu_imem = IMEM_LINES(LSU_IMEM_WORD)
+        self.mxcu_imem = IMEM_LINES(MXCU_IMEM_WORD)
+        self.rcs_imem = [IMEM_LINES(RC_IMEM_WORD) for _ in range(CGRA_ROWS)]
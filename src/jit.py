@@ -0,0 +1,867 @@
+"""jit.py: Translation of a kernel loaded in the DISCO-CGRA into Python source code, compiled once and cached on disk"""
+
+import os
+import sys
+import hashlib
+import marshal
+
+import numpy as np
+
+from .params import *
+from .alu import ALU
+from .rc_array import RC_ARRAY_OPS, RC_ARRAY_OP_NAMES, wrap32
+
+# Change it when the generated code changes, so that older cached kernels are not used any more
+JIT_VERSION = 6
+
+# Directory of the cached kernels, unless another one is given to KERNEL_JIT (set DISCO_CGRA_JIT_CACHE to change it)
+JIT_CACHE_DIR = os.environ.get("DISCO_CGRA_JIT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "disco_cgra", "jit"))
+
+def vwr_index_error(idx):
+    '''Error of an access out of the VWR, as VWR.getIdx raises it'''
+    raise Exception("The indexed accesed " + str(idx) + " should be >= 0 and < " + str(N_ELEMS_PER_VWR) + ".")
+
+# RC operations that a vector loop runs as array operations (see KERNEL_SOURCE.gen_vector_loop). The flag selections
+# read the results of the previous iteration and the rest of operations run on the ALU one by one
+VECTOR_LOOP_OPS = { name for name in RC_ARRAY_OPS if name not in ("sfga", "zfga") }
+
+def vector_loop_apart(distance, stride, n_iter):
+    '''Whether two VWR accesses of a vector loop, at words that are distance apart in the same iteration and advance
+    stride words per iteration, never reach the same word in the same or different iterations'''
+    return distance % stride != 0 or abs(distance) >= stride * n_iter
+
+class KERNEL_JIT:
+    '''Translate the kernel loaded in the IMEMs of the units of a CGRA into one Python function:
+
+            run_kernel(disco_cgra, pc, cycle_number, max_iter) -> pc, cycle_number
+
+       The function runs the cycles of the kernel like SIMULATOR.run does and returns where it stopped. Each basic
+       block of the kernel (the cycles between branches of the LCUs) is straight-line code, and the branches are
+       transitions between blocks. The iterations of a block that loops back to itself are fast-forwarded (see
+       KERNEL_SOURCE.gen_block): skipped in closed form if the loop only counts with registers (see
+       KERNEL_SOURCE.gen_counted_loop), or run as array operations if it walks the VWRs with the MXCU R0 (see
+       KERNEL_SOURCE.gen_vector_loop). The registers and ALU results of the units are local variables, and the VWRs,
+       SRFs and SPM are accessed in place. The state is written back to the CGRA when the function returns,
+       also if the kernel raises an error. If the kernel jumps to a pc out of the kernel, the function returns early
+       and the caller continues with the interpreter.
+
+       The code of a kernel is compiled once and cached in memory and in cache_dir (no disk cache if None), keyed by
+       the hash of the IMEM content of the kernel.
+    '''
+    def __init__(self, cache_dir=JIT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.kernels = {}
+
+    def get_key(self, disco_cgra, ini_col, end_col, n_instr_per_col):
+        '''Hash of everything the generated code depends on: the kernel in the IMEMs of the used columns and the CGRA size'''
+        h = hashlib.sha256()
+        h.update(repr((JIT_VERSION, sys.implementation.cache_tag, CGRA_ROWS, CGRA_COLS, ini_col, end_col, n_instr_per_col)).encode())
+        for col in range(ini_col, end_col+1):
+            units = [disco_cgra.lsus[col]] + disco_cgra.rcs[col] + [disco_cgra.mxcus[col], disco_cgra.lcus[col]]
+            for unit in units:
+                h.update(unit.imem.fields[:n_instr_per_col].tobytes())
+        return h.hexdigest()
+
+    def get_kernel(self, disco_cgra, ini_col, end_col, n_instr_per_col):
+        '''Get the run_kernel function of the kernel loaded in the CGRA, generating and compiling it only if it is not cached'''
+        key = self.get_key(disco_cgra, ini_col, end_col, n_instr_per_col)
+        if key in self.kernels:
+            return self.kernels[key]
+        code = None
+        if self.cache_dir is not None:
+            code_path = os.path.join(self.cache_dir, key + ".code")
+            if os.path.exists(code_path):
+                try:
+                    with open(code_path, "rb") as f:
+                        code = marshal.load(f)
+                except (EOFError, ValueError, TypeError):
+                    code = None # Broken cache entry, generate it again
+        if code is None:
+            source = KERNEL_SOURCE(disco_cgra, ini_col, end_col, n_instr_per_col).generate()
+            code = compile(source, "<disco_cgra_kernel_" + key[:16] + ">", "exec")
+            if self.cache_dir is not None:
+                self.save(key, source, code)
+        namespace = { "ALU": ALU, "vwr_index_error": vwr_index_error, "np": np, "RC_ARRAY_OPS": RC_ARRAY_OPS, "wrap32": wrap32,
+                      "vector_loop_apart": vector_loop_apart }
+        exec(code, namespace)
+        kernel = namespace["run_kernel"]
+        self.kernels[key] = kernel
+        return kernel
+
+    def save(self, key, source, code):
+        '''Write the source (for reference) and the compiled code of a kernel to the cache directory'''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for ext, data in ((".py", source.encode()), (".code", marshal.dumps(code))):
+            path = os.path.join(self.cache_dir, key + ext)
+            tmp_path = path + "." + str(os.getpid()) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path) # Atomic, other processes never see a partial file
+
+class KERNEL_SOURCE:
+    '''Generator of the Python source of the run_kernel function of a kernel (see KERNEL_JIT).
+    The generated code reproduces the units' run() methods, cycle by cycle and unit by unit, in the order of SIMULATOR.run.'''
+    def __init__(self, disco_cgra, ini_col, end_col, n_instr_per_col):
+        self.disco_cgra = disco_cgra
+        self.cols = list(range(ini_col, end_col+1))
+        self.n_instr = n_instr_per_col
+        self.fields = {}
+        for col in self.cols:
+            self.fields["lsu", col] = disco_cgra.lsus[col].imem.fields.tolist()
+            self.fields["mxcu", col] = disco_cgra.mxcus[col].imem.fields.tolist()
+            self.fields["lcu", col] = disco_cgra.lcus[col].imem.fields.tolist()
+            for row in range(CGRA_ROWS):
+                self.fields["rc", col, row] = disco_cgra.rcs[col][row].imem.fields.tolist()
+        # Names of all the ALUs of the CGRA, also of the unused columns since their results can be read by the RCs
+        self.alu_names = {}
+        for col in range(CGRA_COLS):
+            self.alu_names[id(disco_cgra.lcus[col].alu)] = "lcu" + str(col)
+            self.alu_names[id(disco_cgra.lsus[col].alu)] = "lsu" + str(col)
+            self.alu_names[id(disco_cgra.mxcus[col].alu)] = "mxcu" + str(col)
+            for row in range(CGRA_ROWS):
+                self.alu_names[id(disco_cgra.rcs[col][row].alu)] = "rc" + str(col) + "_" + str(row)
+        self.used_alus = set()   # ALUs whose newRes (n_*) is a local variable
+        self.res_alus = set()    # ALUs whose res (r_*) is read by a neighbour RC
+        self.flag_alus = set()   # ALUs whose flags (z_*, s_*) are read by an SFGA/ZFGA
+        for col in self.cols:
+            for name in ("lcu", "lsu", "mxcu"):
+                self.used_alus.add(name + str(col))
+            for row in range(CGRA_ROWS):
+                self.used_alus.add("rc" + str(col) + "_" + str(row))
+
+    # ---------- Operands ----------
+
+    def rc_mux(self, mux, col, row, srf_sel, lines):
+        '''Expression of an RC mux value (see RC.getMuxValue). Statements needed before are added to lines.'''
+        if mux <= 2: # VWR_A, VWR_B or VWR_C
+            idx = "i" + str(mux)
+            lines.append(idx + " = s" + str(col) + "_" + str(mux) + " + " + str(int(SPM_NWORDS/CGRA_ROWS)*row))
+            return "(v" + str(col) + "_" + str(mux) + ".item(" + idx + ") if 0 <= " + idx + " < " + str(N_ELEMS_PER_VWR) + " else vwr_index_error(" + idx + "))"
+        if mux == 3: # SRF
+            return "srf" + str(col) + "[" + str(srf_sel) + "]"
+        if mux == 4 or mux == 5: # R0 or R1
+            return "rc" + str(col) + "_" + str(row) + "_r" + str(mux-4)
+        if mux <= 9: # RCT, RCB, RCL or RCR
+            neighbour = self.alu_names[id(self.disco_cgra.rcs[col][row].neighbours[mux-6])]
+            self.res_alus.add(neighbour)
+            return "r_" + neighbour
+        constants = { 10: 0, 11: 1, 12: MAX_32b, 13: MIN_32b } # ZERO, ONE, MAX_INT, MIN_INT
+        if mux in constants:
+            return str(constants[mux])
+        return None
+
+    def lsu_mux(self, mux, col, srf_sel):
+        '''Expression of an LSU mux value (see LSU.getMuxValue)'''
+        if mux <= 7: # Rx
+            return "lsu" + str(col) + "_r" + str(mux)
+        if mux == 8: # SRF
+            return "srf" + str(col) + "[" + str(srf_sel) + "]"
+        constants = { 9: 0, 10: 1, 11: 2 } # ZERO, ONE, TWO
+        if mux in constants:
+            return str(constants[mux])
+        return None
+
+    def mxcu_mux(self, mux, col, srf_sel):
+        '''Expression of an MXCU mux value (see MXCU.getMuxValue)'''
+        if mux <= 7: # Rx
+            return "mxcu" + str(col) + "_r" + str(mux)
+        if mux == 8: # SRF
+            return "srf" + str(col) + "[" + str(srf_sel) + "]"
+        constants = { 9: 0, 10: 1, 11: 2, 12: int(SPM_NWORDS/CGRA_ROWS/2) -1, 13: int(SPM_NWORDS/CGRA_ROWS) -1 } # ZERO, ONE, TWO, HALF, LAST
+        if mux in constants:
+            return str(constants[mux])
+        return None
+
+    def lcu_mux(self, mux, col, srf_sel, imm, muxA, bgepd):
+        '''Expression of an LCU mux value (see LCU.getMuxValue)'''
+        dec = " - 1" if bgepd and muxA else "" # BGEPD decrements muxA
+        if mux <= 3: # Rx
+            return "(lcu" + str(col) + "_r" + str(mux) + dec + ")"
+        if mux == 4: # SRF
+            return "(srf" + str(col) + "[" + str(srf_sel) + "]" + dec + ")"
+        if mux == 5: # LAST
+            value = int(SPM_NWORDS/CGRA_ROWS) -1
+        elif mux == 6: # ZERO
+            value = 0
+        else: # IMM or ONE
+            if not muxA:
+                return "1"
+            value = imm
+        if dec:
+            value -= 1
+        return str(value)
+
+    # ---------- ALU ----------
+
+    def alu_op(self, op, res, a, b):
+        '''Statements that compute an ALU operation with the same result as the ALU methods'''
+        wrap = lambda expr: "(((" + expr + ") + 0x80000000) & 0xFFFFFFFF) - 0x80000000" # int32(expr)
+        if op == "sadd": return [res + " = " + wrap(a + " + " + b)]
+        if op == "ssub": return [res + " = " + wrap(a + " - " + b)]
+        if op == "land": return [res + " = " + wrap(a + " & " + b)]
+        if op == "lor": return [res + " = " + wrap(a + " | " + b)]
+        if op == "lxor": return [res + " = " + wrap(a + " ^ " + b)]
+        if op == "sll": return [res + " = " + wrap(a + " << (" + b + " & 7)")]
+        if op == "sra": return [res + " = " + wrap(a + " >> (" + b + " & 7)")]
+        if op == "smul": return [res + " = (" + a + " * " + b + ") & " + str(MAX_32b)]
+        # The rest of operations run on a scratch ALU
+        return ["alu.newRes = " + res, "alu." + op + "(" + a + ", " + b + ")", res + " = alu.newRes"]
+
+    def operands(self, a, b, lines):
+        '''Evaluate the operands in order into the locals a and b, unless they are plain names or constants'''
+        names = []
+        for name, expr in (("a", a), ("b", b)):
+            if expr.isidentifier() or expr.lstrip("-").isdigit():
+                names.append(expr)
+            else:
+                lines.append(name + " = " + expr)
+                names.append(name)
+        return names
+
+    # ---------- Units ----------
+
+    def gen_lsu(self, pc, col, ctrl, lines):
+        rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel, vwr_sel_shuf_op, mem_op = self.fields["lsu", col][pc]
+        c = str(col)
+        # IMPORTANT: First mem op
+        if mem_op == 1: # LOAD
+            if vwr_sel_shuf_op < 3: # VWR_A, B or C
+                v = c + "_" + str(vwr_sel_shuf_op)
+                lines.append("v" + v + "[:] = spm.getLine(lsu" + c + "_r7)")
+            else: # SRF, only the first SRF_N_REGS elements
+                lines.append("spm_line = spm.getLine(lsu" + c + "_r7)")
+                lines.append("srf" + c + "[:" + str(SRF_N_REGS) + "] = spm_line[:" + str(SRF_N_REGS) + "].tolist()")
+        elif mem_op == 2: # STORE
+            if vwr_sel_shuf_op < 3: # VWR_A, B or C
+                lines.append("spm.setLine(lsu" + c + "_r7, vwr" + c + "_" + str(vwr_sel_shuf_op) + ".values)")
+            else: # SRF, only the first SRF_N_REGS elements
+                lines.append("spm_line = [0 for _ in range(" + str(SPM_NWORDS) + ")]")
+                lines.append("for i in range(" + str(SRF_N_REGS) + "): spm_line[i] = srf" + c + "[i]")
+                lines.append("spm.setLine(lsu" + c + "_r7, spm_line)")
+        elif mem_op == 3: # SHUFFLE, it only uses the VWRs so run it on the LSU itself
+            lines.append("lsu" + c + ".runMem(3, " + str(vwr_sel_shuf_op) + ", disco_cgra, " + c + ")")
+        a = self.lsu_mux(muxa_sel, col, ctrl.srf_sel)
+        b = self.lsu_mux(muxb_sel, col, ctrl.srf_sel)
+        if a is None or b is None:
+            lines.append("raise Exception(\"LSU: Mux value not recognized\")")
+            return
+        a, b = self.operands(a, b, lines)
+        op = ["land", "lor", "lxor", "sadd", "ssub", "sll", "srl", "bitrev"][alu_op]
+        lines += self.alu_op(op, "n_lsu" + c, a, b)
+        if rf_we == 1:
+            lines.append("lsu" + c + "_r" + str(rf_wsel) + " = n_lsu" + c)
+
+    def gen_rc(self, pc, col, row, ctrl, lines):
+        rf_wsel, rf_we, muxf_sel, alu_op, op_mode, muxb_sel, muxa_sel = self.fields["rc", col, row][pc]
+        name = "rc" + str(col) + "_" + str(row)
+        if alu_op != 0: # A NOP does not use the muxes
+            a = self.rc_mux(muxa_sel, col, row, ctrl.srf_sel, lines)
+            if a is None:
+                lines.append("raise Exception(\"RC: Mux value not recognized\")")
+                return
+            a = self.operands(a, "0", lines)[0]
+            b = self.rc_mux(muxb_sel, col, row, ctrl.srf_sel, lines)
+            if b is None:
+                lines.append("raise Exception(\"RC: Mux value not recognized\")")
+                return
+            b = self.operands("0", b, lines)[1]
+            res = "n_" + name
+            ops = { 1: ("sadd", "saddh"), 2: ("ssub", "ssubh"), 3: ("smul", "smulh"), 4: ("sdiv", "sdivh"), 5: ("sll", "sllh"),
+                    6: ("srl", "srlh"), 7: ("sra", "srah"), 8: ("land", "landh"), 9: ("lor", "lorh"), 10: ("lxor", "lxorh"),
+                    13: ("mul_fp", "mul_fp"), 14: ("div_fp", "div_fp") }
+            if alu_op in ops:
+                lines += self.alu_op(ops[alu_op][1 if op_mode else 0], res, a, b)
+            elif alu_op == 11 or alu_op == 12: # INB_SF_INA or INB_ZF_INA
+                if muxf_sel == 0: # OWN
+                    flags = name
+                elif muxf_sel <= 4:
+                    flags = self.alu_names[id(self.disco_cgra.rcs[col][row].neighbours[muxf_sel-1])]
+                else:
+                    lines.append("raise IndexError(\"list index out of range\")")
+                    return
+                self.flag_alus.add(flags)
+                flag = ("s_" if alu_op == 11 else "z_") + flags
+                lines.append(res + " = " + a + " if " + flag + " else " + b)
+            else: # MAC
+                if op_mode:
+                    lines += ["alu.newRes = " + res, "alu.mach(" + a + ", " + b + ", " + name + "_r0)", res + " = alu.newRes"]
+                else:
+                    lines.append(res + " = ((" + a + " * " + b + " + 0x80000000) & 0xFFFFFFFF) - 0x80000000 + " + name + "_r0")
+        if rf_we == 1:
+            lines.append(name + "_r" + str(rf_wsel) + " = n_" + name)
+
+    def gen_mxcu(self, pc, col, ctrl, lines):
+        rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel = self.fields["mxcu", col][pc][5:]
+        c = str(col)
+        a = self.mxcu_mux(muxa_sel, col, ctrl.srf_sel)
+        b = self.mxcu_mux(muxb_sel, col, ctrl.srf_sel)
+        if a is None or b is None:
+            lines.append("raise Exception(\"MXCU: Mux value not recognized\")")
+            return
+        if alu_op != 0:
+            a, b = self.operands(a, b, lines)
+            op = [None, "sadd", "ssub", "sll", "srl", "land", "lor", "lxor"][alu_op]
+            lines += self.alu_op(op, "n_mxcu" + c, a, b)
+        # SRF store control
+        if ctrl.srf_we == 1:
+            source = ["lcu", "rc" + c + "_0", "mxcu", "lsu"][ctrl.alu_srf_write] # LCU, RC0, MXCU or LSU
+            if source != "rc" + c + "_0":
+                source += c
+            lines.append("srf" + c + "[" + str(ctrl.srf_sel) + "] = n_" + source)
+        # VWR store control
+        if ctrl.vwr_row_we:
+            if ctrl.vwr_sel >= N_VWR_PER_COL:
+                lines.append("raise IndexError(\"list index out of range\")")
+                return
+            v = c + "_" + str(ctrl.vwr_sel)
+            lines.append("slice_idx = mxcu" + c + "_r0 & mxcu" + c + "_r" + str(5 + ctrl.vwr_sel))
+            for row in range(CGRA_ROWS):
+                if (ctrl.vwr_row_we >> row) & 1:
+                    lines.append("v" + v + "[slice_idx + " + str(int(SPM_NWORDS/CGRA_ROWS)*row) + "] = ((n_rc" + c + "_" + str(row) + " + 0x80000000) & 0xFFFFFFFF) - 0x80000000")
+        if rf_we == 1:
+            lines.append("mxcu" + c + "_r" + str(rf_wsel) + " = n_mxcu" + c)
+
+    def gen_lcu(self, pc, col, ctrl, lines):
+        imm, rf_wsel, rf_we, alu_op, br_mode, muxb_sel, muxa_sel = self.fields["lcu", col][pc]
+        c = str(col)
+        res = "n_lcu" + c
+        bgepd = alu_op == 11 # Especial case BGEPD
+        a = self.lcu_mux(muxa_sel, col, ctrl.srf_sel, imm, True, bgepd)
+        b = self.lcu_mux(muxb_sel, col, ctrl.srf_sel, imm, False, bgepd)
+        if alu_op != 13:
+            lines.append("branch_lcu" + c + " = 0")
+        if 1 <= alu_op <= 8: # SADD, SSUB, SLL, SRL, SRA, LAND, LOR or LXOR
+            a, b = self.operands(a, b, lines)
+            lines += self.alu_op(["sadd", "ssub", "sll", "srl", "sra", "land", "lor", "lxor"][alu_op-1], res, a, b)
+        elif 9 <= alu_op <= 12: # Conditional branches
+            a, b = self.operands(a, b, lines)
+            if br_mode == 0:
+                lines += self.alu_op("ssub", res, a, b)
+                equal = "(" + res + " == 0)"
+                greater = "(" + res + " > 0)"
+            else: # Get the flags from the rcs
+                rcs = ["n_rc" + c + "_" + str(row) for row in range(CGRA_ROWS)]
+                equal = "(" + " or ".join(rc + " == 0" for rc in rcs) + ")"
+                greater = "(" + " or ".join(rc + " > 0" for rc in rcs) + ")"
+            taken = [equal, "not " + equal, "(" + greater + " or " + equal + ")", "not (" + greater + " or " + equal + ")"][alu_op-9]
+            lines.append("if " + taken + ":")
+            lines.append("    branch_lcu" + c + " = 1")
+            lines.append("    branch_pc_lcu" + c + " = " + str(imm))
+            if bgepd: # The ALU result is the decrement that it is already in muxA
+                lines.append("    " + self.alu_op("ssub", res, a, "0")[0])
+        elif alu_op == 13: # JUMP
+            lines.append("branch_lcu" + c + " = 1")
+            lines.append("branch_pc_lcu" + c + " = " + b + " + " + a)
+        elif alu_op == 14: # EXIT
+            lines.append("exit_lcu" + c + " = 1")
+        elif alu_op == 15:
+            lines.append("raise Exception(\"LCU: ALU op not recognized\")")
+            return
+        if rf_we == 1:
+            lines.append("lcu" + c + "_r" + str(rf_wsel) + " = " + res)
+
+    # ---------- Cycles and blocks ----------
+
+    def lcu_op(self, pc, col):
+        return self.fields["lcu", col][pc][3]
+
+    def ends_block(self, pc):
+        '''Whether the pc after this cycle is not always pc+1 or the kernel may exit after it'''
+        return any(self.lcu_op(pc, col) >= 9 for col in self.cols)
+
+    def gen_cycle(self, pc, lines, fast=False):
+        '''Statements of the cycle of pc. With fast, the pc and cycle number are only updated where the pc can
+        branch, the caller counts the cycles'''
+        for col in self.cols:
+            ctrl = self.disco_cgra.mxcus[col].imem.get_control(pc)
+            # Slices of the VWRs read by the RCs, the MXCU registers do not change until the MXCU runs
+            for vwr in range(N_VWR_PER_COL):
+                if any(self.fields["rc", col, row][pc][3] != 0 and vwr in self.fields["rc", col, row][pc][5:] for row in range(CGRA_ROWS)):
+                    lines.append("s" + str(col) + "_" + str(vwr) + " = mxcu" + str(col) + "_r0 & mxcu" + str(col) + "_r" + str(5 + vwr))
+            self.gen_lsu(pc, col, ctrl, lines)
+            for row in range(CGRA_ROWS):
+                self.gen_rc(pc, col, row, ctrl, lines)
+            self.gen_mxcu(pc, col, ctrl, lines)
+            self.gen_lcu(pc, col, ctrl, lines)
+        # Update of the shared values (the res and flags of each ALU are its newRes), filled in by generate()
+        lines.append("#UPDATE_SHARED_VALUES")
+        # Update pc, check branches and exit
+        branch_cols = [col for col in self.cols if 9 <= self.lcu_op(pc, col) <= 13]
+        if not branch_cols:
+            if not fast:
+                lines.append("pc = " + str(pc+1))
+        elif len(branch_cols) == 1 and len(self.cols) == 1:
+            col = str(branch_cols[0])
+            lines.append("pc = branch_pc_lcu" + col + " if branch_lcu" + col + " == 1 else " + str(pc+1))
+        else:
+            lines.append("pc = " + str(pc+1))
+            lines.append("branches = 0")
+            for col in self.cols:
+                lines.append("if branch_lcu" + str(col) + " == 1:")
+                lines.append("    branches += 1")
+                lines.append("    pc = branch_pc_lcu" + str(col))
+            lines.append("assert(branches <= 1), \"More than one branch at the same cycle\"")
+        if not fast:
+            lines.append("cycle_number += 1")
+        if any(self.lcu_op(pc, col) == 14 for col in self.cols):
+            lines.append("return pc, cycle_number")
+
+    def blocks(self):
+        '''Leaders of the basic blocks of the kernel'''
+        ops = [[self.fields["lcu", col][pc] for col in self.cols] for pc in range(self.n_instr)]
+        if any(f[3] == 13 for cycle in ops for f in cycle):
+            # The target of JUMP is only known when running, every pc can start a block
+            return list(range(self.n_instr))
+        leaders = { 0 }
+        for pc in range(self.n_instr):
+            for f in ops[pc]:
+                if 9 <= f[3] <= 12 and 0 <= f[0] < self.n_instr: # Target of a conditional branch
+                    leaders.add(f[0])
+            if self.ends_block(pc) and pc+1 < self.n_instr:
+                leaders.add(pc+1)
+        return sorted(leaders)
+
+    def loops_back(self, start, end):
+        '''Whether the last cycle of the block from pc start to end (not included) can branch back to start'''
+        return any(9 <= self.lcu_op(end-1, col) <= 12 and self.fields["lcu", col][end-1][0] == start for col in self.cols)
+
+    def gen_block(self, start, end):
+        '''Statements of the block of the cycles from pc start to end (not included).
+        A block that loops back to itself runs its first iteration cycle by cycle. Its next iterations have the
+        same control flow, so they are fast-forwarded. All of them but the last one are skipped in closed form if
+        the block is a counted loop (see gen_counted_loop), or run as array operations if it is a vector loop (see
+        gen_vector_loop). The remaining ones run in a tight loop while it keeps looping and max_iter leaves room
+        for a whole iteration: the cycle number is counted once per iteration and there are no checks between
+        cycles. The last iterations that do not fit before max_iter go back to the cycle by cycle code.'''
+        lines = []
+        for pc in range(start, end):
+            if pc > start:
+                lines.append("if cycle_number >= max_iter:")
+                lines.append("    return pc, cycle_number")
+            self.gen_cycle(pc, lines)
+        if self.loops_back(start, end):
+            lines += self.gen_counted_loop(start, end) or self.gen_vector_loop(start, end)
+            n_cycles = str(end - start)
+            lines.append("while pc == " + str(start) + " and cycle_number + " + n_cycles + " <= max_iter:")
+            lines.append("    cycle_number += " + n_cycles)
+            fast = []
+            for pc in range(start, end):
+                self.gen_cycle(pc, fast, fast=True)
+            lines += ["    " + l for l in fast]
+        return lines
+
+    def loop_counter(self, start, end):
+        '''The counter register and the limit expression of the block from pc start to end (not included), which
+        loops back to itself, if the LCU of one column counts its iterations: a BGEPD at the last cycle that
+        decrements a register down to a limit that is not the register, while the other LCU instructions are NOPs
+        without register writes. None otherwise'''
+        counters = [col for col in self.cols if self.lcu_op(end-1, col) == 11]
+        if len(counters) != 1:
+            return None
+        imm, rf_wsel, rf_we, alu_op, br_mode, muxb_sel, muxa_sel = self.fields["lcu", counters[0]][end-1]
+        if br_mode != 0 or rf_we != 1 or muxa_sel > 3 or rf_wsel != muxa_sel or muxb_sel == muxa_sel:
+            return None
+        for col in self.cols:
+            for pc in range(start, end):
+                lcu = self.fields["lcu", col][pc]
+                if (col, pc) != (counters[0], end-1) and (lcu[3] != 0 or lcu[2] != 0):
+                    return None
+        counter = "lcu" + str(counters[0]) + "_r" + str(muxa_sel)
+        ctrl = self.disco_cgra.mxcus[counters[0]].imem.get_control(end-1)
+        return counter, self.lcu_mux(muxb_sel, counters[0], ctrl.srf_sel, imm, False, True)
+
+    def gen_counted_loop(self, start, end):
+        '''Statements that skip the next iterations of the block from pc start to end (not included), which loops
+        back to itself, computing their effect in closed form, or [] if the block is not a counted loop. In a
+        counted loop:
+            -   The LCU of one column counts the iterations (see loop_counter)
+            -   Nothing is written to the SPM, the VWRs or the SRFs, the RCs read the VWRs at words that do not
+                change in the loop or with masks that keep them in the VWR, and they only divide values that do not
+                change in the loop, so no iteration can fail
+            -   The RCs do not read the results or flags of the ALUs of their neighbours
+            -   Every register written in the loop gets a value that does not change in the loop, or it is an
+                induction register: it only adds to itself (with SADD or SSUB) values that do not change in the loop
+        The number of iterations left is known from the counter and the limit, so all of them but the last one are
+        skipped: each induction register adds its increments of all of them at once, wrapped to 32 bits as each
+        addition does, the counter goes down by their number and the cycle number goes up by their cycles. The
+        registers whose value does not change already have it after the first iteration, and the ALU results and
+        flags of the skipped iterations are never read, the last iteration computes them again.'''
+        loop_counter = self.loop_counter(start, end)
+        if loop_counter is None:
+            return []
+        counter, limit = loop_counter
+        pcs = range(start, end)
+        # Registers written in the loop, besides the counter
+        written = set()
+        for col in self.cols:
+            c = str(col)
+            for pc in pcs:
+                rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel, vwr_sel_shuf_op, mem_op = self.fields["lsu", col][pc]
+                if mem_op != 0:
+                    return []
+                if rf_we == 1:
+                    written.add("lsu" + c + "_r" + str(rf_wsel))
+                ctrl = self.disco_cgra.mxcus[col].imem.get_control(pc)
+                if ctrl.srf_we == 1 or ctrl.vwr_row_we:
+                    return []
+                rf_wsel, rf_we = self.fields["mxcu", col][pc][5:7]
+                if rf_we == 1:
+                    written.add("mxcu" + c + "_r" + str(rf_wsel))
+                for row in range(CGRA_ROWS):
+                    rf_wsel, rf_we = self.fields["rc", col, row][pc][:2]
+                    if rf_we == 1:
+                        written.add("rc" + c + "_" + str(row) + "_r" + str(rf_wsel))
+
+        # Value of each written register and of each ALU result of the iteration: ("inv", expression) if it does not
+        # change in the loop (the expression is None if it is not needed), ("ind", register, increments) if it is
+        # the register at the start of the iteration plus some values that do not change, or None otherwise
+        values = { reg: ("ind", reg, []) for reg in written }
+        results = {}
+        checks = []
+
+        def operand(expr):
+            return values.get(expr, ("inv", expr))
+
+        def run_op(op, a, b):
+            '''Value of the result of an ALU operation, False if it may fail or depend on other iterations'''
+            if op in ("sfga", "zfga"): # Flags of the previous cycle
+                return False
+            if a is not None and b is not None and a[0] == "inv" and b[0] == "inv":
+                if op in ("sadd", "ssub") and a[1] is not None and b[1] is not None:
+                    return ("inv", "wrap32((" + a[1] + ") " + ("+" if op == "sadd" else "-") + " (" + b[1] + "))")
+                return ("inv", None)
+            if op == "sadd":
+                for x, y in ((a, b), (b, a)):
+                    if x is not None and y is not None and x[0] == "ind" and y[0] == "inv" and y[1] is not None:
+                        return ("ind", x[1], x[2] + ["(" + y[1] + ")"])
+            if op == "ssub" and a is not None and b is not None and a[0] == "ind" and b[0] == "inv" and b[1] is not None:
+                return ("ind", a[1], a[2] + ["-(" + b[1] + ")"])
+            if op == "sdiv": # Division by zero
+                return False
+            return None
+
+        for pc in pcs:
+            for col in self.cols:
+                c = str(col)
+                ctrl = self.disco_cgra.mxcus[col].imem.get_control(pc)
+                # LSU
+                rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel, vwr_sel_shuf_op, mem_op = self.fields["lsu", col][pc]
+                a = self.lsu_mux(muxa_sel, col, ctrl.srf_sel)
+                b = self.lsu_mux(muxb_sel, col, ctrl.srf_sel)
+                if a is None or b is None:
+                    return []
+                results["lsu" + c] = run_op(["land", "lor", "lxor", "sadd", "ssub", "sll", "srl", "bitrev"][alu_op], operand(a), operand(b))
+                if rf_we == 1:
+                    values["lsu" + c + "_r" + str(rf_wsel)] = results["lsu" + c]
+                # RCs, they only read registers of their own
+                rc_values = {}
+                for row in range(CGRA_ROWS):
+                    name = "rc" + c + "_" + str(row)
+                    rf_wsel, rf_we, muxf_sel, alu_op, op_mode, muxb_sel, muxa_sel = self.fields["rc", col, row][pc]
+                    if alu_op != 0:
+                        muxes = []
+                        for mux in (muxa_sel, muxb_sel):
+                            if mux <= 2: # VWR_A, VWR_B or VWR_C, read at R0 masked
+                                mask = "mxcu" + c + "_r" + str(5 + mux)
+                                if mask in written:
+                                    return []
+                                if "mxcu" + c + "_r0" in written:
+                                    checks.append("0 <= " + mask + " < " + str(N_ELEMS_PER_VWR - int(SPM_NWORDS/CGRA_ROWS)*row))
+                                    muxes.append(None)
+                                else:
+                                    muxes.append(("inv", None))
+                            elif mux == 3 or 10 <= mux <= 13 or mux == 4 or mux == 5: # SRF, constants, R0 or R1
+                                muxes.append(operand(self.rc_mux(mux, col, row, ctrl.srf_sel, [])))
+                            else: # The neighbours, or not recognized
+                                return []
+                        op = RC_ARRAY_OP_NAMES[alu_op, op_mode]
+                        if op in ("mac", "mach"):
+                            results[name] = None
+                        else:
+                            results[name] = run_op(op, muxes[0], muxes[1])
+                        if results[name] is False:
+                            return []
+                    if rf_we == 1:
+                        rc_values[name + "_r" + str(rf_wsel)] = results.get(name)
+                values.update(rc_values)
+                # MXCU
+                rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel = self.fields["mxcu", col][pc][5:]
+                a = self.mxcu_mux(muxa_sel, col, ctrl.srf_sel)
+                b = self.mxcu_mux(muxb_sel, col, ctrl.srf_sel)
+                if a is None or b is None:
+                    return []
+                if alu_op != 0:
+                    results["mxcu" + c] = run_op([None, "sadd", "ssub", "sll", "srl", "land", "lor", "lxor"][alu_op], operand(a), operand(b))
+                if rf_we == 1:
+                    values["mxcu" + c + "_r" + str(rf_wsel)] = results.get("mxcu" + c)
+        # Closed form of the induction registers
+        updates = []
+        for reg in sorted(written):
+            value = values[reg]
+            if value is None or (value[0] == "ind" and value[1] != reg):
+                return []
+            if value[0] == "ind" and value[2]:
+                updates.append(reg + " = wrap32(" + reg + " + n_iter * (" + " + ".join(value[2]) + "))")
+        n_cycles = str(end - start)
+        checks = ["n_iter >= 1", "-0x40000000 < " + counter + " < 0x40000000", "-0x40000000 < limit < 0x40000000"] + checks
+        lines = ["# Counted loop: the next iterations, except the last one, in closed form",
+                 "if pc == " + str(start) + ":",
+                 "    limit = " + limit,
+                 "    n_iter = int(min(" + counter + " - limit + 1, (max_iter - cycle_number) // " + n_cycles + ")) - 1",
+                 "    if " + " and ".join(sorted(set(checks), key=checks.index)) + ":"]
+        lines += ["        " + l for l in updates]
+        lines.append("        " + counter + " -= n_iter")
+        lines.append("        cycle_number += n_iter * " + n_cycles)
+        return lines
+
+    def gen_vector_loop(self, start, end):
+        '''Statements that run the next iterations of the block from pc start to end (not included), which loops back to
+        itself, as array operations over the iterations, or [] if the block is not a vector loop. In a vector loop:
+            -   The LCU of one column counts the iterations (see loop_counter)
+            -   The MXCUs only change their R0, adding values that do not change in the loop, and do not write the SRF
+            -   The LSUs do not access the memories or change their registers
+            -   The RCs run operations of VECTOR_LOOP_OPS on the VWRs, their registers, the SRF and constants, and
+                the registers they read before writing them get the same value in every iteration
+        The iterations run as array operations if they are at least two, R0 goes up and stays within the masks of
+        the VWRs it indexes (so the VWR accesses of each row are slices), no word is accessed by two iterations if one
+        of them writes it, and the registers do not overflow. The last iteration always runs as before, so that the
+        ALU results, flags and branches end like they do when running cycle by cycle.'''
+        pcs = range(start, end)
+        loop_counter = self.loop_counter(start, end)
+        if loop_counter is None:
+            return []
+        counter, limit = loop_counter
+        for col in self.cols:
+            for pc in pcs:
+                lsu = self.fields["lsu", col][pc]
+                if lsu[6] != 0 or lsu[1] != 0: # mem_op or rf_we
+                    return []
+
+        r0_lines = []       # R0 of the MXCUs at the first iteration of each cycle
+        op_lines = []       # Operations, in the order of the cycles
+        accesses = []       # VWR accesses: (column, VWR, R0, mask register, offset, write)
+        strides = { col: [] for col in self.cols }
+        names = iter("t" + str(i) for i in range(1 << 30))
+        # Value of each location: (expression, whether it changes in each iteration, initial values it depends on)
+        values = {}
+        for col in self.cols:
+            for row in range(CGRA_ROWS):
+                name = "rc" + str(col) + "_" + str(row)
+                for reg in range(2):
+                    values["reg", col, row, reg] = (name + "_r" + str(reg), False, {("reg", col, row, reg)})
+                values["n", col, row] = ("n_" + name, False, {("n", col, row)})
+        initial = dict(values)
+        read_initials = set()
+
+        def access(col, vwr, r0, row, write):
+            '''Slice of the words of a VWR that the iterations access'''
+            mask = "mxcu" + str(col) + "_r" + str(5 + vwr)
+            offset = int(SPM_NWORDS/CGRA_ROWS)*row
+            accesses.append((col, vwr, r0, mask, offset, write))
+            first = r0 + " + " + str(offset)
+            return "v" + str(col) + "_" + str(vwr) + "[" + first + ":" + first + " + span" + str(col) + ":stride" + str(col) + "]"
+
+        for pc in pcs:
+            for col in self.cols:
+                c = str(col)
+                ctrl = self.disco_cgra.mxcus[col].imem.get_control(pc)
+                if ctrl.srf_we == 1:
+                    return []
+                r0 = "r0_" + c + "_" + str(pc)
+                r0_lines.append(r0 + " = mxcu" + c + "_r0" + "".join(" + " + stride for stride in strides[col]))
+                for row in range(CGRA_ROWS):
+                    rf_wsel, rf_we, muxf_sel, alu_op, op_mode, muxb_sel, muxa_sel = self.fields["rc", col, row][pc]
+                    if alu_op != 0:
+                        op = RC_ARRAY_OP_NAMES[alu_op, op_mode]
+                        if op not in VECTOR_LOOP_OPS:
+                            return []
+                        operands = []
+                        for mux in (muxa_sel, muxb_sel):
+                            if mux <= 2: # VWR_A, VWR_B or VWR_C
+                                operands.append((access(col, mux, r0, row, False) + ".astype(np.int64)", True, set()))
+                            elif mux == 3: # SRF
+                                operands.append(("srf" + c + "[" + str(ctrl.srf_sel) + "]", False, set()))
+                            elif mux == 4 or mux == 5: # R0 or R1
+                                operands.append(values["reg", col, row, mux-4])
+                            elif 10 <= mux <= 13: # ZERO, ONE, MAX_INT or MIN_INT
+                                operands.append((self.rc_mux(mux, col, row, ctrl.srf_sel, []), False, set()))
+                            else: # The neighbours give the results of the previous iteration
+                                return []
+                        # The accumulator of MAC
+                        operands.append(values["reg", col, row, 0] if op in ("mac", "mach") else ("0", False, set()))
+                        for operand in operands:
+                            read_initials |= operand[2]
+                        res = next(names)
+                        op_lines.append(res + " = RC_ARRAY_OPS[\"" + op + "\"](" + ", ".join(operand[0] for operand in operands[:2]) + ", 0, " + operands[2][0] + ")")
+                        values["n", col, row] = (res, any(operand[1] for operand in operands), set().union(*(operand[2] for operand in operands)))
+                    if rf_we == 1:
+                        values["reg", col, row, rf_wsel] = values["n", col, row]
+                # VWR store control, with the R0 of this cycle
+                if ctrl.vwr_row_we:
+                    if ctrl.vwr_sel >= N_VWR_PER_COL:
+                        return []
+                    for row in range(CGRA_ROWS):
+                        if (ctrl.vwr_row_we >> row) & 1:
+                            value = values["n", col, row]
+                            read_initials |= value[2]
+                            op_lines.append(access(col, ctrl.vwr_sel, r0, row, True) + " = wrap32(" + value[0] + ")")
+                # MXCU: nothing or R0 plus a value that does not change
+                rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel = self.fields["mxcu", col][pc][5:]
+                if rf_we == 1:
+                    if rf_wsel != 0 or alu_op != 1 or (muxa_sel == 0) == (muxb_sel == 0):
+                        return []
+                    stride = self.mxcu_mux(muxb_sel if muxa_sel == 0 else muxa_sel, col, ctrl.srf_sel)
+                    if stride is None:
+                        return []
+                    strides[col].append("(" + stride + ")")
+        # The registers read before they are written must get the same value in every iteration
+        changed = { key for key in values if values[key] != initial[key] }
+        for key in changed & read_initials:
+            if values[key][1] or values[key][2] & changed:
+                return []
+        if not any(write for *_, write in accesses):
+            return []
+
+        checks = ["n_iter >= 2", "-0x40000000 < " + counter + " < 0x40000000", "-0x40000000 < limit < 0x40000000"]
+        for col in self.cols:
+            c = str(col)
+            checks.append("stride" + c + " > 0")
+            checks.append("abs(mxcu" + c + "_r0) + n_iter * (" + " + ".join(["0"] + ["abs" + stride for stride in strides[col]]) + ") < 0x80000000")
+        # R0 is within the masks, which keep its lower bits, and within the slice of a row, so the accesses are slices
+        # of the VWRs and the accesses of different rows do not overlap
+        for col, vwr, r0, mask, offset, write in accesses:
+            checks.append("0 <= " + r0 + " <= " + r0 + " + span" + str(col) + " - stride" + str(col) + " <= " + mask)
+            checks.append(mask + " & (" + mask + " + 1) == 0")
+            checks.append(r0 + " + span" + str(col) + " - stride" + str(col) + " < " + str(int(SPM_NWORDS/CGRA_ROWS)))
+        # The words written by an iteration are not accessed by the others. In the same cycle the accesses of a row
+        # are at the same word
+        for i, (col, vwr, r0, mask, offset, write) in enumerate(accesses):
+            for other in accesses[:i]:
+                if (other[0], other[1], other[4]) == (col, vwr, offset) and (write or other[5]) and r0 != other[2]:
+                    checks.append("vector_loop_apart(" + r0 + " - " + other[2] + ", stride" + str(col) + ", n_iter)")
+        lines = ["# Vector loop: the next iterations, except the last one, as array operations",
+                 "if pc == " + str(start) + ":",
+                 "    limit = " + limit,
+                 "    n_iter = min(" + counter + " - limit + 1, (max_iter - cycle_number) // " + str(end - start) + ") - 1"]
+        for col in self.cols:
+            c = str(col)
+            lines.append("    stride" + c + " = " + (" + ".join(strides[col]) if strides[col] else "0"))
+            lines.append("    span" + c + " = n_iter * stride" + c)
+        lines += ["    " + l for l in r0_lines]
+        lines.append("    if " + " and ".join(sorted(set(checks), key=checks.index)) + ":")
+        lines += ["        " + l for l in op_lines]
+        for col in self.cols:
+            lines.append("        mxcu" + str(col) + "_r0 += span" + str(col))
+        lines.append("        " + counter + " -= n_iter")
+        lines.append("        cycle_number += n_iter * " + str(end - start))
+        return lines
+
+    def gen_dispatch(self, leaders, bounds, indent):
+        '''Binary search on the pc among the leaders, running the block of the matching one'''
+        pad = "    " * indent
+        if len(leaders) == 1:
+            start = leaders[0]
+            lines = [pad + "if pc == " + str(start) + ":"]
+            lines += [pad + "    " + l for l in self.gen_block(start, bounds[start])]
+            lines.append(pad + "else:")
+            lines.append(pad + "    return pc, cycle_number # Not a block of the kernel, continue with the interpreter")
+            return lines
+        mid = len(leaders) // 2
+        lines = [pad + "if pc < " + str(leaders[mid]) + ":"]
+        lines += self.gen_dispatch(leaders[:mid], bounds, indent+1)
+        lines.append(pad + "else:")
+        lines += self.gen_dispatch(leaders[mid:], bounds, indent+1)
+        return lines
+
+    def generate(self):
+        '''Source code of the run_kernel function'''
+        leaders = self.blocks()
+        bounds = { start: end for start, end in zip(leaders, leaders[1:] + [self.n_instr]) }
+        body = self.gen_dispatch(leaders, bounds, 3)
+        # Now the ALUs used by the blocks are known
+        alus = sorted(set(self.alu_names.values()))
+        updated = sorted(self.used_alus | self.res_alus | self.flag_alus)
+        update = []
+        for name in updated:
+            update.append("r_" + name + " = n_" + name)
+            if name in self.flag_alus:
+                update.append("z_" + name + " = 1 if n_" + name + " == 0 else 0")
+                update.append("s_" + name + " = 1 if n_" + name + " < 0 else 0")
+        lines = []
+        for line in body:
+            if line.strip() == "#UPDATE_SHARED_VALUES":
+                pad = line[:len(line) - len(line.lstrip())]
+                lines += [pad + l for l in update]
+            else:
+                lines.append(line)
+        body = lines
+
+        src = ["# Generated by KERNEL_JIT (version " + str(JIT_VERSION) + ")",
+               "def run_kernel(disco_cgra, pc, cycle_number, max_iter):",
+               "    alu = ALU() # Scratch ALU for the less common operations",
+               "    spm = disco_cgra.spm",
+               "    start_cycle = cycle_number"]
+        # State to locals
+        units = []
+        for col in self.cols:
+            c = str(col)
+            units += [("lcu" + c, "disco_cgra.lcus[" + c + "]", 4), ("lsu" + c, "disco_cgra.lsus[" + c + "]", 8), ("mxcu" + c, "disco_cgra.mxcus[" + c + "]", 8)]
+            units += [("rc" + c + "_" + str(row), "disco_cgra.rcs[" + c + "][" + str(row) + "]", 2) for row in range(CGRA_ROWS)]
+            src.append("    srf" + c + " = disco_cgra.srfs[" + c + "].regs")
+            for vwr in range(N_VWR_PER_COL):
+                v = c + "_" + str(vwr)
+                src.append("    vwr" + v + " = disco_cgra.vwrs[" + c + "][" + str(vwr) + "]")
+                src.append("    v" + v + " = vwr" + v + ".values")
+            src.append("    branch_lcu" + c + " = disco_cgra.lcus[" + c + "].branch")
+            src.append("    branch_pc_lcu" + c + " = disco_cgra.lcus[" + c + "].branch_pc")
+            src.append("    exit_lcu" + c + " = disco_cgra.lcus[" + c + "].exit")
+        for name, obj, n_regs in units:
+            src.append("    " + name + " = " + obj)
+            src.append("    " + ", ".join(name + "_r" + str(i) for i in range(n_regs)) + ", = " + name + ".regs")
+        all_alus = {}
+        for col in range(CGRA_COLS):
+            c = str(col)
+            all_alus["lcu" + c] = "disco_cgra.lcus[" + c + "].alu"
+            all_alus["lsu" + c] = "disco_cgra.lsus[" + c + "].alu"
+            all_alus["mxcu" + c] = "disco_cgra.mxcus[" + c + "].alu"
+            for row in range(CGRA_ROWS):
+                all_alus["rc" + c + "_" + str(row)] = "disco_cgra.rcs[" + c + "][" + str(row) + "].alu"
+        for name in alus:
+            src.append("    alu_" + name + " = " + all_alus[name])
+            src.append("    n_" + name + " = alu_" + name + ".newRes")
+            if name in updated:
+                src.append("    r_" + name + " = alu_" + name + ".res")
+            if name in self.flag_alus:
+                src.append("    z_" + name + " = alu_" + name + ".zero_flag")
+                src.append("    s_" + name + " = alu_" + name + ".sign_flag")
+        src.append("    try:")
+        src.append("        while pc < " + str(self.n_instr) + " and cycle_number < max_iter:")
+        src += body
+        src.append("        return pc, cycle_number")
+        # Write back the state, also if the kernel failed
+        src.append("    finally:")
+        for name, obj, n_regs in units:
+            src.append("        " + name + ".regs[:] = [" + ", ".join(name + "_r" + str(i) for i in range(n_regs)) + "]")
+        for col in self.cols:
+            c = str(col)
+            src.append("        disco_cgra.lcus[" + c + "].branch = branch_lcu" + c)
+            src.append("        disco_cgra.lcus[" + c + "].branch_pc = branch_pc_lcu" + c)
+            src.append("        disco_cgra.lcus[" + c + "].exit = exit_lcu" + c)
+        src.append("        ran = cycle_number > start_cycle")
+        for name in alus:
+            src.append("        alu_" + name + ".newRes = n_" + name)
+            res = "r_" + name if name in updated else "n_" + name
+            src.append("        if ran:")
+            src.append("            alu_" + name + ".res = " + res)
+            src.append("            alu_" + name + ".zero_flag = 1 if " + res + " == 0 else 0")
+            src.append("            alu_" + name + ".sign_flag = 1 if " + res + " < 0 else 0")
+        return "\n".join(src) + "\n"
+
+def __getattr__(name):
+    # DEFAULT_KERNEL_JIT is shared by all the simulators, so that a kernel is only compiled once per process. It is
+    # created the first time it is used
+    if name == "DEFAULT_KERNEL_JIT":
+        kernel_jit = KERNEL_JIT()
+        globals()[name] = kernel_jit
+        return kernel_jit
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
@@ -16,10 +16,8 @@ KMEM_IMEM_WIDTH = 21
 class KMEM_IMEM:
     '''Kernel memory: Keeps track of which kernels are loaded into the IMEM of DISCO-CGRA'''
     def __init__(self):
-        self.IMEM = np.zeros(KER_CONF_N_REG,dtype="S{0}".format(KMEM_IMEM_WIDTH))
         # Initialize kernel memory with zeros
-        for i, instruction in enumerate(self.IMEM):
-            self.IMEM[i] = np.binary_repr(0,width=KMEM_IMEM_WIDTH)
+        self.IMEM = np.full(KER_CONF_N_REG, np.binary_repr(0,width=KMEM_IMEM_WIDTH), dtype="S{0}".format(KMEM_IMEM_WIDTH))
         
     
     def set_word(self, kmem_word, pos):
@@ -34,7 +32,7 @@ class KMEM_IMEM:
         '''
         
         assert (pos>0), "Kernel word 0 is reserved; need to pick a position >0 and <16"
-        assert (num_instructions_per_col>0) & (num_instructions_per_col<64), "Invalid kernel; number of instructions is either negative or too big"
+        assert (num_instructions_per_col>0) & (num_instructions_per_col<=64), "Invalid kernel; number of instructions is either negative or too big"
 
         # Note: The number of instructions encoded in the kmem word is always one less than the actual number of instructions
         n_instr_kmem = num_instructions_per_col-1
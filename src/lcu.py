@@ -4,7 +4,6 @@ __email__       = "lara.orlandic@epfl.ch"
 
 import numpy as np
 from enum import Enum
-from ctypes import c_int32
 import re
 from .alu import *
 from .srf import SRF_N_REGS
@@ -18,6 +17,9 @@ LCU_NUM_CREG = 64
 # Widths of instructions of each specialized slot in bits
 LCU_IMEM_WIDTH = 20
 
+# Number of integer fields of a decoded instruction (see LCU_IMEM_WORD.decode_word)
+LCU_IMEM_N_FIELDS = 7
+
 # LCU IMEM word decoding
 class LCU_ALU_OPS(int, Enum):
     '''LCU ALU operation codes'''
@@ -71,16 +73,35 @@ class LCU_MUXB_SEL(int, Enum):
 
 class LCU_IMEM:
     '''Instruction memory of the Loop Control Unit'''
+    # IMEM and fields of a memory full of default instructions, see __init__
+    default_imem = None
+    default_fields = None
+
     def __init__(self):
-        self.IMEM = np.zeros(LCU_NUM_CREG,dtype="S{0}".format(LCU_IMEM_WIDTH))
-        # Initialize memory with default instruction
-        default_word = LCU_IMEM_WORD()
-        for i in range(LCU_NUM_CREG):
-            self.IMEM[i] = default_word.get_word()
+        # Initialize memory with default instruction, copied from the one built by the first IMEM
+        if LCU_IMEM.default_imem is None:
+            default_word = LCU_IMEM_WORD()
+            LCU_IMEM.default_imem = np.full(LCU_NUM_CREG, default_word.get_word(), dtype="S{0}".format(LCU_IMEM_WIDTH))
+            LCU_IMEM.default_fields = np.tile(np.array(default_word.decode_word(), dtype=np.int32), (LCU_NUM_CREG, 1))
+        self.IMEM = LCU_IMEM.default_imem.copy()
+        # Integer fields of each instruction, decoded once when the word is written
+        self.fields = LCU_IMEM.default_fields.copy()
     
     def set_word(self, kmem_word, pos):
         '''Set the IMEM index at integer pos to the binary imem word'''
         self.IMEM[pos] = np.binary_repr(kmem_word,width=LCU_IMEM_WIDTH)
+        self.fields[pos] = self.decode_fields(kmem_word)
+    
+    def decode_fields(self, kmem_word):
+        '''Decode an integer imem word into its integer fields, in the order of LCU_IMEM_WORD.decode_word'''
+        imm = kmem_word & 0x3F
+        rf_wsel = (kmem_word >> 6) & 0x3
+        rf_we = (kmem_word >> 8) & 0x1
+        alu_op = (kmem_word >> 9) & 0xF
+        br_mode = (kmem_word >> 13) & 0x1
+        muxb_sel = (kmem_word >> 14) & 0x7
+        muxa_sel = (kmem_word >> 17) & 0x7
+        return imm, rf_wsel, rf_we, alu_op, br_mode, muxb_sel, muxa_sel
     
     def set_params(self, imm=0, rf_wsel=0, rf_we=0, alu_op=LCU_ALU_OPS.NOP, br_mode=0, muxb_sel=LCU_MUXB_SEL.R0, muxa_sel=LCU_MUXA_SEL.R0, pos=0):
         '''Set the IMEM index at integer pos to the configuration parameters.
@@ -88,6 +109,7 @@ class LCU_IMEM:
         '''
         imem_word = LCU_IMEM_WORD(imm=imm, rf_wsel=rf_wsel, rf_we=rf_we, alu_op=alu_op, br_mode=br_mode, muxb_sel=muxb_sel, muxa_sel=muxa_sel)
         self.IMEM[pos] = imem_word.get_word()
+        self.fields[pos] = imem_word.decode_word()
     
     def get_instruction_asm(self, pos, srf_sel, srf_we, alu_srf_write):
         '''Print the human-readable instructions of the instruction at position pos in the instruction memory'''
@@ -307,6 +329,18 @@ class LCU_IMEM_WORD:
         return imm, rf_wsel, rf_we, alu_op, br_mode, muxb_sel, muxa_sel
 
 
+# Operands of the LCU assembly instructions, compiled once for all the instructions that the assembler parses
+LCU_ASM_PATTERNS = {
+    "r": re.compile(r'^R(\d+)$'),
+    "srf": re.compile(r'^SRF\((\d+)\)$'),
+    "zero": re.compile(r'^ZERO$'),
+    "last": re.compile(r'^LAST$'),
+    "one": re.compile(r'^ONE$'),
+}
+
+# Number of instruction texts whose encoding is remembered by LCU.asmToHex
+LCU_ASM_CACHE_SIZE = 4096
+
 class LCU:
     lcu_arith_ops   = { 'SADD','SSUB','SLL','SRL','SRA','LAND','LOR','LXOR' }
     lcu_rcmode_ops  = { 'BEQR','BNER','BLTR','BGER' }
@@ -315,12 +349,14 @@ class LCU:
     lcu_jump_ops    = { 'JUMP' }
     lcu_nop_ops     = { 'NOP' }
     lcu_exit_ops    = { 'EXIT' }
+    # Integer words of the instruction texts already assembled, shared by all the LCUs (see asmToHex)
+    asm_cache = {}
     
     def __init__(self):
         self.regs       = [0 for _ in range(LCU_NUM_DREG)]
         self.imem       = LCU_IMEM()
         self.nInstr     = 0
-        self.default_word = LCU_IMEM_WORD().get_word()
+        self.default_word = self.imem.IMEM[0].decode() # The IMEM starts full of default words
         self.iregs = [self.default_word in range(LCU_NUM_CREG)]
         self.alu = ALU()
         self.exit = 0
@@ -413,12 +449,11 @@ class LCU:
         else:
             raise Exception(self.__class__.__name__ + ": ALU op not recognized")
 
-    def run(self, pc, disco_cgra, col):
-        # MXCU info
-        mxcu_asm, selected_vwr, srf_sel, alu_srf_write, srf_we, vwr_row_we = disco_cgra.mxcus[col].imem.get_instruction_asm(pc)
-        # This LCU instruction
-        lcu_hex = self.imem.get_word_in_hex(pc)
-        imm, rf_wsel, rf_we, alu_op, br_mode, muxb_sel, muxa_sel = LCU_IMEM_WORD(hex_word=lcu_hex).decode_word()
+    def run(self, pc, fields, ctrl, disco_cgra, col):
+        # MXCU control signals of this cycle, shared by all the units of the column
+        srf_sel = ctrl.srf_sel
+        # This LCU instruction (already decoded into integer fields)
+        imm, rf_wsel, rf_we, alu_op, br_mode, muxb_sel, muxa_sel = fields
         # Get muxes value
         bgepd = False # Especial case BGEPD
         if alu_op == 11:
@@ -431,17 +466,102 @@ class LCU:
         # Write result locally
         if rf_we == 1:
             self.regs[rf_wsel] = self.alu.newRes
-        
-        # ---------- Print something -----------
-        print(self.__class__.__name__ + ": " + self.imem.get_instruction_asm(pc, srf_sel, srf_we, alu_srf_write) + " --> ALU res = " + str(self.alu.newRes))
 
-    def parseDestArith(self, rd, instr):
-        # Define the regular expression pattern
-        r_pattern = re.compile(r'^R(\d+)$')
-        srf_pattern = re.compile(r'^SRF\((\d+)\)$')
+    def compileMux(self, mux, disco_cgra, col, srf_sel, imm, muxA, bgepd):
+        '''Get a function without arguments that returns the value of the mux, as getMuxValue does. None if the mux is not recognized'''
+        dec = 1 if bgepd and muxA else 0 # BGEPD decrements muxA
+        if mux <= 3 : # Rx
+            regs = self.regs
+            if dec:
+                return lambda: regs[mux] - 1
+            return lambda: regs[mux]
+        if mux == 4: # SRF
+            srf_regs = disco_cgra.srfs[col].regs
+            if dec:
+                return lambda: srf_regs[srf_sel] - 1
+            return lambda: srf_regs[srf_sel]
+        if mux == 5: # LAST
+            value = int(SPM_NWORDS/CGRA_ROWS) -1 - dec # 128/4 -1 = 31 (last index)
+        elif mux == 6: # ZERO
+            value = 0 - dec
+        elif mux == 7: # IMM or ONE
+            value = imm - dec if muxA else 1
+        else:
+            return None
+        return lambda: value
+
+    def compile(self, pc, fields, ctrl, disco_cgra, col):
+        '''Get a function without arguments that executes the instruction of pc like run() does, with the operand
+        sources and the ALU or branch operation already selected. Not recognized encodings run through run().'''
+        imm, rf_wsel, rf_we, alu_op, br_mode, muxb_sel, muxa_sel = fields
+        bgepd = alu_op == 11 # Especial case BGEPD
+        get_a = self.compileMux(muxa_sel, disco_cgra, col, ctrl.srf_sel, imm, True, bgepd)
+        get_b = self.compileMux(muxb_sel, disco_cgra, col, ctrl.srf_sel, imm, False, bgepd)
+        if get_a is None or get_b is None or alu_op > 14:
+            return lambda: self.run(pc, fields, ctrl, disco_cgra, col)
+        lcu = self
+        regs = self.regs
+        alu = self.alu
+        ssub = alu.ssub
+        if alu_op == 0: # NOP
+            def execute():
+                lcu.branch = 0
+        elif alu_op <= 8: # SADD, SSUB, SLL, SRL, SRA, LAND, LOR or LXOR
+            alu_fn = [alu.sadd, alu.ssub, alu.sll, alu.srl, alu.sra, alu.land, alu.lor, alu.lxor][alu_op-1]
+            def execute():
+                lcu.branch = 0
+                alu_fn(get_a(), get_b())
+        elif alu_op <= 12: # Conditional branches
+            if br_mode == 0:
+                def compare(muxa_val, muxb_val):
+                    ssub(muxa_val, muxb_val)
+                    return alu.newRes == 0, alu.newRes > 0
+            else: # Get the flags from the rcs
+                rc_alus = [disco_cgra.rcs[col][row].alu for row in range(CGRA_ROWS)]
+                def compare(muxa_val, muxb_val):
+                    equal = 0
+                    greater = 0
+                    for rc_alu in rc_alus:
+                        if rc_alu.newRes == 0:
+                            equal = 1
+                        if rc_alu.newRes > 0:
+                            greater = 1
+                    return equal, greater
+            # BEQ, BNE, BGEPD or BLT
+            taken = [lambda equal, greater: equal, lambda equal, greater: not equal,
+                     lambda equal, greater: greater or equal, lambda equal, greater: not (greater or equal)][alu_op-9]
+            def execute():
+                lcu.branch = 0
+                muxa_val = get_a()
+                equal, greater = compare(muxa_val, get_b())
+                if taken(equal, greater):
+                    lcu.branch = 1
+                    lcu.branch_pc = imm
+                    if bgepd:
+                        ssub(muxa_val, 0) # The ALU result is the decrement that it is already in muxA
+        elif alu_op == 13: # JUMP
+            def execute():
+                lcu.branch = 1
+                lcu.branch_pc = get_b() + get_a()
+        else: # EXIT
+            def execute():
+                lcu.branch = 0
+                lcu.exit = 1
+        if rf_we == 1:
+            def slot():
+                execute()
+                regs[rf_wsel] = alu.newRes
+            return slot
+        return execute
+
+    def get_trace_asm(self, pc, disco_cgra, col):
+        '''Disassembly of the instruction at pc as executed by this LCU, for the trace of the simulator'''
+        mxcu_asm, selected_vwr, srf_sel, alu_srf_write, srf_we, vwr_row_we = disco_cgra.mxcus[col].imem.get_instruction_asm(pc)
+        return self.imem.get_instruction_asm(pc, srf_sel, srf_we, alu_srf_write)
 
+    def parseDestArith(self, rd, instr):
         # Check if the input matches the 'R' pattern
-        r_match = r_pattern.match(rd)
+        r_match = LCU_ASM_PATTERNS["r"].match(rd)
         if r_match:
             ret = None
             try:
@@ -452,7 +572,7 @@ class LCU:
 
 
         # Check if the input matches the 'SRF' pattern
-        srf_match = srf_pattern.match(rd)
+        srf_match = LCU_ASM_PATTERNS["srf"].match(rd)
         if srf_match:
             return LCU_DEST_REGS["SRF"], int(srf_match.group(1))
 
@@ -460,14 +580,8 @@ class LCU:
 
     # Returns the value for muxA and the number of the srf accessed (-1 if it isn't accessed)
     def parseMuxAArith(self, rs, instr):
-        # Define the regular expression pattern
-        r_pattern = re.compile(r'^R(\d+)$')
-        srf_pattern = re.compile(r'^SRF\((\d+)\)$')
-        zero_pattern = re.compile(r'^ZERO$')
-        last_pattern = re.compile(r'^LAST$')
-
         # Check if the input matches the 'R' pattern
-        r_match = r_pattern.match(rs)
+        r_match = LCU_ASM_PATTERNS["r"].match(rs)
         if r_match:
             ret = None
             try:
@@ -477,33 +591,26 @@ class LCU:
             return ret, -1
 
         # Check if the input matches the 'SRF' pattern
-        srf_match = srf_pattern.match(rs)
+        srf_match = LCU_ASM_PATTERNS["srf"].match(rs)
         if srf_match:
             i = srf_match.group(1)
             return LCU_MUXA_SEL["SRF"], int(srf_match.group(1))
         
         # Check if the input matches the 'ZERO' pattern
-        zero_match = zero_pattern.match(rs)
+        zero_match = LCU_ASM_PATTERNS["zero"].match(rs)
         if zero_match:
             return LCU_MUXA_SEL[rs], -1
 
         # Check if the input matches the 'LAST' pattern
-        last_match = last_pattern.match(rs)
+        last_match = LCU_ASM_PATTERNS["last"].match(rs)
         if last_match:
             return LCU_MUXA_SEL[rs], -1
 
         return None, -1
 
     def parseMuxBArith(self, rs, instr):
-        # Define the regular expression pattern
-        r_pattern = re.compile(r'^R(\d+)$')
-        srf_pattern = re.compile(r'^SRF\((\d+)\)$')
-        zero_pattern = re.compile(r'^ZERO$')
-        last_pattern = re.compile(r'^LAST$')
-        one_pattern = re.compile(r'^ONE$')
-
         # Check if the input matches the 'R' pattern
-        r_match = r_pattern.match(rs)
+        r_match = LCU_ASM_PATTERNS["r"].match(rs)
         if r_match:
             ret = None
             try:
@@ -513,28 +620,41 @@ class LCU:
             return ret, -1
 
         # Check if the input matches the 'SRF' pattern
-        srf_match = srf_pattern.match(rs)
+        srf_match = LCU_ASM_PATTERNS["srf"].match(rs)
         if srf_match:
             return LCU_MUXB_SEL["SRF"], int(srf_match.group(1))
         
         # Check if the input matches the 'ZERO' pattern
-        zero_match = zero_pattern.match(rs)
+        zero_match = LCU_ASM_PATTERNS["zero"].match(rs)
         if zero_match:
             return LCU_MUXB_SEL[rs], -1
 
         # Check if the input matches the 'LAST' pattern
-        last_match = last_pattern.match(rs)
+        last_match = LCU_ASM_PATTERNS["last"].match(rs)
         if last_match:
             return LCU_MUXB_SEL[rs], -1
         
         # Check if the input matches the 'ONE' pattern
-        one_match = one_pattern.match(rs)
+        one_match = LCU_ASM_PATTERNS["one"].match(rs)
         if one_match:
             return LCU_MUXB_SEL[rs], -1
 
         return None, -1
 
     def asmToHex(self, instr):
+        '''Encode an LCU instruction, see encodeAsm. The encoding only depends on the text, so each text is encoded
+        once for all the LCUs, up to LCU_ASM_CACHE_SIZE of them. The cache keeps the integer value of the word, and
+        each call gets a word object of its own, since the IMEM keeps the object it is given'''
+        ret = LCU.asm_cache.get(instr)
+        if ret is None:
+            ret = self.encodeAsm(instr)
+            ret = ret[:-1] + (int(ret[-1].get_word(), 2),)
+            if len(LCU.asm_cache) >= LCU_ASM_CACHE_SIZE:
+                del LCU.asm_cache[next(iter(LCU.asm_cache))] # The oldest one
+            LCU.asm_cache[instr] = ret
+        return ret[:-1] + (LCU_IMEM_WORD(hex_word=hex(ret[-1])),)
+
+    def encodeAsm(self, instr):
         space_instr = instr.replace(",", " ")
         split_instr = [word for word in space_instr.split(" ") if word]
         try:
@@ -4,7 +4,6 @@ __email__       = "lara.orlandic@epfl.ch"
 
 import numpy as np
 from enum import Enum
-from ctypes import c_int32
 import re
 from .alu import *
 from .srf import SRF_N_REGS
@@ -18,6 +17,9 @@ LSU_NUM_CREG = 64
 # Widths of instructions of each specialized slot in bits
 LSU_IMEM_WIDTH = 20
 
+# Number of integer fields of a decoded instruction (see LSU_IMEM_WORD.decode_word)
+LSU_IMEM_N_FIELDS = 7
+
 # LSU IMEM word decoding
 class LSU_ALU_OPS(int, Enum):
     '''LSU ALU operation codes'''
@@ -81,21 +83,68 @@ class SHUFFLE_SEL(int, Enum):
     CONCAT_BITREV_LOWER = 5
     CONCAT_SLICE_CIRCULAR_SHIFT_UPPER = 6
     CONCAT_SLICE_CIRCULAR_SHIFT_LOWER = 7
+
+def shuffleIndices(n_elems):
+    '''Gather table of the shuffles: row SHUFFLE_SEL holds, for each word of VWR C, its index in the
+    concatenation of VWRs A and B (A first). Each VWR has n_elems words, a power of two'''
+    a = np.arange(n_elems)
+    b = a + n_elems
+    # Words of A and B in turns: a0, b0, a1, b1...
+    interleaved = np.stack((a, b), axis=1).ravel()
+    # Words in bit-reversed order of their index, in turns from A and B
+    n_bits = n_elems.bit_length() - 1
+    rev = np.zeros(n_elems, dtype=np.int64)
+    for bit in range(n_bits):
+        rev |= ((a >> bit) & 1) << (n_bits - 1 - bit)
+    brev = np.stack((rev, rev + n_elems), axis=1).ravel()
+    # A and B shifted one word to the left, with the first word of A at the end
+    cshift = np.concatenate((a[1:], b, a[:1]))
+    table = np.zeros((len(SHUFFLE_SEL), n_elems), dtype=np.intp)
+    table[SHUFFLE_SEL.INTERLEAVE_UPPER] = interleaved[:n_elems]
+    table[SHUFFLE_SEL.INTERLEAVE_LOWER] = interleaved[n_elems:]
+    table[SHUFFLE_SEL.EVEN_INDICES] = np.concatenate((a[::2], b[::2]))
+    table[SHUFFLE_SEL.ODD_INDICES] = np.concatenate((a[1::2], b[1::2]))
+    table[SHUFFLE_SEL.CONCAT_BITREV_UPPER] = brev[:n_elems]
+    table[SHUFFLE_SEL.CONCAT_BITREV_LOWER] = brev[n_elems:]
+    table[SHUFFLE_SEL.CONCAT_SLICE_CIRCULAR_SHIFT_UPPER] = cshift[:n_elems]
+    table[SHUFFLE_SEL.CONCAT_SLICE_CIRCULAR_SHIFT_LOWER] = cshift[n_elems:]
+    return table
+
+SHUFFLE_INDICES = shuffleIndices(N_ELEMS_PER_VWR)
     
 # LOAD STORE UNIT (LSU) #
 
 class LSU_IMEM:
     '''Instruction memory of the Load Store Unit'''
+    # IMEM and fields of a memory full of default instructions, see __init__
+    default_imem = None
+    default_fields = None
+
     def __init__(self):
-        self.IMEM = np.zeros(LSU_NUM_CREG,dtype="S{0}".format(LSU_IMEM_WIDTH))
-        # Initialize kernel memory with default instruction
-        default_word = LSU_IMEM_WORD()
-        for i, instruction in enumerate(self.IMEM):
-            self.IMEM[i] = default_word.get_word()
+        # Initialize memory with default instruction, copied from the one built by the first IMEM
+        if LSU_IMEM.default_imem is None:
+            default_word = LSU_IMEM_WORD()
+            LSU_IMEM.default_imem = np.full(LSU_NUM_CREG, default_word.get_word(), dtype="S{0}".format(LSU_IMEM_WIDTH))
+            LSU_IMEM.default_fields = np.tile(np.array(default_word.decode_word(), dtype=np.int32), (LSU_NUM_CREG, 1))
+        self.IMEM = LSU_IMEM.default_imem.copy()
+        # Integer fields of each instruction, decoded once when the word is written
+        self.fields = LSU_IMEM.default_fields.copy()
     
     def set_word(self, kmem_word, pos):
         '''Set the IMEM index at integer pos to the binary imem word'''
         self.IMEM[pos] = np.binary_repr(kmem_word,width=LSU_IMEM_WIDTH)
+        self.fields[pos] = self.decode_fields(kmem_word)
+    
+    def decode_fields(self, kmem_word):
+        '''Decode an integer imem word into its integer fields, in the order of LSU_IMEM_WORD.decode_word'''
+        rf_wsel = kmem_word & 0x7
+        rf_we = (kmem_word >> 3) & 0x1
+        alu_op = (kmem_word >> 4) & 0x7
+        muxb_sel = (kmem_word >> 7) & 0xF
+        muxa_sel = (kmem_word >> 11) & 0xF
+        vwr_sel_shuf_op = (kmem_word >> 15) & 0x7
+        mem_op = (kmem_word >> 18) & 0x3
+        return rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel, vwr_sel_shuf_op, mem_op
     
     def set_params(self, rf_wsel=0, rf_we=0, alu_op=LSU_ALU_OPS.LAND, muxb_sel=LSU_MUX_SEL.ZERO, muxa_sel=LSU_MUX_SEL.ZERO, vwr_sel_shuf_op=LSU_VWR_SEL.VWR_A, mem_op=LSU_MEM_OP.NOP, pos=0):
         '''Set the IMEM index at integer pos to the configuration parameters.
@@ -103,6 +152,7 @@ class LSU_IMEM:
         '''
         imem_word = LSU_IMEM_WORD(rf_wsel=rf_wsel, rf_we=rf_we, alu_op=alu_op, muxb_sel=muxb_sel, muxa_sel=muxa_sel, vwr_sel_shuf_op=vwr_sel_shuf_op, mem_op=mem_op)
         self.IMEM[pos] = imem_word.get_word()
+        self.fields[pos] = imem_word.decode_word()
     
     def get_instruction_asm(self, pos, srf_sel, alu_srf_write, srf_we):
         '''Print the human-readable instructions of the instruction at position pos in the instruction memory'''
@@ -332,18 +382,38 @@ class LSU_IMEM_WORD:
         return rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel, vwr_sel_shuf_op, mem_op
     
 
+# Operands of the LSU assembly instructions, compiled once for all the instructions that the assembler parses
+LSU_ASM_PATTERNS = {
+    "r": re.compile(r'^R(\d+)$'),
+    "srf": re.compile(r'^SRF\((\d+)\)$'),
+    "zero": re.compile(r'^ZERO$'),
+    "one": re.compile(r'^ONE$'),
+    "two": re.compile(r'^TWO$'),
+    "srf_mem": re.compile(r'^SRF$'),
+    "vwr_a": re.compile(r'^VWR_A$'),
+    "vwr_b": re.compile(r'^VWR_B$'),
+    "vwr_c": re.compile(r'^VWR_C$'),
+}
+
+# Number of instruction texts whose encoding is remembered by LSU.asmToHex
+LSU_ASM_CACHE_SIZE = 4096
+
 class LSU:
     lsu_arith_ops   = { 'SADD','SSUB','SLL','SRL','LAND','LOR','LXOR', 'BITREV' }
     lsu_nop_ops     = { 'NOP' }
     lsu_mem_ops     = { 'LD.VWR','STR.VWR' }
     lsu_shuf_ops    = { 'SH.IL.UP','SH.IL.LO','SH.EVEN','SH.ODD','SH.BRE.UP','SH.BRE.LO','SH.CSHIFT.UP','SH.CSHIFT.LO' }
+    # Integer words of the instruction texts already assembled, shared by all the LSUs (see asmToHex)
+    asm_cache = {}
 
     def __init__(self):
         self.regs       = [0 for _ in range(LSU_NUM_DREG)]
         self.imem       = LSU_IMEM()
         self.nInstr     = 0
-        self.default_word = LSU_IMEM_WORD().get_word()
+        self.default_word = self.imem.IMEM[0].decode() # The IMEM starts full of default words
         self.alu = ALU()
+        # Concatenation of VWRs A and B for the shuffles
+        self.shuffle_sources = np.zeros(2*N_ELEMS_PER_VWR, dtype=np.int32)
     
     def getMuxValue(self, mux, disco_cgra, col, srf_sel):
         if mux <= 7 : # Rx
@@ -380,32 +450,17 @@ class LSU:
         else:
             raise Exception(self.__class__.__name__ + ": ALU op not recognized")
 
-    def bitReversalShuffle(self, a_array, b_array):
-        bit_reversal_order = [0, 64, 32, 96, 16, 80, 48, 112, 8, 72, 40, 104, 24, 88, 56, 120, 4, 68, 36, 100, 20, 84, 52, 116, 12, 76, 44, 108, 28, 92, 60, 124, 2, 66, 34, 98, 18, 82, 50, 114, 10, 74, 42, 106, 26, 90, 58, 122, 6, 70, 38, 102, 22, 86, 54, 118, 14, 78, 46, 110, 30, 94, 62, 126, 1, 65, 33, 97, 17, 81, 49, 113, 9, 73, 41, 105, 25, 89, 57, 121, 5, 69, 37, 101, 21, 85, 53, 117, 13, 77, 45, 109, 29, 93, 61, 125, 3, 67, 35, 99, 19, 83, 51, 115, 11, 75, 43, 107, 27, 91, 59, 123, 7, 71, 39, 103, 23, 87, 55, 119, 15, 79, 47, 111, 31, 95, 63, 127]
-        res = []
-        for idx in bit_reversal_order:
-            res.append(a_array[idx])
-            res.append(b_array[idx])
-        return res
-
-    def interleavedShuffle(self, a_array, b_array):
-        res = []
-        for idx in range(N_ELEMS_PER_VWR):
-            res.append(a_array[idx])
-            res.append(b_array[idx])
-        return res
-    
     def runMem(self, mem_op, vwr_sel_shuf_op, disco_cgra, col):
         if mem_op == 0: # NOP
             pass # Intentional
         elif mem_op == 1: # LOAD
             if vwr_sel_shuf_op < 3: # VWR_A, B or C
-                disco_cgra.vwrs[col][vwr_sel_shuf_op].values = disco_cgra.spm.getLine(self.regs[7])
+                # Copy, the VWR and the SPM line stay independent
+                disco_cgra.vwrs[col][vwr_sel_shuf_op].values[:] = disco_cgra.spm.getLine(self.regs[7])
             else: # SRF
                 # Only copy the first SRF_N_REGS elements
-                for i in range(SRF_N_REGS):
-                    spm_line = disco_cgra.spm.getLine(self.regs[7])
-                    disco_cgra.srfs[col].regs[i] = spm_line[i]
+                spm_line = disco_cgra.spm.getLine(self.regs[7])
+                disco_cgra.srfs[col].regs[:SRF_N_REGS] = spm_line[:SRF_N_REGS].tolist()
         elif mem_op == 2: # STORE
             if vwr_sel_shuf_op < 3: # VWR_A, B or C
                 disco_cgra.spm.setLine(self.regs[7], disco_cgra.vwrs[col][vwr_sel_shuf_op].values)
@@ -416,39 +471,19 @@ class LSU:
                     spm_line[i] = disco_cgra.srfs[col].regs[i]
                 disco_cgra.spm.setLine(self.regs[7], spm_line)
         elif mem_op == 3: # SHUFFLE
-            a_array = disco_cgra.vwrs[col][0].values
-            b_array = disco_cgra.vwrs[col][1].values
-            interleaved = [val for pair in zip(a_array, b_array) for val in pair]
-            evens = a_array[::2] + b_array[::2]
-            odds = a_array[1::2] + b_array[1::2]
-            brev = self.bitReversalShuffle(a_array, b_array)
-            cshift = a_array[1:] + b_array
-            cshift.append(a_array[0])
-            if vwr_sel_shuf_op == 0: 
-                disco_cgra.vwrs[col][2].values = interleaved[0:SPM_NWORDS-1]
-            elif vwr_sel_shuf_op == 1:
-                disco_cgra.vwrs[col][2].values = interleaved[SPM_NWORDS:]
-            elif vwr_sel_shuf_op == 2:
-                disco_cgra.vwrs[col][2].values = evens
-            elif vwr_sel_shuf_op == 3:
-                disco_cgra.vwrs[col][2].values = odds
-            elif vwr_sel_shuf_op == 4:
-                disco_cgra.vwrs[col][2].values = brev[0:SPM_NWORDS-1]
-            elif vwr_sel_shuf_op == 5:
-                disco_cgra.vwrs[col][2].values = brev[SPM_NWORDS:]
-            elif vwr_sel_shuf_op == 6:
-                disco_cgra.vwrs[col][2].values = cshift[0:SPM_NWORDS-1]
-            elif vwr_sel_shuf_op == 7:
-                disco_cgra.vwrs[col][2].values = cshift[SPM_NWORDS:]
+            # Gather the words of VWR C from VWRs A and B with the table of the shuffle
+            sources = self.shuffle_sources
+            sources[:N_ELEMS_PER_VWR] = disco_cgra.vwrs[col][0].values
+            sources[N_ELEMS_PER_VWR:] = disco_cgra.vwrs[col][1].values
+            np.take(sources, SHUFFLE_INDICES[vwr_sel_shuf_op], out=disco_cgra.vwrs[col][2].values)
         else:
             raise Exception(self.__class__.__name__ + ": MEM op not recognized")
 
-    def run(self, pc, disco_cgra, col):
-        # MXCU info
-        mxcu_asm, selected_vwr, srf_sel, alu_srf_write, srf_we, vwr_row_we = disco_cgra.mxcus[col].imem.get_instruction_asm(pc)
-        # This LSU instruction
-        lsu_hex = self.imem.get_word_in_hex(pc)
-        rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel, vwr_sel_shuf_op, mem_op = LSU_IMEM_WORD(hex_word=lsu_hex).decode_word()
+    def run(self, pc, fields, ctrl, disco_cgra, col):
+        # MXCU control signals of this cycle, shared by all the units of the column
+        srf_sel = ctrl.srf_sel
+        # This LSU instruction (already decoded into integer fields)
+        rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel, vwr_sel_shuf_op, mem_op = fields
         # IMPORTANT: First mem op
         # MEM op
         self.runMem(mem_op, vwr_sel_shuf_op, disco_cgra, col)
@@ -460,17 +495,70 @@ class LSU:
         # Write result locally
         if rf_we == 1:
             self.regs[rf_wsel] = self.alu.newRes
-        
-        # ---------- Print something -----------
-        print(self.__class__.__name__ + ": " + self.imem.get_instruction_asm(pc, srf_sel, alu_srf_write, srf_we) + " --> ALU res = " + str(self.alu.newRes))
 
-    def parseDestArith(self, rd, instr):
-        # Define the regular expression pattern
-        r_pattern = re.compile(r'^R(\d+)$')
-        srf_pattern = re.compile(r'^SRF\((\d+)\)$')
+    def compileMux(self, mux, disco_cgra, col, srf_sel):
+        '''Get a function without arguments that returns the value of the mux, as getMuxValue does. None if the mux is not recognized'''
+        if mux <= 7 : # Rx
+            regs = self.regs
+            return lambda: regs[mux]
+        if mux == 8: # SRF
+            srf_regs = disco_cgra.srfs[col].regs
+            return lambda: srf_regs[srf_sel]
+        constants = { 9: 0, 10: 1, 11: 2 } # ZERO, ONE, TWO
+        if mux in constants:
+            value = constants[mux]
+            return lambda: value
+        return None
 
+    def compileAlu(self, alu_op):
+        '''Get the ALU function of two operands that runs the operation, as runAlu does. None if the operation is not recognized'''
+        alu = self.alu
+        ops = [alu.land, alu.lor, alu.lxor, alu.sadd, alu.ssub, alu.sll, alu.srl, alu.bitrev]
+        if alu_op < len(ops):
+            return ops[alu_op]
+        return None
+
+    def compile(self, pc, fields, ctrl, disco_cgra, col):
+        '''Get a function without arguments that executes the instruction of pc like run() does, with the memory
+        operation, the operand sources and the ALU operation already selected. Not recognized encodings run through run().'''
+        rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel, vwr_sel_shuf_op, mem_op = fields
+        get_a = self.compileMux(muxa_sel, disco_cgra, col, ctrl.srf_sel)
+        get_b = self.compileMux(muxb_sel, disco_cgra, col, ctrl.srf_sel)
+        alu_fn = self.compileAlu(alu_op)
+        if get_a is None or get_b is None or alu_fn is None:
+            return lambda: self.run(pc, fields, ctrl, disco_cgra, col)
+        regs = self.regs
+        alu = self.alu
+        run_mem = self.runMem
+        if mem_op == 0: # No MEM op
+            if rf_we == 1:
+                def slot():
+                    alu_fn(get_a(), get_b())
+                    regs[rf_wsel] = alu.newRes
+            else:
+                def slot():
+                    alu_fn(get_a(), get_b())
+        else:
+            # IMPORTANT: First mem op
+            if rf_we == 1:
+                def slot():
+                    run_mem(mem_op, vwr_sel_shuf_op, disco_cgra, col)
+                    alu_fn(get_a(), get_b())
+                    regs[rf_wsel] = alu.newRes
+            else:
+                def slot():
+                    run_mem(mem_op, vwr_sel_shuf_op, disco_cgra, col)
+                    alu_fn(get_a(), get_b())
+        return slot
+
+    def get_trace_asm(self, pc, disco_cgra, col):
+        '''Disassembly of the instruction at pc as executed by this LSU, for the trace of the simulator'''
+        mxcu_asm, selected_vwr, srf_sel, alu_srf_write, srf_we, vwr_row_we = disco_cgra.mxcus[col].imem.get_instruction_asm(pc)
+        return self.imem.get_instruction_asm(pc, srf_sel, alu_srf_write, srf_we)
+
+    def parseDestArith(self, rd, instr):
         # Check if the input matches the 'R' pattern
-        r_match = r_pattern.match(rd)
+        r_match = LSU_ASM_PATTERNS["r"].match(rd)
         if r_match:
             ret = None
             try:
@@ -480,22 +568,15 @@ class LSU:
             return ret, -1
 
         # Check if the input matches the 'SRF' pattern
-        srf_match = srf_pattern.match(rd)
+        srf_match = LSU_ASM_PATTERNS["srf"].match(rd)
         if srf_match:
             return LSU_DEST_REGS["SRF"], int(srf_match.group(1))
 
         return None, -1
 
     def parseMuxArith(self, rs, instr):
-        # Define the regular expression pattern
-        r_pattern = re.compile(r'^R(\d+)$')
-        srf_pattern = re.compile(r'^SRF\((\d+)\)$')
-        zero_pattern = re.compile(r'^ZERO$')
-        one_pattern = re.compile(r'^ONE$')
-        two_pattern = re.compile(r'^TWO$')
-
         # Check if the input matches the 'R' pattern
-        r_match = r_pattern.match(rs)
+        r_match = LSU_ASM_PATTERNS["r"].match(rs)
         if r_match:
             ret = None
             try:
@@ -505,57 +586,64 @@ class LSU:
             return ret, -1
 
         # Check if the input matches the 'SRF' pattern
-        srf_match = srf_pattern.match(rs)
+        srf_match = LSU_ASM_PATTERNS["srf"].match(rs)
         if srf_match:
             return LSU_MUX_SEL["SRF"], int(srf_match.group(1))
         
         # Check if the input matches the 'ZERO' pattern
-        zero_match = zero_pattern.match(rs)
+        zero_match = LSU_ASM_PATTERNS["zero"].match(rs)
         if zero_match:
             return LSU_MUX_SEL[rs], -1
         
         # Check if the input matches the 'ONE' pattern
-        one_match = one_pattern.match(rs)
+        one_match = LSU_ASM_PATTERNS["one"].match(rs)
         if one_match:
             return LSU_MUX_SEL[rs], -1
         
         # Check if the input matches the 'TWO' pattern
-        two_match = two_pattern.match(rs)
+        two_match = LSU_ASM_PATTERNS["two"].match(rs)
         if two_match:
             return LSU_MUX_SEL[rs], -1
 
         return None, -1
     
     def parseDestMem(self, rd):
-        # Define the regular expression pattern
-        srf_pattern = re.compile(r'^SRF$')
-        vwr_a = re.compile(r'^VWR_A$')
-        vwr_b = re.compile(r'^VWR_B$')
-        vwr_c = re.compile(r'^VWR_C$')
-
         # Check if the input matches the 'SRF' pattern
-        srf_match = srf_pattern.match(rd)
+        srf_match = LSU_ASM_PATTERNS["srf_mem"].match(rd)
         if srf_match:
             return LSU_VWR_SEL["SRF"]
 
         # Check if the input matches the 'VWR_A' pattern
-        vwra_match = vwr_a.match(rd)
+        vwra_match = LSU_ASM_PATTERNS["vwr_a"].match(rd)
         if vwra_match:
             return LSU_VWR_SEL["VWR_A"]
         
         # Check if the input matches the 'VWR_B' pattern
-        vwrb_match = vwr_b.match(rd)
+        vwrb_match = LSU_ASM_PATTERNS["vwr_b"].match(rd)
         if vwrb_match:
             return LSU_VWR_SEL["VWR_B"]
         
         # Check if the input matches the 'VWR_C' pattern
-        vwrc_match = vwr_c.match(rd)
+        vwrc_match = LSU_ASM_PATTERNS["vwr_c"].match(rd)
         if vwrc_match:
             return LSU_VWR_SEL["VWR_C"]
 
         return None
 
     def asmToHex(self, instr):
+        '''Encode an LSU instruction, see encodeAsm. The encoding only depends on the text, so each text is encoded
+        once for all the LSUs, up to LSU_ASM_CACHE_SIZE of them. The cache keeps the integer value of the word, and
+        each call gets a word object of its own, since the IMEM keeps the object it is given'''
+        ret = LSU.asm_cache.get(instr)
+        if ret is None:
+            ret = self.encodeAsm(instr)
+            ret = ret[:-1] + (int(ret[-1].get_word(), 2),)
+            if len(LSU.asm_cache) >= LSU_ASM_CACHE_SIZE:
+                del LSU.asm_cache[next(iter(LSU.asm_cache))] # The oldest one
+            LSU.asm_cache[instr] = ret
+        return ret[:-1] + (LSU_IMEM_WORD(hex_word=hex(ret[-1])),)
+
+    def encodeAsm(self, instr):
 
         instructions = instr.split("/")
         split_instr = [itr.replace(",", " ") for itr in instructions]
@@ -4,7 +4,6 @@ __email__       = "lara.orlandic@epfl.ch"
 
 import numpy as np
 from enum import Enum
-from ctypes import c_int32
 import re
 from .alu import *
 
@@ -19,6 +18,9 @@ MXCU_NUM_CREG = 64
 # Widths of instructions of each specialized slot in bits
 MXCU_IMEM_WIDTH = 27
 
+# Number of integer fields of a decoded instruction (see MXCU_IMEM.decode_fields)
+MXCU_IMEM_N_FIELDS = 10
+
 # MXCU IMEM word decoding
 class MXCU_ALU_OPS(int, Enum):
     '''MXCU ALU operation codes'''
@@ -73,21 +75,63 @@ class MXCU_VWR_SEL(int, Enum):
     VWR_B = 1
     VWR_C = 2
     
-    
+
+class MXCU_CONTROL:
+    '''Control signals of an MXCU instruction that are shared with the other units of its column:
+
+       -   vwr_row_we: bit mask of the VWR rows (slices) written this cycle, where bit i enables the write of RC i
+       -   vwr_sel: VWR written by the RCs (see MXCU_VWR_SEL)
+       -   srf_sel: SRF register read (and written if srf_we) by all the units of the column
+       -   alu_srf_write: specialized slot whose ALU result is written to the SRF (see ALU_SRF_WRITE)
+       -   srf_we: write enable to the SRF
+    '''
+    __slots__ = ("vwr_row_we", "vwr_sel", "srf_sel", "alu_srf_write", "srf_we")
+
+    def __init__(self, vwr_row_we=0, vwr_sel=0, srf_sel=0, alu_srf_write=0, srf_we=0):
+        self.vwr_row_we = vwr_row_we
+        self.vwr_sel = vwr_sel
+        self.srf_sel = srf_sel
+        self.alu_srf_write = alu_srf_write
+        self.srf_we = srf_we
+
 # MULTIPLEXER CONTROL UNIT (MXCU) #
 
 class MXCU_IMEM:
     '''Instruction memory of the Multiplexer control unit'''
+    # IMEM and fields of a memory full of default instructions, see __init__
+    default_imem = None
+    default_fields = None
+
     def __init__(self):
-        self.IMEM = np.zeros(MXCU_NUM_CREG,dtype="S{0}".format(MXCU_IMEM_WIDTH))
-        # Initialize kernel memory with default word
-        default_word = MXCU_IMEM_WORD()
-        for i, instruction in enumerate(self.IMEM):
-            self.IMEM[i] = default_word.get_word()
+        # Initialize memory with default instruction, copied from the one built by the first IMEM
+        if MXCU_IMEM.default_imem is None:
+            default_word = MXCU_IMEM_WORD()
+            MXCU_IMEM.default_imem = np.full(MXCU_NUM_CREG, default_word.get_word(), dtype="S{0}".format(MXCU_IMEM_WIDTH))
+            MXCU_IMEM.default_fields = np.tile(np.array(self.decode_fields(int(default_word.get_word(), 2)), dtype=np.int32), (MXCU_NUM_CREG, 1))
+        self.IMEM = MXCU_IMEM.default_imem.copy()
+        # Integer fields of each instruction, decoded once when the word is written
+        self.fields = MXCU_IMEM.default_fields.copy()
     
     def set_word(self, kmem_word, pos):
         '''Set the IMEM index at integer pos to the binary imem word'''
         self.IMEM[pos] = np.binary_repr(kmem_word,width=MXCU_IMEM_WIDTH)
+        self.fields[pos] = self.decode_fields(kmem_word)
+    
+    def decode_fields(self, kmem_word):
+        '''Decode an integer imem word into its integer fields, in the order of MXCU_IMEM_WORD.decode_word.
+        The VWR row write enables are kept as a bit mask where bit i enables the write of RC i.
+        '''
+        vwr_row_we = kmem_word & 0xF
+        vwr_sel = (kmem_word >> 4) & 0x3
+        srf_sel = (kmem_word >> 6) & 0x7
+        alu_srf_write = (kmem_word >> 9) & 0x3
+        srf_we = (kmem_word >> 11) & 0x1
+        rf_wsel = (kmem_word >> 12) & 0x7
+        rf_we = (kmem_word >> 15) & 0x1
+        alu_op = (kmem_word >> 16) & 0x7
+        muxb_sel = (kmem_word >> 19) & 0xF
+        muxa_sel = (kmem_word >> 23) & 0xF
+        return vwr_row_we, vwr_sel, srf_sel, alu_srf_write, srf_we, rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel
     
     def set_params(self, vwr_row_we=[0,0,0,0], vwr_sel=MXCU_VWR_SEL.VWR_A, srf_sel=0, alu_srf_write=ALU_SRF_WRITE.LCU, srf_we=0, rf_wsel=0, rf_we=0, alu_op=MXCU_ALU_OPS.NOP, muxb_sel=MXCU_MUX_SEL.R0, muxa_sel=MXCU_MUX_SEL.R0, pos=0):
         '''Set the IMEM index at integer pos to the configuration parameters.
@@ -97,7 +141,13 @@ class MXCU_IMEM:
         #Convert one-hot array of int/bool to binary
         imem_word = MXCU_IMEM_WORD(vwr_row_we=vwr_row_we, vwr_sel=vwr_sel, srf_sel=srf_sel, alu_srf_write=alu_srf_write, srf_we=srf_we, rf_wsel=rf_wsel, rf_we=rf_we, alu_op=alu_op, muxb_sel=muxb_sel, muxa_sel=muxa_sel)
         self.IMEM[pos] = imem_word.get_word()
+        self.fields[pos] = self.decode_fields(int(imem_word.get_word(), 2))
     
+    def get_control(self, pos):
+        '''Get the MXCU_CONTROL signals of the instruction at position pos, taken from its decoded fields'''
+        vwr_row_we, vwr_sel, srf_sel, alu_srf_write, srf_we = self.fields[pos, :5].tolist()
+        return MXCU_CONTROL(vwr_row_we, vwr_sel, srf_sel, alu_srf_write, srf_we)
+
     def get_instruction_asm(self, pos):
         '''Print the human-readable instructions of the instruction at position pos in the instruction memory'''
         imem_word = MXCU_IMEM_WORD()
@@ -305,15 +355,31 @@ class MXCU_IMEM_WORD:
         return reverse, vwr_sel, srf_sel, alu_srf_write, srf_we, rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel
     
 
+# Operands of the MXCU assembly instructions, compiled once for all the instructions that the assembler parses
+MXCU_ASM_PATTERNS = {
+    "r": re.compile(r'^R(\d+)$'),
+    "srf": re.compile(r'^SRF\((\d+)\)$'),
+    "zero": re.compile(r'^ZERO$'),
+    "one": re.compile(r'^ONE$'),
+    "two": re.compile(r'^TWO$'),
+    "half": re.compile(r'^HALF$'),
+    "last": re.compile(r'^LAST$'),
+}
+
+# Number of instruction texts whose encoding is remembered by MXCU.asmToHex
+MXCU_ASM_CACHE_SIZE = 4096
+
 class MXCU:
     mxcu_arith_ops   = { 'SADD', 'SSUB','SLL','SRL','LAND','LOR','LXOR' }
     mxcu_nop_ops     = { 'NOP' }
+    # Integer words of the instruction texts already assembled, shared by all the MXCUs (see asmToHex)
+    asm_cache = {}
 
     def __init__(self):
         self.regs       = [0 for _ in range(MXCU_NUM_DREG)]
         self.imem       = MXCU_IMEM()
         self.nInstr     = 0
-        self.default_word = MXCU_IMEM_WORD().get_word()
+        self.default_word = self.imem.IMEM[0].decode() # The IMEM starts full of default words
         self.alu = ALU()
     
     def getMuxValue(self, mux, disco_cgra, col, srf_sel):
@@ -356,42 +422,111 @@ class MXCU:
             raise Exception(self.__class__.__name__ + ": ALU op not recognized")
 
         
-    def run(self, pc, disco_cgra, col):
-        # This MXCU instruction
-        mxcu_hex = self.imem.get_word_in_hex(pc)
-        one_hot_vwr_row_we, vwr_sel, srf_sel, alu_srf_write, srf_we, rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel = MXCU_IMEM_WORD(hex_word=mxcu_hex).decode_word()
+    def run(self, pc, fields, ctrl, disco_cgra, col):
+        # This MXCU instruction (already decoded into integer fields), the column control signals are in ctrl
+        rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel = fields[5:]
+        srf_sel = ctrl.srf_sel
         # Get muxes value
         muxa_val = self.getMuxValue(muxa_sel, disco_cgra, col, srf_sel)
         muxb_val = self.getMuxValue(muxb_sel, disco_cgra, col, srf_sel)
         # ALU op
         self.runAlu(alu_op, muxa_val, muxb_val)
         # SRF store control
-        if alu_srf_write == 0: # LCU
-            srf_data = disco_cgra.lcus[col].alu.newRes
-        elif alu_srf_write == 1: # RC0
-            srf_data = disco_cgra.rcs[col][0].alu.newRes
-        elif alu_srf_write == 2: # MXCU
-            srf_data = disco_cgra.mscus[col].alu.newRes
-        else: # LSU
-            srf_data = disco_cgra.lsus[col].alu.newRes
-        if srf_we == 1:
+        if ctrl.srf_we == 1:
+            alu_srf_write = ctrl.alu_srf_write
+            if alu_srf_write == 0: # LCU
+                srf_data = disco_cgra.lcus[col].alu.newRes
+            elif alu_srf_write == 1: # RC0
+                srf_data = disco_cgra.rcs[col][0].alu.newRes
+            elif alu_srf_write == 2: # MXCU
+                srf_data = self.alu.newRes
+            else: # LSU
+                srf_data = disco_cgra.lsus[col].alu.newRes
             disco_cgra.srfs[col].regs[srf_sel] = srf_data
         # VWR store control
-        vwr_dest = disco_cgra.vwrs[col][vwr_sel]
-        mxcu_r0 = disco_cgra.mxcus[col].regs[0] # VWR_IDX
-        mxcu_mask = disco_cgra.mxcus[col].regs[5+vwr_sel] # R5, 6 or 7 for VWR_A, B or C
-        slice_idx = mxcu_r0 & mxcu_mask
-        slice_size = int(SPM_NWORDS/CGRA_ROWS)
-        for row in range(CGRA_ROWS):
-            if one_hot_vwr_row_we[row] == 1:
-                vwr_idx = slice_idx + slice_size*row
-                vwr_dest.values[vwr_idx] = disco_cgra.rcs[col][row].alu.newRes
+        vwr_row_we_mask = ctrl.vwr_row_we
+        if vwr_row_we_mask:
+            vwr_sel = ctrl.vwr_sel
+            vwr_dest = disco_cgra.vwrs[col][vwr_sel]
+            mxcu_r0 = self.regs[0] # VWR_IDX
+            mxcu_mask = self.regs[5+vwr_sel] # R5, 6 or 7 for VWR_A, B or C
+            slice_idx = mxcu_r0 & mxcu_mask
+            slice_size = int(SPM_NWORDS/CGRA_ROWS)
+            for row in range(CGRA_ROWS):
+                if (vwr_row_we_mask >> row) & 1:
+                    vwr_idx = slice_idx + slice_size*row
+                    vwr_dest.setIdx(vwr_idx, disco_cgra.rcs[col][row].alu.newRes)
 
         # Write result locally
         if rf_we == 1:
             self.regs[rf_wsel] = self.alu.newRes
-        
-        # ---------- Print something -----------
+
+    def compileMux(self, mux, disco_cgra, col, srf_sel):
+        '''Get a function without arguments that returns the value of the mux, as getMuxValue does. None if the mux is not recognized'''
+        if mux <= 7 : # Rx
+            regs = self.regs
+            return lambda: regs[mux]
+        if mux == 8: # SRF
+            srf_regs = disco_cgra.srfs[col].regs
+            return lambda: srf_regs[srf_sel]
+        constants = { 9: 0, 10: 1, 11: 2, 12: int(SPM_NWORDS/CGRA_ROWS/2) -1, 13: int(SPM_NWORDS/CGRA_ROWS) -1 } # ZERO, ONE, TWO, HALF, LAST
+        if mux in constants:
+            value = constants[mux]
+            return lambda: value
+        return None
+
+    def compileAlu(self, alu_op):
+        '''Get the ALU function of two operands that runs the operation, as runAlu does. None if the operation is not recognized'''
+        alu = self.alu
+        ops = [None, alu.sadd, alu.ssub, alu.sll, alu.srl, alu.land, alu.lor, alu.lxor]
+        if alu_op == 0: # NOP
+            return lambda muxa_val, muxb_val: None
+        if alu_op < len(ops):
+            return ops[alu_op]
+        return None
+
+    def compile(self, pc, fields, ctrl, disco_cgra, col):
+        '''Get a function without arguments that executes the instruction of pc like run() does, with the operand sources,
+        the ALU operation and the SRF and VWR writes already selected. Not recognized encodings run through run().'''
+        rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel = fields[5:]
+        get_a = self.compileMux(muxa_sel, disco_cgra, col, ctrl.srf_sel)
+        get_b = self.compileMux(muxb_sel, disco_cgra, col, ctrl.srf_sel)
+        alu_fn = self.compileAlu(alu_op)
+        vwr_sel = ctrl.vwr_sel
+        if get_a is None or get_b is None or alu_fn is None or (ctrl.vwr_row_we and vwr_sel >= len(disco_cgra.vwrs[col])):
+            return lambda: self.run(pc, fields, ctrl, disco_cgra, col)
+        regs = self.regs
+        alu = self.alu
+        # SRF store control: the ALU whose result is written
+        srf_regs = disco_cgra.srfs[col].regs
+        srf_sel = ctrl.srf_sel
+        srf_source = None
+        if ctrl.srf_we == 1:
+            srf_source = [disco_cgra.lcus[col].alu, disco_cgra.rcs[col][0].alu, alu, disco_cgra.lsus[col].alu][ctrl.alu_srf_write] # LCU, RC0, MXCU or LSU
+        # VWR store control: the offset of the slice of each row written and the ALU of its RC
+        vwr_rows = []
+        if ctrl.vwr_row_we:
+            vwr_dest = disco_cgra.vwrs[col][vwr_sel]
+            mask_reg = 5 + vwr_sel # R5, 6 or 7 for VWR_A, B or C
+            slice_size = int(SPM_NWORDS/CGRA_ROWS)
+            vwr_rows = [(slice_size*row, disco_cgra.rcs[col][row].alu) for row in range(CGRA_ROWS) if (ctrl.vwr_row_we >> row) & 1]
+
+        def slot():
+            alu_fn(get_a(), get_b())
+            if srf_source is not None:
+                srf_regs[srf_sel] = srf_source.newRes
+            if vwr_rows:
+                slice_idx = regs[0] & regs[mask_reg] # R0 is VWR_IDX
+                values = vwr_dest.values
+                for vwr_offset, rc_alu in vwr_rows:
+                    # Wrapped to a 32-bit word
+                    values[slice_idx + vwr_offset] = ((rc_alu.newRes + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+            if rf_we == 1:
+                regs[rf_wsel] = alu.newRes
+        return slot
+
+    def get_trace_asm(self, pc, disco_cgra, col):
+        '''Disassembly of the instruction at pc as executed by this MXCU, for the trace of the simulator'''
         mxcu_asm, selected_vwr, srf_sel, alu_srf_write, srf_we, vwr_row_we = self.imem.get_instruction_asm(pc)
         if srf_we == 0:
             write_srf = "not writting SRF"
@@ -400,15 +535,12 @@ class MXCU:
                 if op.value == alu_srf_write:
                     dest = op.name
             write_srf = "writting SRF(" + str(srf_sel) + ") from " + dest
-        print(self.__class__.__name__ + ": " + mxcu_asm + " (VWR selected: " + str(vwr_sel) + ", " + write_srf + ", R0: " + str(self.regs[0]) + ") --> ALU res = " + str(self.alu.newRes))
+        vwr_sel = MXCU_VWR_SEL[selected_vwr].value
+        return mxcu_asm + " (VWR selected: " + str(vwr_sel) + ", " + write_srf + ", R0: " + str(self.regs[0]) + ")"
 
     def parseDestArith(self, rd, instr):
-        # Define the regular expression pattern
-        r_pattern = re.compile(r'^R(\d+)$')
-        srf_pattern = re.compile(r'^SRF\((\d+)\)$')
-
         # Check if the input matches the 'R' pattern
-        r_match = r_pattern.match(rd)
+        r_match = MXCU_ASM_PATTERNS["r"].match(rd)
         if r_match:
             ret = None
             try:
@@ -418,24 +550,15 @@ class MXCU:
             return ret, -1
 
         # Check if the input matches the 'SRF' pattern
-        srf_match = srf_pattern.match(rd)
+        srf_match = MXCU_ASM_PATTERNS["srf"].match(rd)
         if srf_match:
             return MXCU_DEST_REGS["SRF"], int(srf_match.group(1))
 
         return None, -1
 
     def parseMuxArith(self, rs, instr):
-        # Define the regular expression pattern
-        r_pattern = re.compile(r'^R(\d+)$')
-        srf_pattern = re.compile(r'^SRF\((\d+)\)$')
-        zero_pattern = re.compile(r'^ZERO$')
-        one_pattern = re.compile(r'^ONE$')
-        two_pattern = re.compile(r'^TWO$')
-        half_pattern = re.compile(r'^HALF$')
-        last_pattern = re.compile(r'^LAST$')
-
         # Check if the input matches the 'R' pattern
-        r_match = r_pattern.match(rs)
+        r_match = MXCU_ASM_PATTERNS["r"].match(rs)
         if r_match:
             ret = None
             try:
@@ -445,38 +568,52 @@ class MXCU:
             return ret, -1
 
         # Check if the input matches the 'SRF' pattern
-        srf_match = srf_pattern.match(rs)
+        srf_match = MXCU_ASM_PATTERNS["srf"].match(rs)
         if srf_match:
             return MXCU_MUX_SEL["SRF"], int(srf_match.group(1))
         
         # Check if the input matches the 'ZERO' pattern
-        zero_match = zero_pattern.match(rs)
+        zero_match = MXCU_ASM_PATTERNS["zero"].match(rs)
         if zero_match:
             return MXCU_MUX_SEL[rs], -1
         
         # Check if the input matches the 'ONE' pattern
-        one_match = one_pattern.match(rs)
+        one_match = MXCU_ASM_PATTERNS["one"].match(rs)
         if one_match:
             return MXCU_MUX_SEL[rs], -1
         
         # Check if the input matches the 'TWO' pattern
-        two_match = two_pattern.match(rs)
+        two_match = MXCU_ASM_PATTERNS["two"].match(rs)
         if two_match:
             return MXCU_MUX_SEL[rs], -1
         
         # Check if the input matches the 'HALF' pattern
-        half_match = half_pattern.match(rs)
+        half_match = MXCU_ASM_PATTERNS["half"].match(rs)
         if half_match:
             return MXCU_MUX_SEL[rs], -1
         
         # Check if the input matches the 'LAST' pattern
-        last_match = last_pattern.match(rs)
+        last_match = MXCU_ASM_PATTERNS["last"].match(rs)
         if last_match:
             return MXCU_MUX_SEL[rs], -1
 
         return None, -1
     
     def asmToHex(self, instr, srf_sel, srf_we, alu_srf_write, vwr_row_we, vwr_sel):
+        '''Encode an MXCU instruction with the SRF and VWR control of its cycle, see encodeAsm. The encoding does not
+        depend on the MXCU, so each combination is encoded once for all of them, up to MXCU_ASM_CACHE_SIZE ones. The
+        cache keeps the integer value of the word, and each call gets a word object of its own, since the IMEM keeps
+        the object it is given'''
+        key = (instr, srf_sel, srf_we, alu_srf_write, tuple(vwr_row_we), vwr_sel)
+        word = MXCU.asm_cache.get(key)
+        if word is None:
+            word = int(self.encodeAsm(*key).get_word(), 2)
+            if len(MXCU.asm_cache) >= MXCU_ASM_CACHE_SIZE:
+                del MXCU.asm_cache[next(iter(MXCU.asm_cache))] # The oldest one
+            MXCU.asm_cache[key] = word
+        return MXCU_IMEM_WORD(hex_word=hex(word))
+
+    def encodeAsm(self, instr, srf_sel, srf_we, alu_srf_write, vwr_row_we, vwr_sel):
         # Set default value for params
         rf_wsel=0
         rf_we=0
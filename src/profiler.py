@@ -0,0 +1,160 @@
+"""profiler.py: Profile of the pcs of a kernel run, annotated with the instructions of its asm file"""
+
+import os
+import io
+import csv
+import sys
+import argparse
+import contextlib
+
+from .params import *
+
+class KERNEL_PROFILE:
+    '''Where the cycles of a kernel run go, from its RUN_STATS (see SIMULATOR.run(stats=True)):
+
+       -   cycles: number of cycles of the run
+       -   counts: times each pc was executed (the pc is the same for all the columns), so each one takes
+           counts[pc]/cycles of the run
+       -   slots: {col: one list per pc with the instruction of each slot}, as written in the asm file or, without
+           it, disassembled from the IMEMs of the units
+       -   lines: {col: line of the asm file of each pc} (None without asm file). The asm file has a header and
+           then the instructions of each used column one after the other
+       -   loops: the loops of the run, most cycles first, see find_loops
+    '''
+    def __init__(self, stats, disco_cgra, asm_path=None):
+        self.cycles = stats.cycles
+        self.counts = stats.pc_counts
+        self.cols = stats.cols
+        self.asm_path = asm_path
+        n_instr = len(self.counts)
+        self.slot_names = ["LCU", "LSU", "MXCU"] + ["RC" + str(rc) for rc in range(CGRA_ROWS)]
+        if asm_path is not None:
+            self.slots, self.lines = self.read_asm(asm_path, n_instr)
+        else:
+            self.slots = { col: [self.disassemble(disco_cgra, col, pc) for pc in range(n_instr)] for col in self.cols }
+            self.lines = { col: [None for _ in range(n_instr)] for col in self.cols }
+        self.loops = self.find_loops(stats.branch_counts)
+
+    def read_asm(self, asm_path, n_instr):
+        '''Get the slots and lines of the used columns from an asm file'''
+        with open(asm_path, 'r') as f:
+            rows = list(csv.reader(f))
+        header = rows[0]
+        for name in self.slot_names:
+            if name not in header:
+                raise Exception("Column " + name + " not found in the header of " + asm_path + ".")
+        idx = [header.index(name) for name in self.slot_names]
+        if len(rows) - 1 < len(self.cols)*n_instr:
+            raise Exception("Not enough instructions in " + asm_path + ". It should have " + str(len(self.cols)*n_instr) + " rows plus the header.")
+        slots = {}
+        lines = {}
+        for i, col in enumerate(self.cols):
+            first_row = 1 + i*n_instr
+            slots[col] = [[rows[first_row + pc][j] for j in idx] for pc in range(n_instr)]
+            lines[col] = [first_row + pc + 1 for pc in range(n_instr)] # Lines of the file start at 1
+        return slots, lines
+
+    def disassemble(self, disco_cgra, col, pc):
+        '''Instructions of each slot at pc of a column, from the IMEMs of the units'''
+        slots = [disco_cgra.lcus[col].get_trace_asm(pc, disco_cgra, col), disco_cgra.lsus[col].get_trace_asm(pc, disco_cgra, col),
+                 disco_cgra.mxcus[col].imem.get_instruction_asm(pc)[0]]
+        for row in range(CGRA_ROWS):
+            slots.append(disco_cgra.rcs[col][row].get_trace_asm(pc, disco_cgra, col, row))
+        return slots
+
+    def find_loops(self, branch_counts):
+        '''Get the loops of the run from its taken branches, most cycles first. A taken branch back to an earlier (or
+        the same) pc closes a loop from that pc to the branch; the branches back to the same pc make one loop. Each
+        loop is a dict:
+            -   first, last: first and last pc of the body
+            -   depth: number of loops that contain it (0 for an outermost loop)
+            -   cycles: cycles spent in the body, its share of the run in percent
+            -   iterations: times the first pc of the body ran, entries: times the loop was entered
+        '''
+        back_branches = {}
+        for (col, pc, target), n in branch_counts.items():
+            if 0 <= target <= pc:
+                last, taken = back_branches.get(target, (pc, 0))
+                back_branches[target] = (max(last, pc), taken + n)
+        loops = []
+        for first, (last, taken) in back_branches.items():
+            cycles = int(self.counts[first:last+1].sum())
+            iterations = int(self.counts[first])
+            loops.append({ "first": first, "last": last, "cycles": cycles, "share": 100*cycles/self.cycles if self.cycles else 0.0,
+                           "iterations": iterations, "entries": iterations - taken })
+        for loop in loops:
+            loop["depth"] = sum(1 for other in loops if other is not loop and other["first"] <= loop["first"] and loop["last"] <= other["last"])
+        loops.sort(key=lambda loop: (-loop["cycles"], loop["first"]))
+        return loops
+
+    def annotate(self, col=None):
+        '''Listing of the kernel like perf annotate: for each pc the times it ran, its share of the cycles, the line of
+        the asm file and the instruction of each slot. All the used columns if col is None'''
+        cols = self.cols if col is None else [col]
+        text = []
+        for col in cols:
+            source = os.path.basename(self.asm_path) if self.asm_path is not None else "IMEMs"
+            text.append("Column " + str(col) + " (" + source + "), " + str(self.cycles) + " cycles")
+            text.append("{:>9} {:>8} {:>4} {:>5}  ".format("Count", "Cycles%", "PC", "Line") + " | ".join(self.slot_names))
+            for pc in range(len(self.counts)):
+                count = int(self.counts[pc])
+                share = 100*count/self.cycles if self.cycles else 0.0
+                line = self.lines[col][pc]
+                text.append("{:>9} {:>7.2f}% {:>4} {:>5}  ".format(count, share, pc, line if line is not None else "-") + " | ".join(self.slots[col][pc]))
+            text.append("")
+        return "\n".join(text)
+
+    def loop_report(self):
+        '''Listing of the loops, most cycles first, each one indented by its depth'''
+        text = ["{:>9} {:>8} {:>10} {:>7}  {}".format("Cycles", "Cycles%", "Iterations", "Entries", "Loop")]
+        for loop in self.loops:
+            body = "  "*loop["depth"] + "pc " + str(loop["first"]) + " to " + str(loop["last"])
+            lines = self.lines[self.cols[0]]
+            if lines[loop["first"]] is not None:
+                body += " (lines " + str(lines[loop["first"]]) + " to " + str(lines[loop["last"]]) + ")"
+            text.append("{:>9} {:>7.2f}% {:>10} {:>7}  {}".format(loop["cycles"], loop["share"], loop["iterations"], loop["entries"], body))
+        if not self.loops:
+            text.append("No loops")
+        return "\n".join(text)
+
+    def __str__(self):
+        return self.annotate() + "\n" + self.loop_report()
+
+def main(argv=None):
+    # Run one case of a kernel manifest, as the regression does
+    from .regression import KERNELS_DIR, discover_kernels, default_manifest, case_inputs
+    from .simulator import SIMULATOR, ENGINES
+    parser = argparse.ArgumentParser(description="Profile the pcs of a DISCO-CGRA kernel on one case of its manifest.")
+    parser.add_argument("kernel", help="Name of the kernel")
+    parser.add_argument("--case", default=None, help="Name of the case of the manifest (default: the first one)")
+    parser.add_argument("--kernels-dir", default=KERNELS_DIR, help="Directory of the kernels")
+    parser.add_argument("--engine", default="interpreter", choices=ENGINES, help="Engine of SIMULATOR.run")
+    parser.add_argument("--col", type=int, default=None, help="Only annotate this column")
+    args = parser.parse_args(argv)
+    kernels = { name: (versions, manifest) for name, versions, manifest in discover_kernels(args.kernels_dir) }
+    if args.kernel not in kernels:
+        parser.error("Kernel not found in " + args.kernels_dir + ": " + args.kernel)
+    versions, manifest = kernels[args.kernel]
+    if manifest is None:
+        manifest = default_manifest(args.kernels_dir, args.kernel, versions)
+    cases = [case for case in manifest["cases"] if args.case is None or case["name"] == args.case]
+    if not cases:
+        parser.error("Case not found in the manifest of " + args.kernel + ": " + str(args.case))
+    case = cases[0]
+    kernel_path = os.path.join(args.kernels_dir, args.kernel) + "/"
+    # Some hex versions have no asm file, their instructions are disassembled
+    asm_path = kernel_path + "instructions_asm" + case["version"] + ".csv"
+    sim = SIMULATOR()
+    # The simulator prints the files it loads and other messages, keep the listing clean
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim.kernel_config(case["column_usage"], case["num_instructions_per_col"], case["imem_add_start"], case["srf_spm_address"], 1)
+        sim.loadSPMData(case_inputs(case))
+        sim.kernel_load(kernel_path, version=case["version"], kernel_number=1)
+        profile = sim.profile(1, kernel_path if os.path.exists(asm_path) else None, version=case["version"],
+                              max_iter=case.get("max_iter", 1500), engine=args.engine)
+    print(profile.annotate(args.col))
+    print(profile.loop_report())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,6 @@ __email__       = "lara.orlandic@epfl.ch"
 
 import numpy as np
 from enum import Enum
-from ctypes import c_int32
 import re
 from .params import *
 from .alu import *
@@ -19,6 +18,9 @@ RC_NUM_CREG = 64
 # Widths of instructions of each specialized slot in bits
 RC_IMEM_WIDTH = 18
 
+# Number of integer fields of a decoded instruction (see RC_IMEM_WORD.decode_word)
+RC_IMEM_N_FIELDS = 7
+
 # RC IMEM word decoding
 class RC_ALU_OPS(int, Enum):
     '''RC ALU operation codes'''
@@ -75,16 +77,35 @@ class RC_DEST_REGS(int, Enum):
 
 class RC_IMEM:
     '''Instruction memory of the Reconfigurable Cell'''
+    # IMEM and fields of a memory full of default instructions, see __init__
+    default_imem = None
+    default_fields = None
+
     def __init__(self):
-        self.IMEM = np.zeros(RC_NUM_CREG,dtype="S{0}".format(RC_IMEM_WIDTH))
-        # Initialize kernel memory with default word
-        default_word = RC_IMEM_WORD()
-        for i, instruction in enumerate(self.IMEM):
-            self.IMEM[i] = default_word.get_word()
+        # Initialize memory with default instruction, copied from the one built by the first IMEM
+        if RC_IMEM.default_imem is None:
+            default_word = RC_IMEM_WORD()
+            RC_IMEM.default_imem = np.full(RC_NUM_CREG, default_word.get_word(), dtype="S{0}".format(RC_IMEM_WIDTH))
+            RC_IMEM.default_fields = np.tile(np.array(default_word.decode_word(), dtype=np.int32), (RC_NUM_CREG, 1))
+        self.IMEM = RC_IMEM.default_imem.copy()
+        # Integer fields of each instruction, decoded once when the word is written
+        self.fields = RC_IMEM.default_fields.copy()
     
     def set_word(self, kmem_word, pos):
         '''Set the IMEM index at integer pos to the binary imem word'''
         self.IMEM[pos] = np.binary_repr(kmem_word,width=RC_IMEM_WIDTH)
+        self.fields[pos] = self.decode_fields(kmem_word)
+    
+    def decode_fields(self, kmem_word):
+        '''Decode an integer imem word into its integer fields, in the order of RC_IMEM_WORD.decode_word'''
+        rf_wsel = kmem_word & 0x1
+        rf_we = (kmem_word >> 1) & 0x1
+        muxf_sel = (kmem_word >> 2) & 0x7
+        alu_op = (kmem_word >> 5) & 0xF
+        op_mode = (kmem_word >> 9) & 0x1
+        muxb_sel = (kmem_word >> 10) & 0xF
+        muxa_sel = (kmem_word >> 14) & 0xF
+        return rf_wsel, rf_we, muxf_sel, alu_op, op_mode, muxb_sel, muxa_sel
     
     def set_params(self, rf_wsel=0, rf_we=0, muxf_sel=RC_MUXF_SEL.OWN, alu_op=RC_ALU_OPS.NOP, op_mode=0, muxb_sel=RC_MUX_SEL.VWR_A, muxa_sel=RC_MUX_SEL.VWR_A, pos=0):
         '''Set the IMEM index at integer pos to the configuration parameters.
@@ -92,6 +113,7 @@ class RC_IMEM:
         '''
         imem_word = RC_IMEM_WORD(rf_wsel=rf_wsel, rf_we=rf_we, muxf_sel=muxf_sel, alu_op=alu_op, op_mode=op_mode, muxb_sel=muxb_sel, muxa_sel=muxa_sel)
         self.IMEM[pos] = imem_word.get_word()
+        self.fields[pos] = imem_word.decode_word()
     
     def get_instruction_asm(self, pos, srf_sel, selected_vwr, vwr_re, srf_we, srf_wd, row):
         '''Print the human-readable instructions of the instruction at position pos in the instruction memory'''
@@ -298,10 +320,28 @@ class RC_IMEM_WORD:
         
         return rf_wsel, rf_we, muxf_sel, alu_op, op_mode, muxb_sel, muxa_sel
     
+# Operands of the RC assembly instructions, compiled once for all the instructions that the assembler parses
+RC_ASM_PATTERNS = {
+    "r": re.compile(r'^R(\d+)$'),
+    "srf": re.compile(r'^SRF\((\d+)\)$'),
+    "vwr": re.compile(r'^VWR_([A-Za-z])$'),
+    "rout": re.compile(r'^ROUT$'),
+    "zero": re.compile(r'^ZERO$'),
+    "one": re.compile(r'^ONE$'),
+    "maxInt": re.compile(r'^MAX_INT$'),
+    "minInt": re.compile(r'^MIN_INT$'),
+    "neigh": re.compile(r'^RC([A-Za-z])$'),
+}
+
+# Number of instruction texts whose encoding is remembered by RC.asmToHex
+RC_ASM_CACHE_SIZE = 4096
+
 class RC:
     rc_arith_ops    = { 'MAC','SADD','SSUB','SMUL','SDIV','SLL','SRL','SRA','LAND','LOR', 'LXOR', 'SADD.H','SSUB.H','SMUL.H','SDIV.H','SLL.H','SRL.H','SRA.H','LAND.H','LOR.H','MUL.FXP','DIV.FXP', 'MAC.H' }
     rc_flag_ops     = { 'SFGA','ZFGA' }
     rc_nop_ops      = { 'NOP' }
+    # Integer words of the instruction texts already assembled, shared by all the RCs (see asmToHex)
+    asm_cache = {}
 
     def __init__(self):
         self.regs       = [0 for _ in range(RC_NUM_DREG)]
@@ -309,7 +349,7 @@ class RC:
         self.neighbours = [ALU() for _ in range(4)] # RCT, RCB, RCL, RCR
         self.imem       = RC_IMEM()
         self.nInstr     = 0
-        self.default_word = RC_IMEM_WORD().get_word()
+        self.default_word = self.imem.IMEM[0].decode() # The IMEM starts full of default words
         self.alu = ALU()
     
     # Returns the value for mux
@@ -408,35 +448,109 @@ class RC:
         else:
             raise Exception(self.__class__.__name__ + ": ALU op not recognized")
                 
-    def run(self, pc, disco_cgra, col, row):
-        # MXCU info
-        mxcu_asm, selected_vwr, srf_sel, alu_srf_write, srf_we, vwr_row_we = disco_cgra.mxcus[col].imem.get_instruction_asm(pc)
-        # This RC instruction
-        rc_hex = self.imem.get_word_in_hex(pc)
-        rf_wsel, rf_we, muxf_sel, alu_op, op_mode, muxb_sel, muxa_sel = RC_IMEM_WORD(hex_word=rc_hex).decode_word()
-        # Get muxes value
-        muxa_val = self.getMuxValue(muxa_sel, disco_cgra, col, srf_sel, row)
-        muxb_val = self.getMuxValue(muxb_sel, disco_cgra, col, srf_sel, row)
+    def run(self, pc, fields, ctrl, disco_cgra, col, row):
+        # MXCU control signals of this cycle, shared by all the units of the column
+        srf_sel = ctrl.srf_sel
+        # This RC instruction (already decoded into integer fields)
+        rf_wsel, rf_we, muxf_sel, alu_op, op_mode, muxb_sel, muxa_sel = fields
+        # Get muxes value (a NOP does not use them)
+        muxa_val = muxb_val = 0
+        if alu_op != 0:
+            muxa_val = self.getMuxValue(muxa_sel, disco_cgra, col, srf_sel, row)
+            muxb_val = self.getMuxValue(muxb_sel, disco_cgra, col, srf_sel, row)
         # ALU op
         self.runAlu(alu_op, muxa_val, muxb_val, op_mode, muxf_sel)
         # Write result locally
         if rf_we == 1:
             self.regs[rf_wsel] = self.alu.newRes
 
-        # ---------- Print something -----------
+    def compileMux(self, mux, disco_cgra, col, srf_sel, row):
+        '''Get a function without arguments that returns the value of the mux, as getMuxValue does. None if the mux is not recognized'''
+        if mux <= 2: # VWR_A, VWR_B or VWR_C
+            vwr = disco_cgra.vwrs[col][mux]
+            mxcu_regs = disco_cgra.mxcus[col].regs # R0 is VWR_IDX and R5, 6 or 7 are MASK_VWR_A, B or C
+            mask_reg = 5 + mux
+            vwr_offset = int(SPM_NWORDS/CGRA_ROWS)*row
+            return lambda: vwr.getIdx((mxcu_regs[0] & mxcu_regs[mask_reg]) + vwr_offset)
+        if mux == 3: # SRF
+            srf_regs = disco_cgra.srfs[col].regs
+            return lambda: srf_regs[srf_sel]
+        if mux == 4 or mux == 5: # R0 or R1
+            regs = self.regs
+            reg = mux - 4
+            return lambda: regs[reg]
+        if mux <= 9: # RCT, RCB, RCL or RCR
+            neighbour = self.neighbours[mux - 6]
+            return lambda: neighbour.res
+        constants = { 10: 0, 11: 1, 12: MAX_32b, 13: MIN_32b } # ZERO, ONE, MAX_INT, MIN_INT
+        if mux in constants:
+            value = constants[mux]
+            return lambda: value
+        return None
+
+    def compileAlu(self, alu_op, half_precision, muxf_sel):
+        '''Get the ALU function of two operands that runs the operation, as runAlu does. None if the operation is not recognized'''
+        alu = self.alu
+        ops = { 1: (alu.sadd, alu.saddh), 2: (alu.ssub, alu.ssubh), 3: (alu.smul, alu.smulh), 4: (alu.sdiv, alu.sdivh),
+                5: (alu.sll, alu.sllh), 6: (alu.srl, alu.srlh), 7: (alu.sra, alu.srah), 8: (alu.land, alu.landh),
+                9: (alu.lor, alu.lorh), 10: (alu.lxor, alu.lxorh), 13: (alu.mul_fp, alu.mul_fp), 14: (alu.div_fp, alu.div_fp) }
+        if alu_op in ops:
+            return ops[alu_op][1 if half_precision else 0]
+        if alu_op == 11 or alu_op == 12: # INB_SF_INA or INB_ZF_INA
+            if muxf_sel == 0: # OWN
+                flags = alu
+            elif muxf_sel <= len(self.neighbours):
+                flags = self.neighbours[muxf_sel-1]
+            else:
+                return None
+            if alu_op == 11:
+                sfga = alu.sfga
+                return lambda muxa_val, muxb_val: sfga(muxa_val, muxb_val, flags.sign_flag)
+            zfga = alu.zfga
+            return lambda muxa_val, muxb_val: zfga(muxa_val, muxb_val, flags.zero_flag)
+        if alu_op == 15: # MAC
+            mac = alu.mach if half_precision else alu.mac
+            regs = self.regs
+            return lambda muxa_val, muxb_val: mac(muxa_val, muxb_val, regs[0])
+        return None
+
+    def compile(self, pc, fields, ctrl, disco_cgra, col, row):
+        '''Get a function without arguments that executes the instruction of pc like run() does, with the operand
+        sources and the ALU operation already selected. Not recognized encodings run through run() to fail the same way.'''
+        rf_wsel, rf_we, muxf_sel, alu_op, op_mode, muxb_sel, muxa_sel = fields
+        regs = self.regs
+        alu = self.alu
+        if alu_op == 0: # NOP
+            if rf_we == 1:
+                def slot():
+                    regs[rf_wsel] = alu.newRes
+            else:
+                def slot():
+                    pass # Intentional
+            return slot
+        get_a = self.compileMux(muxa_sel, disco_cgra, col, ctrl.srf_sel, row)
+        get_b = self.compileMux(muxb_sel, disco_cgra, col, ctrl.srf_sel, row)
+        alu_fn = self.compileAlu(alu_op, op_mode, muxf_sel)
+        if get_a is None or get_b is None or alu_fn is None:
+            return lambda: self.run(pc, fields, ctrl, disco_cgra, col, row)
+        if rf_we == 1:
+            def slot():
+                alu_fn(get_a(), get_b())
+                regs[rf_wsel] = alu.newRes
+        else:
+            def slot():
+                alu_fn(get_a(), get_b())
+        return slot
+
+    def get_trace_asm(self, pc, disco_cgra, col, row):
+        '''Disassembly of the instruction at pc as executed by this RC, for the trace of the simulator'''
+        mxcu_asm, selected_vwr, srf_sel, alu_srf_write, srf_we, vwr_row_we = disco_cgra.mxcus[col].imem.get_instruction_asm(pc)
         vwr_re = vwr_row_we[CGRA_ROWS -1 -row] # The opposite way around because its like a binary number where the last one is the least significant so RC0
-        rc_asm = self.imem.get_instruction_asm(pc, srf_sel, selected_vwr, vwr_re, srf_we, alu_srf_write, row)
-        print(self.__class__.__name__ + str(row) +": " + rc_asm + " --> ALU res = " + str(self.alu.newRes))
+        return self.imem.get_instruction_asm(pc, srf_sel, selected_vwr, vwr_re, srf_we, alu_srf_write, row)
         
     def parseDestArith(self, rd, instr):
-        # Define the regular expression pattern
-        r_pattern = re.compile(r'^R(\d+)$')
-        srf_pattern = re.compile(r'^SRF\((\d+)\)$')
-        vwr_pattern = re.compile(r'^VWR_([A-Za-z])$')
-        rout_pattern = re.compile(r'^ROUT$')
-
         # Check if the input matches the 'R' pattern
-        r_match = r_pattern.match(rd)
+        r_match = RC_ASM_PATTERNS["r"].match(rd)
         if r_match:
             ret = None
             try:
@@ -446,17 +560,17 @@ class RC:
             return ret, -1, -1
         
         # Check if the input matches the 'ROUT' pattern
-        rout_match = rout_pattern.match(rd)
+        rout_match = RC_ASM_PATTERNS["rout"].match(rd)
         if rout_match:
             return 4, -1, -1
 
         # Check if the input matches the 'SRF' pattern
-        srf_match = srf_pattern.match(rd)
+        srf_match = RC_ASM_PATTERNS["srf"].match(rd)
         if srf_match:
             return RC_DEST_REGS["SRF"], int(srf_match.group(1)), -1
         
         # Check if the input matches the 'VWR' pattern
-        vwr_match = vwr_pattern.match(rd)
+        vwr_match = RC_ASM_PATTERNS["vwr"].match(rd)
         if vwr_match:
             if vwr_match.group(1) == 'A':
                 return RC_DEST_REGS["VWR"], -1, 0
@@ -469,18 +583,8 @@ class RC:
 
     # Returns the value for muxA and the number of the srf accessed (-1 if it isn't accessed)
     def parseMuxArith(self, rs, instr):
-        # Define the regular expression pattern
-        r_pattern = re.compile(r'^R(\d+)$')
-        srf_pattern = re.compile(r'^SRF\((\d+)\)$')
-        vwr_pattern = re.compile(r'^VWR_([A-Za-z])$')
-        zero_pattern = re.compile(r'^ZERO$')
-        one_pattern = re.compile(r'^ONE$')
-        maxInt_pattern = re.compile(r'^MAX_INT$')
-        minInt_pattern = re.compile(r'^MIN_INT$')
-        neigh_pattern = re.compile(r'^RC([A-Za-z])$')
-
         # Check if the input matches the 'R' pattern
-        r_match = r_pattern.match(rs)
+        r_match = RC_ASM_PATTERNS["r"].match(rs)
         if r_match:
             ret = None
             try:
@@ -490,13 +594,13 @@ class RC:
             return ret, -1
 
         # Check if the input matches the 'SRF' pattern
-        srf_match = srf_pattern.match(rs)
+        srf_match = RC_ASM_PATTERNS["srf"].match(rs)
         if srf_match:
             i = srf_match.group(1)
             return RC_MUX_SEL["SRF"], int(srf_match.group(1))
         
         # Check if the input matches the 'VWR' pattern
-        vwr_match = vwr_pattern.match(rs)
+        vwr_match = RC_ASM_PATTERNS["vwr"].match(rs)
         if vwr_match:
             try:
                 ret = RC_MUX_SEL[rs]
@@ -505,7 +609,7 @@ class RC:
             return ret, -1
             
         # Check if the input matches the 'RCX' pattern
-        neigh_match = neigh_pattern.match(rs)
+        neigh_match = RC_ASM_PATTERNS["neigh"].match(rs)
         if neigh_match:
             ret = None
             try:
@@ -515,22 +619,22 @@ class RC:
             return ret, -1
         
         # Check if the input matches the 'ZERO' pattern
-        zero_match = zero_pattern.match(rs)
+        zero_match = RC_ASM_PATTERNS["zero"].match(rs)
         if zero_match:
             return RC_MUX_SEL[rs], -1
 
         # Check if the input matches the 'ONE' pattern
-        one_match = one_pattern.match(rs)
+        one_match = RC_ASM_PATTERNS["one"].match(rs)
         if one_match:
             return RC_MUX_SEL[rs], -1
         
         # Check if the input matches the 'MAX_INT' pattern
-        maxInt_match = maxInt_pattern.match(rs)
+        maxInt_match = RC_ASM_PATTERNS["maxInt"].match(rs)
         if maxInt_match:
             return RC_MUX_SEL[rs], -1
         
         # Check if the input matches the 'MIN_INT' pattern
-        minInt_match = minInt_pattern.match(rs)
+        minInt_match = RC_ASM_PATTERNS["minInt"].match(rs)
         if minInt_match:
             return RC_MUX_SEL[rs], -1
 
@@ -546,6 +650,19 @@ class RC:
         return ret
 
     def asmToHex(self, instr):
+        '''Encode an RC instruction, see encodeAsm. The encoding only depends on the text, so each text is encoded
+        once for all the RCs, up to RC_ASM_CACHE_SIZE of them. The cache keeps the integer value of the word, and
+        each call gets a word object of its own, since the IMEM keeps the object it is given'''
+        ret = RC.asm_cache.get(instr)
+        if ret is None:
+            ret = self.encodeAsm(instr)
+            ret = ret[:-1] + (int(ret[-1].get_word(), 2),)
+            if len(RC.asm_cache) >= RC_ASM_CACHE_SIZE:
+                del RC.asm_cache[next(iter(RC.asm_cache))] # The oldest one
+            RC.asm_cache[instr] = ret
+        return ret[:-1] + (RC_IMEM_WORD(hex_word=hex(ret[-1])),)
+
+    def encodeAsm(self, instr):
         space_instr = instr.replace(",", " ")
         split_instr = [word for word in space_instr.split(" ") if word]
         try:
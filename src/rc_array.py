@@ -0,0 +1,311 @@
+"""rc_array.py: The reconfigurable cells of the DISCO-CGRA as NumPy arrays, executed all at once in each cycle"""
+
+import numpy as np
+
+from .params import *
+from .alu import ALU
+from .rc import RC_NUM_DREG
+
+# Values of the constant RC mux inputs: ZERO, ONE, MAX_INT and MIN_INT
+RC_ARRAY_CONSTS = [0, 1, MAX_32b, MIN_32b]
+
+def wrap32(x):
+    '''Same as int32(x) for each element. An int64 array is wrapped with two casts instead of three masking
+    operations, the conversion to int32 keeps the lowest 32 bits'''
+    if isinstance(x, np.ndarray):
+        return x.astype(np.int32).astype(np.int64)
+    return ((x + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+def srl32(a, b):
+    '''Same as ALU.srl for each element'''
+    shift_n = b & 7
+    pos = wrap32((wrap32(a) & MAX_32b) >> shift_n)
+    neg = -wrap32((-a) >> shift_n)
+    return np.where(a >= 0, pos, neg)
+
+def half32(a, b, op):
+    '''Same as the half precision ALU operations for each element: op applied to the 16-bit halves'''
+    high_res = op((a >> 16) & 0xFFFF, (b >> 16) & 0xFFFF) & 0xFFFF
+    low_res = op(a & 0xFFFF, b & 0xFFFF) & 0xFFFF
+    return (high_res << 16) | low_res
+
+# RC ALU operations on arrays. They take the operands, the flags source and R0 of each RC
+RC_ARRAY_OPS = {
+    "sadd": lambda a, b, f, r0: wrap32(a + b),
+    "ssub": lambda a, b, f, r0: wrap32(a - b),
+    "smul": lambda a, b, f, r0: (a * b) & MAX_32b, # The lowest 31 bits do not change when wrapping first
+    "sll": lambda a, b, f, r0: wrap32(a << (b & 7)),
+    "srl": lambda a, b, f, r0: srl32(a, b),
+    "sra": lambda a, b, f, r0: wrap32(a >> (b & 7)),
+    "land": lambda a, b, f, r0: wrap32(a & b),
+    "lor": lambda a, b, f, r0: wrap32(a | b),
+    "lxor": lambda a, b, f, r0: wrap32(a ^ b),
+    "saddh": lambda a, b, f, r0: half32(a, b, np.add),
+    "ssubh": lambda a, b, f, r0: half32(a, b, np.subtract),
+    "smulh": lambda a, b, f, r0: half32(a, b, np.multiply),
+    "sfga": lambda a, b, f, r0: np.where(f != 0, a, b),
+    "zfga": lambda a, b, f, r0: np.where(f != 0, a, b),
+    "mac": lambda a, b, f, r0: wrap32(a * b) + r0,
+    "mach": lambda a, b, f, r0: ((((((a >> 16) & 0xFFFF) * ((b >> 16) & 0xFFFF)) & 0xFFFF) + ((r0 >> 16) & 0xFFFF)) & 0xFFFF) << 16 |
+                                (((((a & 0xFFFF) * (b & 0xFFFF)) & 0xFFFF) + (r0 & 0xFFFF)) & 0xFFFF),
+}
+
+# ALU method of each RC operation (alu_op, half precision), see RC.runAlu
+RC_ARRAY_OP_NAMES = { (1, 0): "sadd", (1, 1): "saddh", (2, 0): "ssub", (2, 1): "ssubh", (3, 0): "smul", (3, 1): "smulh",
+                      (4, 0): "sdiv", (4, 1): "sdivh", (5, 0): "sll", (5, 1): "sllh", (6, 0): "srl", (6, 1): "srlh",
+                      (7, 0): "sra", (7, 1): "srah", (8, 0): "land", (8, 1): "landh", (9, 0): "lor", (9, 1): "lorh",
+                      (10, 0): "lxor", (10, 1): "lxorh", (11, 0): "sfga", (11, 1): "sfga", (12, 0): "zfga", (12, 1): "zfga",
+                      (13, 0): "mul_fp", (13, 1): "mul_fp", (14, 0): "div_fp", (14, 1): "div_fp", (15, 0): "mac", (15, 1): "mach" }
+
+def contiguous(idx):
+    '''A slice instead of the list of indices idx if they are consecutive, since slicing is cheaper than indexing
+    with an array'''
+    if len(idx) and list(idx) == list(range(idx[0], idx[0] + len(idx))):
+        return slice(idx[0], idx[0] + len(idx))
+    return np.array(idx, dtype=np.int64)
+
+class RC_ARRAY_ALU:
+    '''Stand-in of the ALU of an RC while its values live in an RC_ARRAY, for the units that read them'''
+    def __init__(self, rc_array, idx):
+        self.rc_array = rc_array
+        self.idx = idx
+
+    @property
+    def newRes(self):
+        return int(self.rc_array.new_res[self.idx])
+
+    @property
+    def res(self):
+        return int(self.rc_array.res[self.idx])
+
+    @property
+    def zero_flag(self):
+        return int(self.rc_array.get_flags()[0][self.idx])
+
+    @property
+    def sign_flag(self):
+        return int(self.rc_array.get_flags()[1][self.idx])
+
+class RC_ARRAY:
+    '''Registers, ALU results and flags of all the RCs of a CGRA in int64 NumPy arrays, where the RC of column col
+    and row row has the index col*CGRA_ROWS + row. The values are int64 and not int32 because some ALU
+    operations (MIN_INT, the half precision ones and MAC) give results out of the int32 range, as the RC objects do.
+    The operations that wrap their result to 32 bits do it with two casts (see wrap32).
+
+    The registers and the ALU results are views of one state vector, which also has a place for the constants and
+    for the SRF and VWR values read in a cycle. So the mux inputs of all the RCs are gathered from it at once.
+    The instructions of each pc are compiled into a step that executes the RCs of all the used columns with
+    vectorized operations: each ALU operation runs once on all the RCs that use it. A pc where every RC does a
+    NOP without register writes has no step. The flags are only computed from the results when they are read,
+    and the results only copied when some RC ran (see updateALUValues).
+
+    attach() moves the state of the RCs to the arrays and detach() moves it back.
+    '''
+    def __init__(self, disco_cgra):
+        self.disco_cgra = disco_cgra
+        self.n_rcs = CGRA_COLS*CGRA_ROWS
+        self.rcs = [disco_cgra.rcs[col][row] for col in range(CGRA_COLS) for row in range(CGRA_ROWS)]
+        self.alus = [rc.alu for rc in self.rcs]
+        # Layout of the state vector: registers, results, constants and the SRF and VWR reads of a cycle (at most
+        # two per RC)
+        self.res_base = self.n_rcs*RC_NUM_DREG
+        self.const_base = self.res_base + self.n_rcs
+        self.read_base = self.const_base + len(RC_ARRAY_CONSTS)
+        self.state = np.zeros(self.read_base + 2*self.n_rcs, dtype=np.int64)
+        self.state[self.const_base:self.read_base] = RC_ARRAY_CONSTS
+        self.regs = self.state[:self.res_base].reshape(self.n_rcs, RC_NUM_DREG)
+        self.res = self.state[self.res_base:self.const_base]
+        self.new_res = np.zeros(self.n_rcs, dtype=np.int64)
+        self.zero_flag = np.zeros(self.n_rcs, dtype=np.int64)
+        self.sign_flag = np.zeros(self.n_rcs, dtype=np.int64)
+        # Whether an RC ran since the last updateALUValues, and whether the flags are older than the results
+        self.dirty = False
+        self.stale_flags = False
+        # Index of the RCT, RCB, RCL and RCR of each RC
+        alu_idx = { id(alu): idx for idx, alu in enumerate(self.alus) }
+        self.neighbours = np.array([[alu_idx[id(rc.neighbours[k])] for rc in self.rcs] for k in range(4)], dtype=np.int64)
+
+    def attach(self):
+        '''Take the state of the RCs and make their ALUs read it from the arrays'''
+        for idx, rc in enumerate(self.rcs):
+            alu = self.alus[idx]
+            self.regs[idx] = rc.regs
+            self.res[idx] = alu.res
+            self.new_res[idx] = alu.newRes
+            self.zero_flag[idx] = alu.zero_flag
+            self.sign_flag[idx] = alu.sign_flag
+            rc.alu = RC_ARRAY_ALU(self, idx)
+        # The flags of the ALUs may not come from their results yet, the first update sets both
+        self.dirty = True
+        self.stale_flags = False
+
+    def detach(self):
+        '''Give the state back to the RCs and their ALUs'''
+        zero_flag, sign_flag = self.get_flags()
+        for idx, rc in enumerate(self.rcs):
+            alu = self.alus[idx]
+            rc.regs[:] = self.regs[idx].tolist()
+            alu.res = int(self.res[idx])
+            alu.newRes = int(self.new_res[idx])
+            alu.zero_flag = int(zero_flag[idx])
+            alu.sign_flag = int(sign_flag[idx])
+            rc.alu = alu
+
+    def updateALUValues(self):
+        '''Same as ALU.updateALUValues for all the RCs'''
+        if self.dirty:
+            np.copyto(self.res, self.new_res)
+            self.dirty = False
+            self.stale_flags = True
+
+    def get_flags(self):
+        '''Zero and sign flags of all the RCs'''
+        if self.stale_flags:
+            np.equal(self.res, 0, out=self.zero_flag)
+            np.less(self.res, 0, out=self.sign_flag)
+            self.stale_flags = False
+        return self.zero_flag, self.sign_flag
+
+    def compile(self, pc, ini_col, end_col):
+        '''Get a function without arguments that executes the instructions of pc of the RCs of columns ini_col to
+        end_col, None if all of them are NOPs without register writes'''
+        state = self.state
+        srf_reads = {}  # Place in the state of the SRF read of each column
+        vwr_reads = {}  # Place in the state of each VWR read, by (col, vwr, row)
+        active = []     # RCs that run an ALU operation
+        a_src = []
+        b_src = []
+        ops = {}        # Positions in active of the RCs of each operation
+        flag_src = []   # Flags source of each active RC (only used by SFGA and ZFGA)
+        error = None
+        rf_src = []
+        rf_dst = []
+        for col in range(ini_col, end_col+1):
+            ctrl = self.disco_cgra.mxcus[col].imem.get_control(pc)
+            for row in range(CGRA_ROWS):
+                idx = col*CGRA_ROWS + row
+                rf_wsel, rf_we, muxf_sel, alu_op, op_mode, muxb_sel, muxa_sel = self.disco_cgra.rcs[col][row].imem.fields[pc].tolist()
+                if rf_we == 1:
+                    rf_src.append(idx)
+                    rf_dst.append(idx*RC_NUM_DREG + rf_wsel)
+                if alu_op == 0 or error is not None: # NOP, it does not use the muxes
+                    continue
+                srcs = []
+                for mux in (muxa_sel, muxb_sel):
+                    if mux <= 2: # VWR_A, VWR_B or VWR_C
+                        key = (col, mux, row)
+                        if key not in vwr_reads:
+                            vwr_reads[key] = self.read_base + len(srf_reads) + len(vwr_reads)
+                        srcs.append(vwr_reads[key])
+                    elif mux == 3: # SRF
+                        if col not in srf_reads:
+                            srf_reads[col] = (self.read_base + len(srf_reads) + len(vwr_reads), ctrl.srf_sel)
+                        srcs.append(srf_reads[col][0])
+                    elif mux <= 5: # R0 or R1
+                        srcs.append(idx*RC_NUM_DREG + mux - 4)
+                    elif mux <= 9: # RCT, RCB, RCL or RCR
+                        srcs.append(self.res_base + int(self.neighbours[mux-6][idx]))
+                    elif mux <= 13: # ZERO, ONE, MAX_INT or MIN_INT
+                        srcs.append(self.const_base + mux - 10)
+                    else:
+                        error = Exception("RC: Mux value not recognized")
+                if (alu_op == 11 or alu_op == 12) and muxf_sel > 4:
+                    error = IndexError("list index out of range")
+                if error is not None:
+                    continue
+                op = RC_ARRAY_OP_NAMES[alu_op, op_mode]
+                ops.setdefault(op, []).append(len(active))
+                active.append(idx)
+                a_src.append(srcs[0])
+                b_src.append(srcs[1])
+                flag_src.append(idx if muxf_sel == 0 or op not in ("sfga", "zfga") else int(self.neighbours[muxf_sel-1][idx]))
+        if error is not None:
+            def step():
+                raise error
+            return step
+        if not active and not rf_src:
+            return None
+        n_active = len(active)
+        ab_src = np.array(a_src + b_src, dtype=np.int64)
+        groups = []
+        for op, positions in ops.items():
+            dest = contiguous([active[pos] for pos in positions])
+            r0 = np.array([active[pos]*RC_NUM_DREG for pos in positions], dtype=np.int64)
+            flags = np.array([flag_src[pos] for pos in positions], dtype=np.int64)
+            positions = None if len(positions) == n_active else np.array(positions, dtype=np.int64)
+            groups.append((self.compile_op(op, flags, r0), positions, dest))
+        rf_src = contiguous(rf_src)
+        rf_dst = np.array(rf_dst, dtype=np.int64)
+        # Where the SRF and VWR reads come from
+        srfs = self.disco_cgra.srfs
+        srf_reads = [(slot, srfs[col].regs, srf_sel) for col, (slot, srf_sel) in srf_reads.items()]
+        vwrs = self.disco_cgra.vwrs
+        mxcus = self.disco_cgra.mxcus
+        vwr_offset = int(SPM_NWORDS/CGRA_ROWS)
+        vwr_reads = [(slot, vwrs[col][vwr], mxcus[col].regs, 5 + vwr, vwr_offset*row) for (col, vwr, row), slot in vwr_reads.items()]
+        new_res = self.new_res
+        rc_array = self
+
+        def step():
+            for slot, srf_regs, srf_sel in srf_reads:
+                state[slot] = srf_regs[srf_sel]
+            for slot, vwr, mxcu_regs, mask_reg, offset in vwr_reads:
+                state[slot] = vwr.getIdx((mxcu_regs[0] & mxcu_regs[mask_reg]) + offset)
+            if n_active:
+                # All the mux inputs of this pc in one gather
+                ab = state[ab_src]
+                a = ab[:n_active]
+                b = ab[n_active:]
+                for run_op, positions, dest in groups:
+                    if positions is None:
+                        new_res[dest] = run_op(a, b)
+                    else:
+                        new_res[dest] = run_op(a[positions], b[positions])
+            # Write results locally
+            if rf_dst.size:
+                state[rf_dst] = new_res[rf_src]
+            rc_array.dirty = True
+        return step
+
+    def compile_check(self, pc, ini_col, end_col):
+        '''VWR reads of the RCs of columns ini_col to end_col at pc, as (col, vwr, row), which fail if their index is
+        out of the VWR. None if the RCs may fail otherwise: with a mux or flags source not recognized, or with an
+        operation that is not vectorized (see compile_op), which fails or divides'''
+        reads = set()
+        for col in range(ini_col, end_col+1):
+            for row in range(CGRA_ROWS):
+                rf_wsel, rf_we, muxf_sel, alu_op, op_mode, muxb_sel, muxa_sel = self.disco_cgra.rcs[col][row].imem.fields[pc].tolist()
+                if alu_op == 0: # NOP, it does not use the muxes
+                    continue
+                op = RC_ARRAY_OP_NAMES[alu_op, op_mode]
+                if muxa_sel > 13 or muxb_sel > 13 or (op not in RC_ARRAY_OPS and op != "mul_fp") or \
+                   (op in ("sfga", "zfga") and muxf_sel > 4):
+                    return None
+                for mux in (muxa_sel, muxb_sel):
+                    if mux <= 2: # VWR_A, VWR_B or VWR_C
+                        reads.add((col, mux, row))
+        return sorted(reads)
+
+    def compile_op(self, op, flags, r0):
+        '''Get the function of the operands of a group of RCs that returns the results of an ALU operation. flags
+        are the indices of the RCs whose flags SFGA and ZFGA read, and r0 the places in the state of the R0 of the
+        RCs, read by MAC'''
+        state = self.state
+        if op == "sfga" or op == "zfga":
+            flag = 1 if op == "sfga" else 0
+            return lambda a, b: np.where(self.get_flags()[flag][flags] != 0, a, b)
+        if op == "mac" or op == "mach":
+            mac = RC_ARRAY_OPS[op]
+            return lambda a, b: mac(a, b, None, state[r0])
+        if op in RC_ARRAY_OPS:
+            array_op = RC_ARRAY_OPS[op]
+            return lambda a, b: array_op(a, b, None, None)
+        # Operations that fail or are not vectorized (the divisions), run them one by one on an ALU
+        def scalar_op(a, b):
+            alu = ALU()
+            res = np.zeros(len(a), dtype=np.int64)
+            for pos in range(len(a)):
+                getattr(alu, op)(int(a[pos]), int(b[pos]))
+                res[pos] = alu.newRes
+            return res
+        return scalar_op
@@ -0,0 +1,509 @@
+"""regression.py: Run the kernels of the kernels/ directory against their manifests of inputs and expected outputs, and
+check the APIs of the simulator on the same cases against plain interpreter runs"""
+
+import os
+import re
+import io
+import sys
+import csv
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .params import *
+from .kmem import KMEM_WORD
+from .simulator import SIMULATOR, ENGINES
+from .trace import TRACE_LEVEL, LIST_SINK
+
+# File of each kernel directory with its regression cases
+MANIFEST_NAME = "manifest.json"
+
+# Directory of the kernels of the repository
+KERNELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kernels")
+
+# A manifest is a JSON file with a list of cases. Each case runs one hex version of the kernel:
+#
+#     {
+#         "cases": [
+#             {
+#                 "name": "default",
+#                 "version": "",                  # Runs instructions_hex<version>.csv
+#                 "column_usage": [true, false],  # Arguments of SIMULATOR.kernel_config (kernel number 1)
+#                 "num_instructions_per_col": 23,
+#                 "imem_add_start": 0,
+#                 "srf_spm_address": 0,
+#                 "max_iter": 1500,
+#                 "random_spm": {"seed": 0, "low": -200, "high": 200}, # Optional, random values for all the SPM lines
+#                 "spm": {"0": [...]},            # Values of some SPM lines (the rest are random or zero)
+#                 "expected": {
+#                     "cycles": 23,               # null if the kernel fails
+#                     "error": null,              # "<exception type>: <message>" if the kernel fails
+#                     "spm": {"1": [...]}         # SPM lines that the kernel changes, the rest must keep their input
+#                 }
+#             }
+#         ]
+#     }
+
+def discover_kernels(kernels_dir=KERNELS_DIR):
+    '''Get the name, hex versions and manifest (None if there is none) of each kernel directory'''
+    kernels = []
+    for name in sorted(os.listdir(kernels_dir)):
+        path = os.path.join(kernels_dir, name)
+        if not os.path.isdir(path):
+            continue
+        versions = [fn[len("instructions_hex"):-len(".csv")] for fn in sorted(os.listdir(path))
+                    if fn.startswith("instructions_hex") and fn.endswith(".csv")]
+        if not versions:
+            continue
+        manifest = read_manifest(path)
+        kernels.append((name, versions, manifest))
+    return kernels
+
+def read_manifest(kernel_path):
+    '''Get the manifest of a kernel directory, None if there is none'''
+    path = os.path.join(kernel_path, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_manifest(kernel_path, manifest):
+    '''Write the manifest of a kernel directory, with each list of numbers in one line'''
+    text = json.dumps(manifest, indent=4)
+    text = re.sub(r"\[[-0-9,\s]*\]", lambda m: json.dumps(json.loads(m.group(0))), text)
+    with open(os.path.join(kernel_path, MANIFEST_NAME), "w") as f:
+        f.write(text + "\n")
+
+def kmem_config(hex_path):
+    '''Get the configuration of kernel 1 from the KMEM column of a hex instructions file, None if it has no KMEM'''
+    with open(hex_path) as f:
+        rows = list(csv.reader(f))
+    header = rows[0]
+    if "KMEM" not in header or len(rows) < 3 or not rows[2][header.index("KMEM")]:
+        return None
+    n_instr, imem_add, col, spm_add = KMEM_WORD(hex_word=rows[2][header.index("KMEM")]).decode_word()
+    return { "column_usage": [bool(col & 1), bool(col & 2)], "num_instructions_per_col": n_instr + 1,
+             "imem_add_start": imem_add, "srf_spm_address": spm_add }
+
+def case_inputs(case):
+    '''SPM contents (SPM_NLINES lists of SPM_NWORDS values) at the start of a case'''
+    random_spm = case.get("random_spm")
+    if random_spm is not None:
+        rng = np.random.default_rng(random_spm["seed"])
+        spm = rng.integers(random_spm["low"], random_spm["high"], size=(SPM_NLINES, SPM_NWORDS), endpoint=True).tolist()
+    else:
+        spm = [[0 for _ in range(SPM_NWORDS)] for _ in range(SPM_NLINES)]
+    for line, values in case.get("spm", {}).items():
+        spm[int(line)] = list(values)
+    return spm
+
+def error_text(e):
+    '''How the report and the manifests write an exception'''
+    return type(e).__name__ + ": " + str(e)
+
+def load_case(sim, kernels_dir, kernel, case, inputs=None):
+    '''Configure kernel 1 of a simulator as a case says and load its instructions and inputs (none if None)'''
+    # The simulator prints the files it loads and other messages, keep the report clean
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim.kernel_config(case["column_usage"], case["num_instructions_per_col"], case["imem_add_start"], case["srf_spm_address"], 1)
+        if inputs is not None:
+            sim.loadSPMData(inputs)
+        sim.kernel_load(os.path.join(kernels_dir, kernel) + "/", version=case["version"], kernel_number=1)
+
+def run_loaded(sim, case, engine="interpreter"):
+    '''Run kernel 1 of a simulator. Return its cycles (None if it fails), error (None if it does not fail) and the
+    data of the CGRA afterwards (see CGRA.get_data)'''
+    sink = LIST_SINK()
+    error = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            sim.run(1, max_iter=case.get("max_iter", 1500), trace_level=TRACE_LEVEL.SUMMARY, trace_sink=sink, engine=engine)
+    except Exception as e:
+        error = error_text(e)
+    cycles = sink.events[-1].cycle if error is None else None
+    return cycles, error, sim.disco_cgra.get_data()
+
+def run_case(kernels_dir, kernel, case, engine="interpreter"):
+    '''Run one case of a kernel. Return its output: cycles (None if it fails), error (None if it does not fail),
+    final SPM contents and wall time in seconds'''
+    inputs = case_inputs(case)
+    sim = SIMULATOR()
+    start = time.perf_counter()
+    try:
+        load_case(sim, kernels_dir, kernel, case, inputs)
+        cycles, error, _ = run_loaded(sim, case, engine)
+    except Exception as e:
+        cycles, error = None, error_text(e)
+    wall_time = time.perf_counter() - start
+    spm = sim.disco_cgra.spm.lines.tolist()
+    return { "cycles": cycles, "error": error, "spm": spm, "wall_time": wall_time }
+
+def check_case(kernels_dir, kernel, case, engine="interpreter"):
+    '''Run one case of a kernel and compare it with its expected output. Return the entry of the report'''
+    output = run_case(kernels_dir, kernel, case, engine)
+    expected = case.get("expected")
+    result = { "kernel": kernel, "case": case["name"], "version": case["version"], "cycles": output["cycles"],
+               "wall_time": output["wall_time"], "error": output["error"] }
+    if expected is None:
+        result["status"] = "skip"
+        result["message"] = "No expected output in the manifest"
+        return result
+    result["expected_cycles"] = expected["cycles"]
+    mismatches = []
+    if output["error"] != expected["error"]:
+        mismatches.append("error " + repr(output["error"]) + " instead of " + repr(expected["error"]))
+    if output["cycles"] != expected["cycles"]:
+        mismatches.append(str(output["cycles"]) + " cycles instead of " + str(expected["cycles"]))
+    inputs = case_inputs(case)
+    wrong_lines = [line for line in range(SPM_NLINES)
+                   if output["spm"][line] != expected["spm"].get(str(line), inputs[line])]
+    if wrong_lines:
+        mismatches.append("wrong SPM lines " + str(wrong_lines))
+    result["status"] = "fail" if mismatches else "pass"
+    result["message"] = "; ".join(mismatches)
+    return result
+
+def record_case(kernels_dir, kernel, case, engine="interpreter"):
+    '''Run one case of a kernel and set its expected output to the result'''
+    output = run_case(kernels_dir, kernel, case, engine)
+    inputs = case_inputs(case)
+    case["expected"] = { "cycles": output["cycles"], "error": output["error"],
+                         "spm": { str(line): output["spm"][line] for line in range(SPM_NLINES) if output["spm"][line] != inputs[line] } }
+    return case
+
+def default_manifest(kernels_dir, kernel, versions, seed=0):
+    '''Manifest with one case for each hex version with a KMEM configuration, with random inputs. The SRF line of
+    the SPM gets small values, as kernels use them as sizes, counters and SPM lines'''
+    cases = []
+    for version in versions:
+        config = kmem_config(os.path.join(kernels_dir, kernel, "instructions_hex" + version + ".csv"))
+        if config is None:
+            continue
+        rng = np.random.default_rng(seed)
+        case = { "name": "default" if version == "" else version.strip("_"), "version": version }
+        case.update(config)
+        case["max_iter"] = 1500
+        case["random_spm"] = { "seed": seed, "low": -200, "high": 200 }
+        case["spm"] = { str(config["srf_spm_address"]): rng.integers(0, 6, size=SPM_NWORDS, endpoint=True).tolist() }
+        cases.append(case)
+    return { "cases": cases }
+
+# Frames of the APIs that run a kernel over several inputs: the input of the case and API_FRAMES - 1 others with
+# other random values in the lines on one side of the SRF line
+API_FRAMES = 3
+
+def case_frames(case, n_frames=API_FRAMES):
+    '''Inputs of the frames of a case (see case_inputs) and the block of lines that changes between them, as
+    (first_line, n_lines): the larger side of the SRF line. The lines given by the case are the same in all of them'''
+    inputs = case_inputs(case)
+    srf = case["srf_spm_address"]
+    first_line, n_lines = (srf + 1, SPM_NLINES - srf - 1) if SPM_NLINES - srf - 1 >= srf else (0, srf)
+    frames = [inputs]
+    random_spm = case.get("random_spm")
+    for i in range(1, n_frames):
+        if random_spm is not None:
+            other = case_inputs(dict(case, random_spm=dict(random_spm, seed=random_spm["seed"] + i)))
+        else:
+            other = inputs
+        frames.append(inputs[:first_line] + other[first_line:first_line+n_lines] + inputs[first_line+n_lines:])
+    return frames, first_line, n_lines
+
+def reference_run(kernels_dir, kernel, case, inputs):
+    '''Run a case with other inputs on the interpreter, as run() does it. Return its cycles, error and final data'''
+    sim = SIMULATOR()
+    load_case(sim, kernels_dir, kernel, case, inputs)
+    return run_loaded(sim, case)
+
+def compare_run(label, got, expected):
+    '''Mismatches of a run, (cycles, error, data) as run_loaded returns them, with the one expected'''
+    mismatches = []
+    if got[1] != expected[1]:
+        mismatches.append(label + ": error " + repr(got[1]) + " instead of " + repr(expected[1]))
+    elif got[0] != expected[0]:
+        mismatches.append(label + ": " + str(got[0]) + " cycles instead of " + str(expected[0]))
+    if not np.array_equal(got[2], expected[2]):
+        mismatches.append(label + ": wrong CGRA state")
+    return mismatches
+
+def compare_frames(label, outputs, cycles, references):
+    '''Mismatches of the SPM lines (n_frames, SPM_NLINES, SPM_NWORDS) and cycles of the frames of an API with the
+    reference runs of the frames'''
+    mismatches = []
+    for i, (expected_cycles, _, data) in enumerate(references):
+        spm = data[:SPM_NLINES*SPM_NWORDS].reshape(SPM_NLINES, SPM_NWORDS)
+        wrong_lines = [line for line in range(SPM_NLINES) if not np.array_equal(outputs[i][line], spm[line])]
+        if cycles[i] != expected_cycles:
+            mismatches.append(label + " frame " + str(i) + ": " + str(cycles[i]) + " cycles instead of " + str(expected_cycles))
+        if wrong_lines:
+            mismatches.append(label + " frame " + str(i) + ": wrong SPM lines " + str(wrong_lines))
+    return mismatches
+
+def frames_error(references):
+    '''Error that an API running the frames must raise: the first one of their reference runs, None if none fails'''
+    return next((error for _, error, _ in references if error is not None), None)
+
+def check_snapshot(kernels_dir, kernel, case, engine):
+    '''snapshot, run, restore and run again: restore gives back the snapshot, and both runs are the plain run'''
+    inputs = case_inputs(case)
+    expected = reference_run(kernels_dir, kernel, case, inputs)
+    sim = SIMULATOR()
+    load_case(sim, kernels_dir, kernel, case, inputs)
+    snap = sim.snapshot()
+    mismatches = compare_run("first run", run_loaded(sim, case, engine), expected)
+    sim.restore(snap)
+    if not np.array_equal(sim.snapshot(), snap):
+        mismatches.append("restore does not give back the snapshot")
+    return mismatches + compare_run("run after restore", run_loaded(sim, case, engine), expected)
+
+def check_result_cache(kernels_dir, kernel, case, engine):
+    '''A run with a RESULT_CACHE, and the same run again (a hit unless the kernel fails), are the plain run'''
+    from .result_cache import RESULT_CACHE # Only needed to check it
+    inputs = case_inputs(case)
+    expected = reference_run(kernels_dir, kernel, case, inputs)
+    result_cache = RESULT_CACHE()
+    sim = SIMULATOR(result_cache=result_cache)
+    load_case(sim, kernels_dir, kernel, case, inputs)
+    snap = sim.snapshot()
+    mismatches = compare_run("uncached run", run_loaded(sim, case, engine), expected)
+    sim.restore(snap)
+    mismatches += compare_run("cached run", run_loaded(sim, case, engine), expected)
+    # A run that fails is not cached
+    hits = 1 if expected[1] is None else 0
+    if result_cache.hits != hits:
+        mismatches.append(str(result_cache.hits) + " cache hits instead of " + str(hits))
+    return mismatches
+
+def check_bitstream(kernels_dir, kernel, case, engine):
+    '''The kernel written as a binary bitstream (create_binary_file) and loaded from it (kernel_load_bitstream)
+    gives the CGRA of the CSV files, and runs as the plain run'''
+    inputs = case_inputs(case)
+    expected = reference_run(kernels_dir, kernel, case, inputs)
+    sim = SIMULATOR()
+    load_case(sim, kernels_dir, kernel, case, inputs)
+    bitstream_sim = SIMULATOR()
+    bitstream_sim.loadSPMData(inputs)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with contextlib.redirect_stdout(io.StringIO()):
+            sim.create_binary_file(tmp_dir + "/", case["version"])
+        bitstream_sim.kernel_load_bitstream(tmp_dir + "/", case["version"])
+    mismatches = []
+    if not np.array_equal(bitstream_sim.snapshot(), sim.snapshot()):
+        mismatches.append("the bitstream does not load the KMEM and IMEMs of the CSV files")
+    return mismatches + compare_run("bitstream run", run_loaded(bitstream_sim, case, engine), expected)
+
+def check_lines(kernels_dir, kernel, case, engine):
+    '''The inputs loaded from a numpy.memmap in two blocks of lines (setLines) and the outputs stored into another
+    one in two blocks (getLines) are those of the plain run'''
+    inputs = case_inputs(case)
+    expected = reference_run(kernels_dir, kernel, case, inputs)
+    sim = SIMULATOR()
+    half = SPM_NLINES//2
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        spm_in = np.memmap(os.path.join(tmp_dir, "in.dat"), dtype=np.int32, mode="w+", shape=(SPM_NLINES, SPM_NWORDS))
+        spm_in[:] = inputs
+        spm_out = np.memmap(os.path.join(tmp_dir, "out.dat"), dtype=np.int32, mode="w+", shape=(SPM_NLINES, SPM_NWORDS))
+        load_case(sim, kernels_dir, kernel, case)
+        sim.loadSPMData(spm_in[half:], half)
+        sim.loadSPMData(spm_in[:half])
+        got = run_loaded(sim, case, engine)
+        sim.storeSPMData(spm_out[:half])
+        sim.storeSPMData(spm_out[half:], half)
+        mismatches = compare_run("run", got, expected)
+        mismatches += compare_frames("stored lines", [spm_out], [expected[0]], [expected])
+        del spm_in, spm_out # Unmap the files before they are removed
+    return mismatches
+
+def check_batch(kernels_dir, kernel, case, engine):
+    '''run_batch over the frames of the case gives the SPM lines and cycles of the plain run of each frame, and
+    leaves the CGRA of the last one'''
+    frames, first_line, n_lines = case_frames(case)
+    references = [reference_run(kernels_dir, kernel, case, frame) for frame in frames]
+    sim = SIMULATOR()
+    load_case(sim, kernels_dir, kernel, case, frames[0])
+    spm_batch = np.array(frames)[:, first_line:first_line+n_lines]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            outputs, cycles = sim.run_batch(1, spm_batch, max_iter=case.get("max_iter", 1500), engine=engine, first_line=first_line)
+    except Exception as e:
+        error = error_text(e)
+        if error != frames_error(references):
+            return ["batch: error " + repr(error) + " instead of " + repr(frames_error(references))]
+        return []
+    if frames_error(references) is not None:
+        return ["batch: no error instead of " + repr(frames_error(references))]
+    mismatches = compare_frames("batch", outputs, cycles, references)
+    if not np.array_equal(sim.disco_cgra.get_data(), references[-1][2]):
+        mismatches.append("batch: wrong CGRA state after the last frame")
+    return mismatches
+
+def check_stream(kernels_dir, kernel, case, engine):
+    '''run_stream over the frames of the case, the first one as {line: values} and the others as arrays of lines,
+    yields the SPM lines and cycles of the plain run of each frame'''
+    frames, first_line, n_lines = case_frames(case)
+    references = [reference_run(kernels_dir, kernel, case, frame) for frame in frames]
+    sim = SIMULATOR()
+    load_case(sim, kernels_dir, kernel, case, frames[0])
+    stream_frames = [{ str(line): frames[0][line] for line in range(first_line, first_line+n_lines) }]
+    stream_frames += [np.array(frame[first_line:first_line+n_lines]) for frame in frames[1:]]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = list(sim.run_stream(1, stream_frames, first_line=first_line, queue_size=2, max_iter=case.get("max_iter", 1500), engine=engine))
+    except Exception as e:
+        error = error_text(e)
+        if error != frames_error(references):
+            return ["stream: error " + repr(error) + " instead of " + repr(frames_error(references))]
+        return []
+    if frames_error(references) is not None:
+        return ["stream: no error instead of " + repr(frames_error(references))]
+    return compare_frames("stream", [outputs for outputs, _ in results], [cycles for _, cycles in results], references)
+
+def check_tiled(kernels_dir, kernel, case, engine):
+    '''run_tiled over a signal made of the changing lines of the frames of the case, one frame per tile and the
+    other lines constant, gives the SPM lines and cycles of the plain run of each frame'''
+    from .stream import TILED_KERNEL # Only needed to check tiled runs
+    frames, first_line, n_lines = case_frames(case)
+    references = [reference_run(kernels_dir, kernel, case, frame) for frame in frames]
+    sim = SIMULATOR()
+    load_case(sim, kernels_dir, kernel, case)
+    constants = { line: frames[0][line] for line in range(SPM_NLINES) if line < first_line or line >= first_line + n_lines }
+    tiled_kernel = TILED_KERNEL(first_line, n_lines, 0, SPM_NLINES, spm=constants)
+    signal = np.array([frame[first_line:first_line+n_lines] for frame in frames], dtype=np.int32).reshape(-1)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            outputs, cycles = sim.run_tiled(1, tiled_kernel, signal, max_iter=case.get("max_iter", 1500), engine=engine)
+    except Exception as e:
+        error = error_text(e)
+        if error != frames_error(references):
+            return ["tiled: error " + repr(error) + " instead of " + repr(frames_error(references))]
+        return []
+    if frames_error(references) is not None:
+        return ["tiled: no error instead of " + repr(frames_error(references))]
+    return compare_frames("tiled", outputs.reshape(len(frames), SPM_NLINES, SPM_NWORDS), cycles, references)
+
+def check_stats(kernels_dir, kernel, case, engine):
+    '''A run with stats is the plain run, and its RUN_STATS has its cycles and one pc count per cycle'''
+    inputs = case_inputs(case)
+    expected = reference_run(kernels_dir, kernel, case, inputs)
+    sim = SIMULATOR()
+    load_case(sim, kernels_dir, kernel, case, inputs)
+    max_iter = case.get("max_iter", 1500)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = sim.run(1, max_iter=max_iter, engine=engine, stats=True)
+    except Exception as e:
+        return compare_run("run with stats", (None, error_text(e), sim.disco_cgra.get_data()), expected)
+    mismatches = compare_run("run with stats", (stats.cycles, None, sim.disco_cgra.get_data()), expected)
+    if stats.max_iter_reached != (stats.cycles == max_iter):
+        mismatches.append("stats: max_iter_reached is " + str(stats.max_iter_reached) + " after " + str(stats.cycles) + " cycles")
+    if int(stats.pc_counts.sum()) != stats.cycles:
+        mismatches.append("stats: " + str(int(stats.pc_counts.sum())) + " pc counts in " + str(stats.cycles) + " cycles")
+    return mismatches
+
+# Checks of the APIs of the simulator, each one on the cases of the manifests with the engine of the regression.
+# A check returns its mismatches with plain interpreter runs, as check_api reports them
+API_CHECKS = {
+    "snapshot": check_snapshot,
+    "result_cache": check_result_cache,
+    "bitstream": check_bitstream,
+    "lines": check_lines,
+    "batch": check_batch,
+    "stream": check_stream,
+    "tiled": check_tiled,
+    "stats": check_stats,
+}
+
+def check_api(kernels_dir, kernel, case, engine, api):
+    '''Check one API (see API_CHECKS) on one case of a kernel. Return the entry of the report'''
+    start = time.perf_counter()
+    try:
+        mismatches = API_CHECKS[api](kernels_dir, kernel, case, engine)
+        error = None
+    except Exception as e:
+        error = error_text(e)
+        mismatches = ["error " + repr(error)]
+    return { "kernel": kernel, "case": case["name"] + "/" + api, "version": case["version"], "cycles": None,
+             "wall_time": time.perf_counter() - start, "error": error,
+             "status": "fail" if mismatches else "pass", "message": "; ".join(mismatches) }
+
+def run_regression(kernels_dir=KERNELS_DIR, kernels=None, jobs=None, engine="interpreter", record=False, apis=None):
+    '''Run the cases of the manifests of the kernels (all of them if kernels is None) on a pool of jobs processes
+    (one per CPU if None). Return the report: the result of each case and the totals.
+    With record, the expected outputs are set to the outputs of this run and the manifests are written, creating
+    them from the KMEM configuration of the hex files for the kernels that have none.
+    With apis, a list of names of API_CHECKS, those APIs are also checked on each case, one entry of the report each'''
+    if engine not in ENGINES:
+        raise ValueError("Engine not recognized: " + str(engine) + ". It should be one of " + str(ENGINES) + ".")
+    apis = apis if apis is not None else []
+    for api in apis:
+        if api not in API_CHECKS:
+            raise ValueError("API check not recognized: " + str(api) + ". It should be one of " + str(tuple(API_CHECKS)) + ".")
+    if record and apis:
+        raise ValueError("The APIs are checked against the manifests, they cannot be checked while recording them.")
+    start = time.perf_counter()
+    results = []
+    work = []
+    manifests = {}
+    for name, versions, manifest in discover_kernels(kernels_dir):
+        if kernels is not None and name not in kernels:
+            continue
+        if manifest is None and record:
+            manifest = default_manifest(kernels_dir, name, versions)
+        if manifest is None or not manifest["cases"]:
+            results.append({ "kernel": name, "case": None, "version": None, "status": "skip", "message": "No manifest",
+                             "cycles": None, "wall_time": 0.0, "error": None })
+            continue
+        manifests[name] = manifest
+        work += [(name, case) for case in manifest["cases"]]
+    task = record_case if record else check_case
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(task, kernels_dir, name, case, engine) for name, case in work]
+        api_futures = [pool.submit(check_api, kernels_dir, name, case, engine, api) for name, case in work for api in apis]
+        outputs = [future.result() for future in futures]
+        api_results = [future.result() for future in api_futures]
+    if record:
+        for (name, case), recorded in zip(work, outputs):
+            case.update(recorded)
+        for name, manifest in manifests.items():
+            write_manifest(os.path.join(kernels_dir, name), manifest)
+        results += [{ "kernel": name, "case": case["name"], "version": case["version"], "status": "recorded", "message": "",
+                      "cycles": case["expected"]["cycles"], "wall_time": 0.0, "error": case["expected"]["error"] } for name, case in work]
+    else:
+        results += outputs + api_results
+    results.sort(key=lambda result: (result["kernel"], str(result["case"])))
+    totals = {}
+    for result in results:
+        totals[result["status"]] = totals.get(result["status"], 0) + 1
+    return { "engine": engine, "jobs": jobs if jobs is not None else os.cpu_count(), "wall_time": time.perf_counter() - start,
+             "totals": totals, "results": results }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the DISCO-CGRA kernels against their manifests (" + MANIFEST_NAME + ").")
+    parser.add_argument("kernels", nargs="*", help="Names of the kernels to run (default: all)")
+    parser.add_argument("--kernels-dir", default=KERNELS_DIR, help="Directory of the kernels")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of processes (default: one per CPU)")
+    parser.add_argument("--engine", default="interpreter", choices=ENGINES, help="Engine of SIMULATOR.run")
+    parser.add_argument("--report", default=None, help="Write the JSON report to this file (default: standard output)")
+    parser.add_argument("--record", action="store_true", help="Set the expected outputs of the manifests to the outputs of this run")
+    parser.add_argument("--apis", action="store_true", help="Also check the APIs of the simulator on each case (" + ", ".join(API_CHECKS) + ") against plain interpreter runs")
+    args = parser.parse_args(argv)
+    report = run_regression(args.kernels_dir, args.kernels or None, args.jobs, args.engine, args.record, list(API_CHECKS) if args.apis else None)
+    if args.report is None:
+        json.dump(report, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+    else:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+    for result in report["results"]:
+        if result["status"] == "fail":
+            print(result["kernel"] + " (" + str(result["case"]) + "): " + result["message"], file=sys.stderr)
+    print(", ".join(str(n) + " " + status for status, n in sorted(report["totals"].items())) +
+          " in " + "{:.2f}".format(report["wall_time"]) + " s", file=sys.stderr)
+    return 1 if report["totals"].get("fail", 0) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""result_cache.py: Cache of the results of kernel runs, keyed by the hash of the kernel and of the state it starts from"""
+
+import os
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from .params import *
+
+# Change it when the cached results or their keys change, so that older cached results are not used any more
+RESULT_CACHE_VERSION = 1
+
+class RESULT_CACHE:
+    '''Results of kernel runs, so that running the same kernel on the same inputs again does not simulate it:
+
+            key -> (data, pc, cycles)
+
+       The key is the hash of everything a run depends on: the decoded instructions in the IMEMs of the used columns,
+       the part of the KMEM entry that the run uses (used columns and number of instructions, the SRF line of the
+       SPM is in R7 of the LSUs) and the maximum number of cycles, and the data of the CGRA when the run starts
+       (CGRA.get_data: SPM, VWRs, SRFs, registers, ALUs and LCU branch and exit). The result is the data of the CGRA
+       when the run ends, the pc and the number of cycles.
+
+       The results are kept in memory, the max_entries most recently used ones, and in cache_dir (no disk cache if
+       None), without limit. The hits and misses count the lookups.
+    '''
+    def __init__(self, max_entries=64, cache_dir=None):
+        if max_entries < 1:
+            raise ValueError("The result cache needs at least 1 entry, not " + str(max_entries) + ".")
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, disco_cgra, ini_col, end_col, n_instr_per_col, max_iter):
+        '''Hash of the kernel loaded in the IMEMs of the used columns and of the current data of the CGRA'''
+        h = hashlib.sha256()
+        h.update(repr((RESULT_CACHE_VERSION, CGRA_ROWS, CGRA_COLS, ini_col, end_col, n_instr_per_col, max_iter)).encode())
+        for col in range(ini_col, end_col+1):
+            units = [disco_cgra.lsus[col]] + disco_cgra.rcs[col] + [disco_cgra.mxcus[col], disco_cgra.lcus[col]]
+            for unit in units:
+                h.update(unit.imem.fields[:n_instr_per_col].tobytes())
+        h.update(disco_cgra.get_data().tobytes())
+        return h.hexdigest()
+
+    def get(self, key):
+        '''Get the (data, pc, cycles) result of a key, None if it is not cached'''
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+        elif self.cache_dir is not None:
+            result = self.load(key)
+            if result is not None:
+                self.keep(key, result)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, key, data, pc, cycles):
+        '''Cache the result of a key: the data of the CGRA (see CGRA.get_data), the pc and the number of cycles'''
+        result = (np.array(data, dtype=np.int64), pc, cycles)
+        self.keep(key, result)
+        if self.cache_dir is not None:
+            self.save(key, result)
+
+    def keep(self, key, result):
+        '''Keep a result in memory, dropping the least recently used one if there are more than max_entries'''
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+
+    def load(self, key):
+        '''Read the result of a key from the cache directory, None if it is not there'''
+        path = os.path.join(self.cache_dir, key + ".npz")
+        if not os.path.exists(path):
+            return None
+        import zipfile # Only needed with a cache directory, slow to import
+        try:
+            with np.load(path) as f:
+                return (f["data"], int(f["pc"]), int(f["cycles"]))
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            return None # Broken cache entry, run the kernel again
+
+    def save(self, key, result):
+        '''Write the result of a key to the cache directory'''
+        data, pc, cycles = result
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, key + ".npz")
+        tmp_path = path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, data=data, pc=pc, cycles=cycles)
+        os.replace(tmp_path, path) # Atomic, other processes never see a partial file
+
+    def clear(self):
+        '''Forget the results kept in memory and the hit and miss counts. The cache directory is kept'''
+        self.results.clear()
+        self.hits = 0
+        self.misses = 0
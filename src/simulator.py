@@ -1,26 +1,63 @@
 # Filename
 EXT             = ".csv"
+EXT_BIN         = ".bin"
 FILENAME_INSTR  = "instructions"
 
 import numpy as np
 from enum import Enum
 
-from ctypes import c_int32
+import os
 import csv
+import sys
+from functools import partial
+from itertools import islice
 
 from .disco_cgra import CGRA, CGRA_ROWS, CGRA_COLS
 from .spm import *
 from .imem import IMEM_N_LINES
-from .lcu import LCU_NUM_CREG, LCU_IMEM_WORD, LCU
-from .lsu import LSU_NUM_CREG, LSU_IMEM_WORD, LSU
-from .mxcu import MXCU_NUM_CREG, MXCU_IMEM_WORD, MXCU
-from .rc import RC_NUM_CREG, RC_IMEM_WORD, RC
-from .kmem import KER_CONF_N_REG, KMEM_WORD
+from .lcu import LCU_NUM_CREG, LCU_IMEM_WIDTH, LCU_IMEM_WORD, LCU
+from .lsu import LSU_NUM_CREG, LSU_IMEM_WIDTH, LSU_IMEM_WORD, LSU
+from .mxcu import MXCU_NUM_CREG, MXCU_IMEM_WIDTH, MXCU_IMEM_WORD, MXCU
+from .rc import RC_NUM_CREG, RC_IMEM_WIDTH, RC_IMEM_WORD, RC
+from .kmem import KER_CONF_N_REG, KMEM_IMEM_WIDTH, KMEM_WORD
+from .trace import TRACE_LEVEL, TRACE_EVENT, FILE_SINK
 #from .srf import *
 
+# Engines of SIMULATOR.run
+ENGINES = ("interpreter", "jit", "numpy")
+
+# Binary bitstream (see SIMULATOR.create_binary_file): a header of BITSTREAM_HEADER_LEN words followed by the KMEM,
+# the LCU, LSU and MXCU IMEMs and the IMEMs of all the RCs concatenated, all of them little-endian uint32 words
+BITSTREAM_MAGIC = 0x50495344 # "DSIP"
+BITSTREAM_VERSION = 1
+BITSTREAM_HEADER_LEN = 11
+
+def bitstream_header():
+    '''Header of the binary bitstreams of this CGRA: magic, format version, widths of the words and geometry'''
+    return [BITSTREAM_MAGIC, BITSTREAM_VERSION, KMEM_IMEM_WIDTH, LCU_IMEM_WIDTH, LSU_IMEM_WIDTH, MXCU_IMEM_WIDTH, RC_IMEM_WIDTH,
+            KER_CONF_N_REG, IMEM_N_LINES, CGRA_ROWS, CGRA_COLS]
+
+def read_bitstream(file_path):
+    '''Map a binary bitstream file into memory, without reading it. Return the read-only uint32 arrays of the KMEM,
+    LCU, LSU and MXCU IMEMs (IMEM_N_LINES words each) and RC IMEMs (shape (CGRA_ROWS, IMEM_N_LINES))'''
+    data = np.memmap(file_path, dtype="<u4", mode="r")
+    header = bitstream_header()
+    if data[:BITSTREAM_HEADER_LEN].tolist() != header:
+        raise ValueError("Bitstream " + file_path + " not valid for this CGRA. Its header should be " + str(header) + ".")
+    sizes = [KER_CONF_N_REG, IMEM_N_LINES, IMEM_N_LINES, IMEM_N_LINES, CGRA_ROWS*IMEM_N_LINES]
+    if len(data) != BITSTREAM_HEADER_LEN + sum(sizes):
+        raise ValueError("Bitstream " + file_path + " not valid for this CGRA. It has " + str(len(data)) + " words instead of " + str(BITSTREAM_HEADER_LEN + sum(sizes)) + ".")
+    ends = np.cumsum([BITSTREAM_HEADER_LEN] + sizes)
+    kmem, lcu, lsu, mxcu, rcs = [data[ends[i]:ends[i+1]] for i in range(len(sizes))]
+    return kmem, lcu, lsu, mxcu, rcs.reshape(CGRA_ROWS, IMEM_N_LINES)
+
 class SIMULATOR:
-    def __init__(self):
+    def __init__(self, kernel_jit=None, result_cache=None):
         self.disco_cgra = CGRA()
+        # KERNEL_JIT of the "jit" engine, None for the DEFAULT_KERNEL_JIT shared by all the simulators
+        self.kernel_jit = kernel_jit
+        # RESULT_CACHE of the runs that are not traced cycle by cycle, None to always simulate them
+        self.result_cache = result_cache
     
     # Save the configuration parameters of a kernel into the kmem
     def kernel_config(self, column_usage, num_instructions_per_col, imem_add_start, srf_spm_addres, kernel_number):
@@ -104,8 +141,231 @@ class SIMULATOR:
                     instr_cont+=1
                     instr_cont_per_col+=1
     
+    # Load the KMEM and the kernels of a binary bitstream file (see create_binary_file) to the general imem
+    def kernel_load_bitstream(self, kernel_path, version=""):
+        '''Load the KMEM of a binary bitstream and the IMEM lines of the kernels that it configures. The file is
+        mapped into memory, so only the words of those kernels are read'''
+        file_path = kernel_path + FILENAME_INSTR + "_bin" + version + EXT_BIN
+        kmem, lcu, lsu, mxcu, rcs = read_bitstream(file_path)
+        kmem = kmem.tolist()
+        for pos in range(1, KER_CONF_N_REG):
+            self.disco_cgra.kmem.imem.IMEM[pos] = np.binary_repr(kmem[pos], width=KMEM_IMEM_WIDTH)
+        imem = self.disco_cgra.imem
+        for pos in range(1, KER_CONF_N_REG):
+            n_instr_per_col, imem_start_addr, col_one_hot, srf_spm_bank = self.disco_cgra.kmem.imem.get_params(pos)
+            if col_one_hot == 0: # No kernel
+                continue
+            ini_col, end_col = self.parseColUsageFromOneHot(col_one_hot)
+            start = imem_start_addr
+            end = min(start + (n_instr_per_col+1)*(end_col-ini_col+1), IMEM_N_LINES)
+            # The words are copied as integers, their word objects are only built if the lines are read as such
+            for unit_imem, words in [(imem.lcu_imem, lcu), (imem.lsu_imem, lsu), (imem.mxcu_imem, mxcu)] + [(imem.rcs_imem[rc], rcs[rc]) for rc in range(CGRA_ROWS)]:
+                unit_imem.set_ints(start, words[start:end])
+
     # Run the instructions of an specified kernel
-    def run(self, kernel_number, display_ops=[[] for _ in range(CGRA_ROWS + 4)], max_iter=1500): # +4 -> (LCU, LSU, MXCU, SRF)
+    def run(self, kernel_number, display_ops=[[] for _ in range(CGRA_ROWS + 4)], max_iter=1500, trace_level=TRACE_LEVEL.NONE, trace_sink=None, engine="interpreter", stats=False): # +4 -> (LCU, LSU, MXCU, SRF)
+        '''Execute a kernel. By default nothing is reported while running. With trace_level the execution
+        is reported as TRACE_EVENTs to trace_sink (the standard output if no sink is given):
+            -   TRACE_LEVEL.SUMMARY: one event at the end of the run
+            -   TRACE_LEVEL.CYCLE: also one event at the start of each cycle and one per executed unit
+        The engine executes the cycles:
+            -   "interpreter": the reference, runs the compiled instructions of each unit one by one
+            -   "jit": runs the kernel translated to Python code (see KERNEL_JIT), cached between runs. The interpreter
+                still runs the cycles that are traced, and those after a jump out of the kernel
+            -   "numpy": the interpreter with the RCs of all the used columns executed at once on NumPy arrays
+                (see RC_ARRAY), so that the cost of a cycle barely grows with CGRA_ROWS, and the cycles in which
+                every RC is idle cost nothing for them. A cycle that may fail runs unit by unit as in the interpreter,
+                so errors and the state they leave are the same. Runs that trace each cycle use the interpreter
+        With a result_cache (see RESULT_CACHE), a run that starts from the same state with the same kernel as a
+        cached one takes its final state from the cache instead of executing the cycles.
+        With stats, return the RUN_STATS of the run (None otherwise). Counting the executions of each pc is the
+        only cost while running, but the cycles run on the interpreter and the result cache is not used'''
+        if engine not in ENGINES:
+            raise ValueError("Engine not recognized: " + str(engine) + ". It should be one of " + str(ENGINES) + ".")
+        trace_level = TRACE_LEVEL(trace_level)
+        if trace_level > TRACE_LEVEL.NONE and trace_sink is None:
+            trace_sink = FILE_SINK(sys.stdout)
+        ini_col, end_col, n_instr_per_col, srf_spm_bank = self.load_kernel_imems(kernel_number)
+        # Initialize the index of the SRF values on the SPM on R7 of the LSU
+        for col in range(ini_col, end_col+1):
+            self.disco_cgra.lsus[col].regs[7] = srf_spm_bank
+        if not stats:
+            self.run_cycles(ini_col, end_col, n_instr_per_col, max_iter, trace_level, trace_sink, engine)
+            return None
+        pc_counts = [0 for _ in range(n_instr_per_col)]
+        branch_counts = {}
+        cycles = self.run_cycles(ini_col, end_col, n_instr_per_col, max_iter, trace_level, trace_sink, engine, pc_counts, branch_counts)
+        from .stats import RUN_STATS # Only needed with stats
+        return RUN_STATS(self.disco_cgra, ini_col, end_col, cycles, cycles == max_iter, pc_counts, branch_counts)
+
+    def profile(self, kernel_number, kernel_path=None, version="", max_iter=1500, engine="interpreter"):
+        '''Execute a kernel counting the executions of each pc, and return its KERNEL_PROFILE: the annotated listing of
+        the kernel and its loops ranked by cycles. The instructions come from the asm file of kernel_path and version
+        (as in kernel_load) if kernel_path is given, otherwise they are disassembled from the IMEMs'''
+        stats = self.run(kernel_number, max_iter=max_iter, engine=engine, stats=True)
+        asm_path = None
+        if kernel_path is not None:
+            asm_path = kernel_path + FILENAME_INSTR + "_asm" + version + EXT
+        from .profiler import KERNEL_PROFILE # Only needed to profile
+        return KERNEL_PROFILE(stats, self.disco_cgra, asm_path)
+
+    def run_batch(self, kernel_number, spm_batch, max_iter=1500, engine="numpy", first_line=0, out=None, out_first_line=0, batch_size=None):
+        '''Execute a kernel once for each SPM data set of spm_batch, an array of shape (n, m, SPM_NWORDS) with the
+        contents of the m SPM lines from first_line on (by default the whole SPM). It can be a numpy.memmap, the
+        data sets are read when their instances are about to run. Every instance starts from the state of the CGRA
+        when run_batch is called, with its own contents of those lines, so the result is the same as n separate
+        runs. The kernel is moved to the unit IMEMs only once. With the "numpy" engine up to batch_size instances
+        (BATCH_SIZE if None) run in lockstep (see run_lockstep), the other engines run the instances one after
+        another. Return:
+            -   spm_out: the SPM lines from out_first_line on after each instance. It is out if given, an array
+                of shape (n, k, SPM_NWORDS) such as a preallocated numpy.memmap, otherwise an int32 array with the
+                lines up to the end of the SPM
+            -   cycles: the number of cycles of each instance, an int64 array of shape (n,)
+        Afterwards the CGRA keeps the state of the last instance, as after a run()'''
+        if engine not in ENGINES:
+            raise ValueError("Engine not recognized: " + str(engine) + ". It should be one of " + str(ENGINES) + ".")
+        spm_batch = np.asarray(spm_batch)
+        if spm_batch.ndim != 3 or spm_batch.shape[2] != SPM_NWORDS or first_line < 0 or first_line + spm_batch.shape[1] > SPM_NLINES:
+            raise ValueError("SPM batch should have shape (n, m, " + str(SPM_NWORDS) + ") with m <= " + str(SPM_NLINES - first_line) + ", not " + str(spm_batch.shape) + ".")
+        if out is None:
+            out = np.zeros((len(spm_batch), SPM_NLINES - out_first_line, SPM_NWORDS), dtype=np.int32)
+        elif out.ndim != 3 or len(out) != len(spm_batch) or out.shape[2] != SPM_NWORDS:
+            raise ValueError("SPM output should have shape (" + str(len(spm_batch)) + ", k, " + str(SPM_NWORDS) + "), not " + str(out.shape) + ".")
+        self.disco_cgra.spm.checkLines(out_first_line, out.shape[1])
+        cycles = np.zeros(len(spm_batch), dtype=np.int64)
+        inputs = (((first_line, data),) for data in spm_batch)
+        if engine != "numpy":
+            for i, instance_cycles in enumerate(self.run_instances(kernel_number, inputs, max_iter, engine)):
+                cycles[i] = instance_cycles
+                self.disco_cgra.spm.getLines(out_first_line, out[i])
+            return out, cycles
+        done = 0
+        for batch, data, batch_cycles in self.run_lockstep(kernel_number, inputs, max_iter, batch_size):
+            cycles[done:done+len(data)] = batch_cycles
+            np.copyto(out[done:done+len(data)], batch.spm(data)[:, out_first_line:out_first_line+out.shape[1]], casting="unsafe")
+            done += len(data)
+            last_data = data[-1, :batch.data_size]
+        if done:
+            self.disco_cgra.set_data(last_data)
+        return out, cycles
+
+    def run_instances(self, kernel_number, inputs, max_iter=1500, engine="numpy", batch_size=None):
+        '''Generator that executes a kernel once for each item of inputs, a sequence of (first_line, lines) blocks
+        of SPM lines. Every instance starts from the state of the CGRA when the generator starts, with its blocks
+        copied into the SPM, and the kernel is moved to the unit IMEMs only once. After each instance it yields the
+        number of cycles, while the CGRA keeps the final state of the instance for the caller to read it. With the
+        "numpy" engine up to batch_size instances (BATCH_SIZE if None) run in lockstep (see run_lockstep) before the
+        first of them is yielded, the other engines run the instances one after another'''
+        if engine == "numpy":
+            for batch, data, cycles in self.run_lockstep(kernel_number, inputs, max_iter, batch_size):
+                for i in range(len(data)):
+                    self.disco_cgra.set_data(data[i, :batch.data_size])
+                    yield int(cycles[i])
+            return
+        ini_col, end_col, n_instr_per_col, srf_spm_bank = self.load_kernel_imems(kernel_number)
+        initial_state = self.disco_cgra.get_state()
+        for blocks in inputs:
+            self.disco_cgra.set_state(initial_state)
+            for first_line, lines in blocks:
+                self.disco_cgra.spm.setLines(first_line, lines)
+            for col in range(ini_col, end_col+1):
+                self.disco_cgra.lsus[col].regs[7] = srf_spm_bank
+            yield self.run_cycles(ini_col, end_col, n_instr_per_col, max_iter, TRACE_LEVEL.NONE, None, engine)
+
+    def run_lockstep(self, kernel_number, inputs, max_iter=1500, batch_size=None):
+        '''Generator that executes a kernel once for each item of inputs (as in run_instances) on a CGRA_BATCH:
+        batch_size instances (BATCH_SIZE if None) at a time run in lockstep, each one from the state of the CGRA when
+        the generator starts with its blocks copied into its SPM. The CGRA itself does not change. For each batch it
+        yields the CGRA_BATCH, the final data of the instances (see CGRA_BATCH.new_data) and their numbers of cycles'''
+        from .batch import CGRA_BATCH, BATCH_SIZE # Only needed by lockstep runs
+        if batch_size is None:
+            batch_size = BATCH_SIZE
+        if batch_size < 1:
+            raise ValueError("The batch size should be at least 1, not " + str(batch_size) + ".")
+        ini_col, end_col, n_instr_per_col, srf_spm_bank = self.load_kernel_imems(kernel_number)
+        batch = CGRA_BATCH(self.disco_cgra, ini_col, end_col, n_instr_per_col)
+        initial_data = self.disco_cgra.get_data()
+        inputs = iter(inputs)
+        while True:
+            instances = list(islice(inputs, batch_size))
+            if not instances:
+                return
+            data = batch.new_data(initial_data, len(instances), srf_spm_bank)
+            for i, blocks in enumerate(instances):
+                for first_line, lines in blocks:
+                    batch.set_lines(data[i:i+1], first_line, lines)
+            yield batch, data, batch.run(data, max_iter)
+
+    def run_stream(self, kernel_number, frames, out_first_line=0, out_n_lines=SPM_NLINES, first_line=0, queue_size=4, max_iter=1500, engine="jit"):
+        '''Execute a kernel once for each input frame of the iterable frames, and yield the (outputs, cycles) of each
+        frame as soon as it is done: the SPM lines from out_first_line on (out_n_lines of them, an int32 array) and
+        the number of cycles. A frame is {line: values} or an array of lines written from first_line on (see
+        frame_blocks), for example the SRF line and the data of a window of a signal. As in run_batch, every frame
+        starts from the state of the CGRA when the stream starts, and the kernel stays in the unit IMEMs between
+        frames. A background thread reads and converts up to queue_size frames ahead, and waits while the consumer
+        is behind. With the "numpy" engine the frames run in lockstep, queue_size of them at a time'''
+        if engine not in ENGINES:
+            raise ValueError("Engine not recognized: " + str(engine) + ". It should be one of " + str(ENGINES) + ".")
+        self.disco_cgra.spm.checkLines(out_first_line, out_n_lines)
+        from .stream import frame_blocks, read_ahead # Only needed by streams, threading is slow to import
+        inputs = read_ahead((frame_blocks(frame, first_line) for frame in frames), queue_size)
+        def stream():
+            for cycles in self.run_instances(kernel_number, inputs, max_iter, engine, max(queue_size, 1)):
+                outputs = np.zeros((out_n_lines, SPM_NWORDS), dtype=np.int32)
+                yield self.disco_cgra.spm.getLines(out_first_line, outputs), cycles
+        return stream()
+
+    def run_tiled(self, kernel_number, tiled_kernel, signal, out=None, max_iter=1500, engine="jit"):
+        '''Stream a 1-D signal longer than the SPM through a kernel, one tile at a time, as described by
+        tiled_kernel (see TILED_KERNEL). The signal can be a numpy.memmap: only the tile that runs and the next one,
+        read in the background while the kernel runs, are in memory (with the "numpy" engine, the tiles of a batch
+        that runs in lockstep, see run_instances). Return:
+            -   out: the outputs of each tile, out if given (for example a preallocated numpy.memmap) or an int32
+                array, of shape (n_tiles, tiled_kernel.out_size)
+            -   cycles: the number of cycles of each tile, an int64 array of shape (n_tiles,)
+        Afterwards the CGRA keeps the state of the last tile, as after a run()'''
+        if engine not in ENGINES:
+            raise ValueError("Engine not recognized: " + str(engine) + ". It should be one of " + str(ENGINES) + ".")
+        signal = np.asarray(signal)
+        if signal.ndim != 1:
+            raise ValueError("The signal of a tiled run should be 1-D, not of shape " + str(signal.shape) + ".")
+        n_tiles = tiled_kernel.n_tiles(len(signal))
+        if out is None:
+            out = np.zeros((n_tiles, tiled_kernel.out_size), dtype=np.int32)
+        elif out.shape != (n_tiles, tiled_kernel.out_size):
+            raise ValueError("Tiled output should have shape " + str((n_tiles, tiled_kernel.out_size)) + ", not " + str(out.shape) + ".")
+        cycles = np.zeros(n_tiles, dtype=np.int64)
+        # The constant lines and the SRF values are part of the state every tile starts from
+        srf_spm_bank = self.disco_cgra.kmem.imem.get_params(kernel_number)[3]
+        tiled_kernel.load_constants(self.disco_cgra.spm, srf_spm_bank)
+        out_lines = np.zeros((tiled_kernel.out_n_lines, SPM_NWORDS), dtype=np.int32)
+        from concurrent.futures import ThreadPoolExecutor # Only needed by tiled runs, slow to import
+        from .stream import staged
+        with ThreadPoolExecutor(max_workers=1) as stager:
+            tiles = staged(stager, (partial(tiled_kernel.tile_input, signal, i) for i in range(n_tiles)))
+            for i, tile_cycles in enumerate(self.run_instances(kernel_number, tiles, max_iter, engine)):
+                cycles[i] = tile_cycles
+                self.disco_cgra.spm.getLines(tiled_kernel.out_first_line, out_lines)
+                out[i] = out_lines.reshape(-1)[tiled_kernel.out_offset:tiled_kernel.out_offset + tiled_kernel.out_size]
+        return out, cycles
+
+    def reset(self, keep_imem=True, keep_spm=False):
+        '''Clear the CGRA between runs instead of building a new SIMULATOR, see CGRA.reset. With the kernels kept in
+        the IMEMs (and translated by the JIT), running one of them again only needs its inputs in the SPM'''
+        self.disco_cgra.reset(keep_imem, keep_spm)
+
+    def snapshot(self):
+        '''Every architectural element of the CGRA (SPM, VWRs, SRFs, registers, ALUs, LCU branch and exit, IMEMs and
+        KMEM) in one int64 array, see CGRA.snapshot'''
+        return self.disco_cgra.snapshot()
+
+    def restore(self, snap):
+        '''Go back to a state given by snapshot. Raise ValueError if it was taken from a CGRA of other sizes'''
+        self.disco_cgra.restore(snap)
+
+    def load_kernel_imems(self, kernel_number):
+        '''Move the instructions of a kernel from the general IMEM to the IMEM of each unit of the used columns.
+        Return the first and last used columns, the number of instructions per column and the SRF line of the SPM'''
         # Decode the kernel number of instructions and which ones they are
         n_instr_per_col, imem_start_addr, col_one_hot, srf_spm_bank = self.disco_cgra.kmem.imem.get_params(kernel_number)
         n_instr_per_col+=1
@@ -113,66 +373,288 @@ class SIMULATOR:
         # Control the columns used
         ini_col, end_col = self.parseColUsageFromOneHot(col_one_hot)
         
-        # Initialize the index of the SRF values on the SPM on R7 of the LSU
-        for col in range(ini_col, end_col+1):
-            self.disco_cgra.lsus[col].regs[7] = srf_spm_bank
-        
         # Move the instructions from the general imem to each specilized unit's imem
         addr = imem_start_addr
         for col in range(ini_col, end_col+1):
             pos = 0
             for j in range(n_instr_per_col):
                 # Debug
-                self.disco_cgra.lcus[col].imem.set_word(int(self.disco_cgra.imem.lcu_imem[addr].get_word(),2), pos)
-                self.disco_cgra.lsus[col].imem.set_word(int(self.disco_cgra.imem.lsu_imem[addr].get_word(),2), pos)
-                self.disco_cgra.mxcus[col].imem.set_word(int(self.disco_cgra.imem.mxcu_imem[addr].get_word(),2), pos)
+                self.disco_cgra.lcus[col].imem.set_word(self.disco_cgra.imem.lcu_imem.get_int(addr), pos)
+                self.disco_cgra.lsus[col].imem.set_word(self.disco_cgra.imem.lsu_imem.get_int(addr), pos)
+                self.disco_cgra.mxcus[col].imem.set_word(self.disco_cgra.imem.mxcu_imem.get_int(addr), pos)
                 for rc in range(CGRA_ROWS):
-                    self.disco_cgra.rcs[col][rc].imem.set_word(int(self.disco_cgra.imem.rcs_imem[rc][addr].get_word(),2), pos)
+                    self.disco_cgra.rcs[col][rc].imem.set_word(self.disco_cgra.imem.rcs_imem[rc].get_int(addr), pos)
                 pos+=1
                 addr+=1
-        
+        return ini_col, end_col, n_instr_per_col, srf_spm_bank
+
+    def run_cycles(self, ini_col, end_col, n_instr_per_col, max_iter, trace_level, trace_sink, engine, pc_counts=None, branch_counts=None):
+        '''Execute the kernel already in the IMEMs of the units from pc 0, see run(). Return the number of cycles.
+        With pc_counts (a list of n_instr_per_col counts), count the executions of each pc, and the taken branches
+        in branch_counts, a dict {(col, pc, target pc): count}'''
+        trace_cycles = trace_level >= TRACE_LEVEL.CYCLE
+        # Counted runs do not take the cache or the translated kernel, which do not see the pcs
+        counted = pc_counts is not None
+        # A run already in the result cache is not executed, the CGRA goes to its final state
+        result_key = None
+        if self.result_cache is not None and not trace_cycles and not counted:
+            result_key = self.result_cache.get_key(self.disco_cgra, ini_col, end_col, n_instr_per_col, max_iter)
+            result = self.result_cache.get(result_key)
+            if result is not None:
+                data, pc, cycle_number = result
+                self.disco_cgra.set_data(data)
+                if trace_level >= TRACE_LEVEL.SUMMARY:
+                    trace_sink.emit(TRACE_EVENT("summary", cycle_number, pc, max_iter_reached=(cycle_number == max_iter)))
+                return cycle_number
 
         # Execute each instruction cycle by cycle
         cycle_number = 0        
         pc = 0 # The pc is the same for both columns because is the same kernel
         exit = False
-        
-        while pc < n_instr_per_col and cycle_number < max_iter and not exit:
-            print("---------------------")
-            print("       PC: " + str(pc))
-            print("---------------------")
-            for col in range(ini_col, end_col+1):
-                self.disco_cgra.lsus[col].run(pc, self.disco_cgra, col) # Check if they need anything from the others
+
+        # The translated kernel does not stop after the first cycle when an LCU is still exiting from a previous run
+        if engine == "jit" and not trace_cycles and not counted and not any(self.disco_cgra.lcus[col].exit == 1 for col in range(ini_col, end_col+1)):
+            if self.kernel_jit is None:
+                from .jit import DEFAULT_KERNEL_JIT # Only needed by the "jit" engine
+                self.kernel_jit = DEFAULT_KERNEL_JIT
+            kernel = self.kernel_jit.get_kernel(self.disco_cgra, ini_col, end_col, n_instr_per_col)
+            pc, cycle_number = kernel(self.disco_cgra, pc, cycle_number, max_iter)
+            exit = any(self.disco_cgra.lcus[col].exit == 1 for col in range(ini_col, end_col+1))
+
+        # Compile each instruction of the kernel into one callable per unit, so that the execution
+        # loop does not select opcodes and operand sources any more
+        rc_array = None
+        update_shared_values = self.disco_cgra.updateSharedValues
+        if pc < n_instr_per_col and cycle_number < max_iter and not exit:
+            if engine == "numpy" and not trace_cycles:
+                from .rc_array import RC_ARRAY # Only needed by the "numpy" engine
+                rc_array = RC_ARRAY(self.disco_cgra)
+                rc_array.attach()
+                cycle_slots, slot_units = self.compile_kernel(ini_col, end_col, n_instr_per_col, rc_array)
+                rc_alus = set(id(alu) for alu in rc_array.alus)
+                unit_alus = [alu for alu in self.disco_cgra.alus if id(alu) not in rc_alus]
+                def update_shared_values():
+                    for alu in unit_alus:
+                        alu.updateALUValues()
+                    rc_array.updateALUValues()
+            else:
+                cycle_slots, slot_units = self.compile_kernel(ini_col, end_col, n_instr_per_col)
+
+        try:
+            while pc < n_instr_per_col and cycle_number < max_iter and not exit:
+                if trace_cycles:
+                    trace_sink.emit(TRACE_EVENT("cycle", cycle_number, pc))
+                # Per column: LSU, RCs (before MXCU because this one can alterate the VWR idx), MXCU and
+                # last the LCU because it might need the ALU flags of the RCs and modifies VWR and SRF
+                if trace_cycles:
+                    for slot, (col, unit, name, row) in zip(cycle_slots[pc], slot_units):
+                        slot()
+                        self.trace_unit(trace_sink, cycle_number, pc, col, unit, name, row)
+                else:
+                    for slot in cycle_slots[pc]:
+                        slot()
+                update_shared_values()
+                if counted:
+                    pc_counts[pc] += 1
+                pc+=1 # Update pc
+                # Check branches
+                branches = 0
+                for col in range(ini_col, end_col+1):
+                    if self.disco_cgra.lcus[col].branch == 1:
+                        branches += 1
+                        if counted:
+                            edge = (col, pc - 1, self.disco_cgra.lcus[col].branch_pc)
+                            branch_counts[edge] = branch_counts.get(edge, 0) + 1
+                        pc = self.disco_cgra.lcus[col].branch_pc
+                assert(branches <= 1), "More than one branch at the same cycle"
+                # Check exit
+                for col in range(ini_col, end_col+1):
+                    if self.disco_cgra.lcus[col].exit == 1:
+                        exit = True
+                cycle_number+=1
+        finally:
+            # Give the RC state back to the RC objects, also when a cycle fails
+            if rc_array is not None:
+                rc_array.detach()
+
+        if result_key is not None:
+            self.result_cache.put(result_key, self.disco_cgra.get_data(), pc, cycle_number)
+        if trace_level >= TRACE_LEVEL.SUMMARY:
+            trace_sink.emit(TRACE_EVENT("summary", cycle_number, pc, max_iter_reached=(cycle_number == max_iter)))
+        return cycle_number
+
+    def compile_kernel(self, ini_col, end_col, n_instr_per_col, rc_array=None):
+        '''Compile the instructions loaded in the IMEMs of the units of the used columns. Return:
+            -   cycle_slots: for each pc, the list of callables that execute the instructions of that cycle in order
+            -   slot_units: for each callable of a cycle, its (col, unit, name, row), where row is None for the non-RC units
+        With an attached rc_array, the RCs of all the columns run in one callable per cycle, see compile_rc_array_kernel'''
+        if rc_array is not None:
+            return self.compile_rc_array_kernel(ini_col, end_col, n_instr_per_col, rc_array)
+        cycle_slots = [[] for _ in range(n_instr_per_col)]
+        slot_units = []
+        for col in range(ini_col, end_col+1):
+            lsu = self.disco_cgra.lsus[col]
+            rcs = self.disco_cgra.rcs[col]
+            mxcu = self.disco_cgra.mxcus[col]
+            lcu = self.disco_cgra.lcus[col]
+            # The per-unit IMEMs keep their words decoded into integer fields
+            lsu_fields = lsu.imem.fields.tolist()
+            rcs_fields = [rcs[rc].imem.fields.tolist() for rc in range(CGRA_ROWS)]
+            mxcu_fields = mxcu.imem.fields.tolist()
+            lcu_fields = lcu.imem.fields.tolist()
+            for pc in range(n_instr_per_col):
+                # The MXCU control signals (SRF and VWR selection and write enables) are used by every unit
+                # of the column, so build them once per instruction and share them between all of them
+                ctrl = mxcu.imem.get_control(pc)
+                cycle_slots[pc].append(lsu.compile(pc, lsu_fields[pc], ctrl, self.disco_cgra, col))
                 for rc in range(CGRA_ROWS):
-                    self.disco_cgra.rcs[col][rc].run(pc, self.disco_cgra, col, rc)
-                # RCs before MSCU becuase this one can alterate the VWR idx
-                self.disco_cgra.mxcus[col].run(pc, self.disco_cgra, col)
-                # Last the LCU because it might need the ALU flags of the RCs and modifies VWR and SRF
-                self.disco_cgra.lcus[col].run(pc, self.disco_cgra, col)
-            self.disco_cgra.updateSharedValues()
-            pc+=1 # Update pc
-            # Check branches
-            branches = 0
-            for col in range(ini_col, end_col+1):
-                if self.disco_cgra.lcus[col].branch == 1:
-                    branches += 1
-                    pc = self.disco_cgra.lcus[col].branch_pc
-            assert(branches <= 1), "More than one branch at the same cycle"
-            # Check exit
-            for col in range(ini_col, end_col+1):
-                if self.disco_cgra.lcus[col].exit == 1:
-                    exit = True
-            cycle_number+=1
-        
-        if cycle_number == max_iter:
-            print("Max number of iterations reached.")
-        else: print("End...")
+                    cycle_slots[pc].append(rcs[rc].compile(pc, rcs_fields[rc][pc], ctrl, self.disco_cgra, col, rc))
+                cycle_slots[pc].append(mxcu.compile(pc, mxcu_fields[pc], ctrl, self.disco_cgra, col))
+                cycle_slots[pc].append(lcu.compile(pc, lcu_fields[pc], ctrl, self.disco_cgra, col))
+            slot_units.append((col, lsu, "LSU", None))
+            for rc in range(CGRA_ROWS):
+                slot_units.append((col, rcs[rc], "RC" + str(rc), rc))
+            slot_units.append((col, mxcu, "MXCU", None))
+            slot_units.append((col, lcu, "LCU", None))
+        return cycle_slots, slot_units
+
+    def compile_rc_array_kernel(self, ini_col, end_col, n_instr_per_col, rc_array):
+        '''Same as compile_kernel, but the RCs of all the used columns run at once on the rc_array. There are no
+        slot_units. The LSUs of the columns run first, in order, since the LSU of a column can store an SPM line that
+        the next one loads in the same cycle and the RCs read the VWRs that their LSU loads. The RCs of a column
+        only read the VWRs, SRF and MXCU of their own column, so the MXCU and LCU of the columns can run after all of
+        them. The order only differs when an instruction fails, so a cycle that may fail is checked first (see
+        compile_cycle_check and guard_cycle)'''
+        cycle_slots = [[] for _ in range(n_instr_per_col)]
+        cols = range(ini_col, end_col+1)
+        fields = { col: (self.disco_cgra.lsus[col].imem.fields.tolist(), self.disco_cgra.mxcus[col].imem.fields.tolist(),
+                         self.disco_cgra.lcus[col].imem.fields.tolist()) for col in cols }
+        for pc in range(n_instr_per_col):
+            ctrls = { col: self.disco_cgra.mxcus[col].imem.get_control(pc) for col in cols }
+            slots = []
+            for col in cols:
+                slots.append(self.disco_cgra.lsus[col].compile(pc, fields[col][0][pc], ctrls[col], self.disco_cgra, col))
+            rc_step = rc_array.compile(pc, ini_col, end_col)
+            if rc_step is not None:
+                slots.append(rc_step)
+            for col in cols:
+                slots.append(self.disco_cgra.mxcus[col].compile(pc, fields[col][1][pc], ctrls[col], self.disco_cgra, col))
+                slots.append(self.disco_cgra.lcus[col].compile(pc, fields[col][2][pc], ctrls[col], self.disco_cgra, col))
+            check = self.compile_cycle_check(pc, ini_col, end_col, fields, ctrls, rc_array)
+            if check is None:
+                cycle_slots[pc] = slots
+            else:
+                cycle_slots[pc].append(self.guard_cycle(pc, ini_col, end_col, slots, check, rc_array))
+        return cycle_slots, []
+
+    def compile_cycle_check(self, pc, ini_col, end_col, fields, ctrls, rc_array):
+        '''Get a function without arguments that tells whether the instructions of pc run without errors in the
+        current state, see compile_rc_array_kernel. It checks the SPM lines of the LSU loads and stores and the VWR
+        indices read by the RCs and written by the MXCUs, which no unit changes before them in the cycle. None if
+        no instruction of pc can fail, False if some instruction may fail whatever the state'''
+        rc_reads = rc_array.compile_check(pc, ini_col, end_col)
+        if rc_reads is None:
+            return False
+        slice_size = int(SPM_NWORDS/CGRA_ROWS)
+        lines = []      # Registers of the LSUs whose R7 is the SPM line of a load or store
+        indices = []    # VWR indices: (MXCU registers, mask register, lowest and highest offsets, lowest index)
+        for col in range(ini_col, end_col+1):
+            lsu = self.disco_cgra.lsus[col]
+            mxcu = self.disco_cgra.mxcus[col]
+            lcu = self.disco_cgra.lcus[col]
+            ctrl = ctrls[col]
+            # The encodings that are not recognized always fail
+            rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel, vwr_sel_shuf_op, mem_op = fields[col][0][pc]
+            if lsu.compileMux(muxa_sel, self.disco_cgra, col, ctrl.srf_sel) is None or lsu.compileMux(muxb_sel, self.disco_cgra, col, ctrl.srf_sel) is None:
+                return False
+            if mem_op == 1 or mem_op == 2: # LOAD or STORE
+                lines.append(lsu.regs)
+            rf_wsel, rf_we, alu_op, muxb_sel, muxa_sel = fields[col][1][pc][5:]
+            if mxcu.compileMux(muxa_sel, self.disco_cgra, col, ctrl.srf_sel) is None or mxcu.compileMux(muxb_sel, self.disco_cgra, col, ctrl.srf_sel) is None:
+                return False
+            if ctrl.vwr_row_we:
+                if ctrl.vwr_sel >= N_VWR_PER_COL:
+                    return False
+                rows = [row for row in range(CGRA_ROWS) if (ctrl.vwr_row_we >> row) & 1]
+                # The writes index the NumPy array of the VWR, which takes negative indices
+                indices.append((mxcu.regs, 5 + ctrl.vwr_sel, slice_size*rows[0], slice_size*rows[-1], -N_ELEMS_PER_VWR))
+            imm, rf_wsel, rf_we, alu_op, br_mode, muxb_sel, muxa_sel = fields[col][2][pc]
+            if alu_op > 14 or lcu.compileMux(muxa_sel, self.disco_cgra, col, ctrl.srf_sel, imm, True, alu_op == 11) is None or \
+               lcu.compileMux(muxb_sel, self.disco_cgra, col, ctrl.srf_sel, imm, False, alu_op == 11) is None:
+                return False
+            for vwr in range(N_VWR_PER_COL):
+                rows = [row for read_col, read_vwr, row in rc_reads if (read_col, read_vwr) == (col, vwr)]
+                if rows:
+                    indices.append((mxcu.regs, 5 + vwr, slice_size*rows[0], slice_size*rows[-1], 0))
+        if not lines and not indices:
+            return None
+
+        def check():
+            for regs in lines:
+                if regs[7] < 0 or regs[7] >= SPM_NLINES:
+                    return False
+            for regs, mask_reg, low, high, lowest in indices:
+                slice_idx = regs[0] & regs[mask_reg]
+                if slice_idx + low < lowest or slice_idx + high >= N_ELEMS_PER_VWR:
+                    return False
+            return True
+        return check
+
+    def guard_cycle(self, pc, ini_col, end_col, slots, check, rc_array):
+        '''Get a function without arguments that runs the slots of a cycle of compile_rc_array_kernel if check tells
+        that they run without errors. Otherwise the cycle runs unit by unit on the RC objects, in the order of
+        compile_kernel, so that it fails with the same error and leaves the same state as in the interpreter'''
+        unit_slots = []
+
+        def cycle():
+            if check is not False and check():
+                for slot in slots:
+                    slot()
+                return
+            rc_array.detach()
+            try:
+                if not unit_slots:
+                    unit_slots.extend(self.compile_cycle(pc, ini_col, end_col))
+                for slot in unit_slots:
+                    slot()
+            finally:
+                rc_array.attach()
+        return cycle
+
+    def compile_cycle(self, pc, ini_col, end_col):
+        '''Compile the instructions of pc of the units of the used columns into callables, in the order of compile_kernel'''
+        slots = []
+        for col in range(ini_col, end_col+1):
+            mxcu = self.disco_cgra.mxcus[col]
+            ctrl = mxcu.imem.get_control(pc)
+            lsu = self.disco_cgra.lsus[col]
+            slots.append(lsu.compile(pc, lsu.imem.fields[pc].tolist(), ctrl, self.disco_cgra, col))
+            for row, rc in enumerate(self.disco_cgra.rcs[col]):
+                slots.append(rc.compile(pc, rc.imem.fields[pc].tolist(), ctrl, self.disco_cgra, col, row))
+            slots.append(mxcu.compile(pc, mxcu.imem.fields[pc].tolist(), ctrl, self.disco_cgra, col))
+            lcu = self.disco_cgra.lcus[col]
+            slots.append(lcu.compile(pc, lcu.imem.fields[pc].tolist(), ctrl, self.disco_cgra, col))
+        return slots
+
+    def trace_unit(self, trace_sink, cycle_number, pc, col, unit, name, row=None):
+        '''Report to the trace sink the instruction just executed by a unit'''
+        asm = None
+        if trace_sink.disasm:
+            if row is None:
+                asm = unit.get_trace_asm(pc, self.disco_cgra, col)
+            else:
+                asm = unit.get_trace_asm(pc, self.disco_cgra, col, row)
+        trace_sink.emit(TRACE_EVENT("unit", cycle_number, pc, col, name, unit.alu.newRes, asm))
                     
     def setSPMLine(self, nline, vector):
         self.disco_cgra.setSPMLine(nline, vector)
     
-    def loadSPMData(self, data):
-        self.disco_cgra.loadSPMData(data)
+    def loadSPMData(self, data, first_line=0):
+        self.disco_cgra.loadSPMData(data, first_line)
+
+    def storeSPMData(self, out, first_line=0):
+        '''Copy the SPM lines from first_line on into out, an array of shape (n, SPM_NWORDS) such as a numpy.memmap'''
+        return self.disco_cgra.spm.getLines(first_line, out)
 
     def getSPMLine(self, nline):
         return self.disco_cgra.spm.getLine(nline)
@@ -297,6 +779,7 @@ class SIMULATOR:
         # Write instructions to bitstream
         self.create_header_file(kernel_path)
         self.create_hex_csv_file(kernel_path, version + "_autogen")
+        self.create_binary_file(kernel_path, version + "_autogen")
 
     def create_hex_csv_file(self, kernel_path, version):
         file_name = kernel_path + FILENAME_INSTR + "_hex" + version + EXT
@@ -317,6 +800,19 @@ class SIMULATOR:
                     elems_to_write.append(self.disco_cgra.imem.rcs_imem[rc][i].get_word_in_hex())
                 writer.writerow(elems_to_write)
 
+    def create_binary_file(self, kernel_path, version):
+        '''Write the KMEM and the general IMEM as a binary bitstream, see read_bitstream and kernel_load_bitstream'''
+        file_name = kernel_path + FILENAME_INSTR + "_bin" + version + EXT_BIN
+        print("Creating file: " + file_name)
+        imem = self.disco_cgra.imem
+        words = [int(word, 2) for word in self.disco_cgra.kmem.imem.IMEM]
+        for unit_imem in [imem.lcu_imem, imem.lsu_imem, imem.mxcu_imem] + imem.rcs_imem:
+            words += unit_imem.get_ints()
+        data = np.array(bitstream_header() + words, dtype="<u4")
+        tmp_name = file_name + ".tmp"
+        data.tofile(tmp_name)
+        os.replace(tmp_name, file_name) # Processes that map the old file keep reading it
+
     def create_header_file(self, kernel_path):
         file_name = kernel_path + 'dsip_bitstream.h'
         print("Creating file: " + file_name)
@@ -1,14 +1,42 @@
+import numpy as np
 from .params import *
+
+def copyWords(dest, values):
+    '''Copy values into the int32 array dest, wrapped to 32-bit words as the hardware memories keep them'''
+    if not isinstance(values, np.ndarray):
+        values = np.asarray(values, dtype=np.int64)
+    np.copyto(dest, values, casting="unsafe")
+
 class SPM:
     def __init__(self):
-        self.lines = [[0 for _ in range(SPM_NWORDS)] for _ in range(SPM_NLINES)]
+        # One contiguous block of 32-bit words, each line is a row
+        self.lines = np.zeros((SPM_NLINES, SPM_NWORDS), dtype=np.int32)
     
     def setLine(self, nline, vec):
+        '''Copy the values of vec into a line'''
         assert(nline >= 0 & nline < SPM_NLINES), "SPM: Number of SPM line out of bounds. It should be >= 0 and < " + str(SPM_NLINES) + "."
         assert(len(vec) == SPM_NWORDS), "SPM: Vector should have " + str(SPM_NWORDS) + " elements."
-        self.lines[nline] = vec
+        copyWords(self.lines[nline], vec)
     
+    def setLines(self, first_line, values):
+        '''Copy a block of lines, an array (for example a numpy.memmap) or a list of lists, into the lines from
+        first_line on'''
+        self.checkLines(first_line, len(values))
+        copyWords(self.lines[first_line:first_line+len(values)], values)
+
+    def getLines(self, first_line, out):
+        '''Copy the lines from first_line on into out, an array (for example a numpy.memmap) of shape (n, SPM_NWORDS)'''
+        self.checkLines(first_line, len(out))
+        np.copyto(out, self.lines[first_line:first_line+len(out)], casting="unsafe")
+        return out
+
+    def checkLines(self, first_line, n_lines):
+        '''Check that a block of n_lines lines from first_line on is in the SPM'''
+        if first_line < 0 or first_line + n_lines > SPM_NLINES:
+            raise Exception("SPM: Lines " + str(first_line) + " to " + str(first_line + n_lines - 1) + " out of bounds. They should be >= 0 and < " + str(SPM_NLINES) + ".")
+
     def getLine(self, nline):
+        '''View of a line, changing it changes the SPM'''
         if nline < 0 or nline >= SPM_NLINES:
             raise Exception("SPM: Number of SPM line " + str(nline) + " out of bounds. It should be >= 0 and < " + str(SPM_NLINES) + ".")
-        return self.lines[nline]
\ No newline at end of file
+        return self.lines[nline]
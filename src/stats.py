@@ -0,0 +1,136 @@
+"""stats.py: Performance counters of the kernel runs of the DISCO-CGRA simulator"""
+
+import numpy as np
+
+from .params import *
+from .lcu import LCU_ALU_OPS, LCU_MUXA_SEL, LCU_MUXB_SEL
+from .lsu import LSU_ALU_OPS, LSU_MUX_SEL, LSU_MEM_OP, SHUFFLE_SEL
+from .mxcu import MXCU_ALU_OPS, MXCU_MUX_SEL, ALU_SRF_WRITE
+from .rc import RC_ALU_OPS, RC_MUX_SEL
+
+# LCU operations that can change the pc
+LCU_BRANCH_OPS = (LCU_ALU_OPS.BEQ, LCU_ALU_OPS.BNE, LCU_ALU_OPS.BGEPD, LCU_ALU_OPS.BLT, LCU_ALU_OPS.JUMP)
+
+class RUN_STATS:
+    '''Performance counters of a kernel run, see SIMULATOR.run(stats=True). The run only counts how many times
+    each pc is executed (pc_counts) and how many times the branch of each LCU at each pc is taken; the rest of
+    the counters come from the instructions in the IMEMs of the units:
+
+       -   cycles: number of cycles of the run. max_iter_reached: whether it stopped because of max_iter
+       -   units: (col, name) of each unit of the used columns, name is LCU, LSU, MXCU, RC0, ..., RCN
+       -   active_cycles: {(col, name): cycles} in which the unit does something. For the LCU and the RCs, an ALU
+           operation other than NOP. The LSU ALU has no NOP, it is active when it accesses the SPM, shuffles or
+           writes its result. The MXCU is active with an ALU operation or a VWR or SRF write
+       -   alu_ops: {(col, name): {operation: count}} of the ALU operations of the active cycles (LSU operations
+           only when their result is written)
+       -   spm_loads, spm_stores: SPM lines loaded and stored by the LSUs, to and from a VWR or the SRF
+       -   srf_reads: operands of the active units read from the SRF. srf_writes: SRF registers written
+       -   vwr_writes: words written to the VWRs by the RCs of each row, a list of CGRA_ROWS counts
+       -   branches_taken, branches_not_taken: executed branch operations of the LCUs (JUMP is always taken)
+       -   shuffles: {mode: count} of the LSU shuffles (see SHUFFLE_SEL)
+       -   cols: the used columns
+       -   pc_counts: times each pc was executed, an int64 array. The columns run the same pcs
+       -   branch_counts: {(col, pc, target pc): count} of the branches taken by the LCUs. taken_counts: {col:
+           int64 array} of the times the LCU branch at each pc was taken
+    '''
+    def __init__(self, disco_cgra, ini_col, end_col, cycles, max_iter_reached, pc_counts, branch_counts):
+        self.cycles = cycles
+        self.max_iter_reached = max_iter_reached
+        self.cols = list(range(ini_col, end_col+1))
+        self.pc_counts = np.array(pc_counts, dtype=np.int64)
+        self.branch_counts = dict(branch_counts)
+        self.taken_counts = { col: np.zeros(len(self.pc_counts), dtype=np.int64) for col in self.cols }
+        for (col, pc, target), n in self.branch_counts.items():
+            self.taken_counts[col][pc] += n
+        self.units = []
+        self.active_cycles = {}
+        self.alu_ops = {}
+        self.spm_loads = 0
+        self.spm_stores = 0
+        self.srf_reads = 0
+        self.srf_writes = 0
+        self.vwr_writes = [0 for _ in range(CGRA_ROWS)]
+        self.branches_taken = 0
+        self.branches_not_taken = 0
+        self.shuffles = {}
+        for col in range(ini_col, end_col+1):
+            self.count_column(disco_cgra, col)
+
+    def count_column(self, disco_cgra, col):
+        '''Add the counters of the units of a column'''
+        n_instr = len(self.pc_counts)
+        counts = self.pc_counts
+        lcu = disco_cgra.lcus[col].imem.fields[:n_instr]
+        lsu = disco_cgra.lsus[col].imem.fields[:n_instr]
+        mxcu = disco_cgra.mxcus[col].imem.fields[:n_instr]
+        rcs = [disco_cgra.rcs[col][rc].imem.fields[:n_instr] for rc in range(CGRA_ROWS)]
+        vwr_row_we, srf_we, alu_srf_write = mxcu[:, 0], mxcu[:, 4], mxcu[:, 3]
+        srf_write = srf_we == 1
+
+        # LCU: imm, rf_wsel, rf_we, alu_op, br_mode, muxb, muxa
+        lcu_active = lcu[:, 3] != LCU_ALU_OPS.NOP
+        self.count_unit(col, "LCU", counts, lcu_active, lcu[:, 3], LCU_ALU_OPS)
+        self.count_srf_reads(counts, lcu_active, lcu[:, 6] == LCU_MUXA_SEL.SRF, lcu[:, 5] == LCU_MUXB_SEL.SRF)
+        branch = np.isin(lcu[:, 3], LCU_BRANCH_OPS)
+        taken = int(self.taken_counts[col].sum())
+        self.branches_taken += taken
+        self.branches_not_taken += int(counts[branch].sum()) - taken
+
+        # LSU: rf_wsel, rf_we, alu_op, muxb, muxa, vwr_sel_shuf_op, mem_op
+        mem_op = lsu[:, 6]
+        lsu_result = (lsu[:, 1] == 1) | (srf_write & (alu_srf_write == ALU_SRF_WRITE.LSU))
+        self.count_unit(col, "LSU", counts, lsu_result | (mem_op != LSU_MEM_OP.NOP), lsu[:, 2], LSU_ALU_OPS, lsu_result)
+        self.count_srf_reads(counts, lsu_result, lsu[:, 4] == LSU_MUX_SEL.SRF, lsu[:, 3] == LSU_MUX_SEL.SRF)
+        self.spm_loads += int(counts[mem_op == LSU_MEM_OP.LOAD].sum())
+        self.spm_stores += int(counts[mem_op == LSU_MEM_OP.STORE].sum())
+        for mode in SHUFFLE_SEL:
+            n = int(counts[(mem_op == LSU_MEM_OP.SHUFFLE) & (lsu[:, 5] == mode)].sum())
+            if n:
+                self.shuffles[mode.name] = self.shuffles.get(mode.name, 0) + n
+
+        # MXCU: vwr_row_we, vwr_sel, srf_sel, alu_srf_write, srf_we, rf_wsel, rf_we, alu_op, muxb, muxa
+        mxcu_alu = mxcu[:, 7] != MXCU_ALU_OPS.NOP
+        self.count_unit(col, "MXCU", counts, mxcu_alu | srf_write | (vwr_row_we != 0), mxcu[:, 7], MXCU_ALU_OPS, mxcu_alu)
+        self.count_srf_reads(counts, mxcu_alu, mxcu[:, 9] == MXCU_MUX_SEL.SRF, mxcu[:, 8] == MXCU_MUX_SEL.SRF)
+        self.srf_writes += int(counts[srf_write].sum())
+
+        # RCs: rf_wsel, rf_we, muxf, alu_op, op_mode, muxb, muxa
+        for rc in range(CGRA_ROWS):
+            rc_active = rcs[rc][:, 3] != RC_ALU_OPS.NOP
+            self.count_unit(col, "RC" + str(rc), counts, rc_active, rcs[rc][:, 3], RC_ALU_OPS)
+            self.count_srf_reads(counts, rc_active, rcs[rc][:, 6] == RC_MUX_SEL.SRF, rcs[rc][:, 5] == RC_MUX_SEL.SRF)
+            # Bit rc of the MXCU vwr_row_we enables the write of the result of RC rc to its slice of the VWR
+            self.vwr_writes[rc] += int(counts[(vwr_row_we >> rc) & 1 == 1].sum())
+
+    def count_unit(self, col, name, counts, active, alu_op, ops, counted_ops=None):
+        '''Add the active cycles of a unit and the histogram of its ALU operations (ops, an Enum), those of the
+        active cycles unless counted_ops selects other ones'''
+        if counted_ops is None:
+            counted_ops = active
+        self.units.append((col, name))
+        self.active_cycles[(col, name)] = int(counts[active].sum())
+        histogram = {}
+        for op in ops:
+            n = int(counts[counted_ops & (alu_op == op)].sum())
+            if n:
+                histogram[op.name] = n
+        self.alu_ops[(col, name)] = histogram
+
+    def count_srf_reads(self, counts, active, muxa_srf, muxb_srf):
+        '''Add the SRF reads of the operands of a unit'''
+        self.srf_reads += int(counts[active & muxa_srf].sum()) + int(counts[active & muxb_srf].sum())
+
+    def __str__(self):
+        lines = ["Cycles: " + str(self.cycles) + (" (max number of iterations reached)" if self.max_iter_reached else "")]
+        for col, name in self.units:
+            active = self.active_cycles[(col, name)]
+            ops = ", ".join(op + " " + str(n) for op, n in self.alu_ops[(col, name)].items())
+            utilization = 100*active/self.cycles if self.cycles else 0
+            lines.append("  Col " + str(col) + " " + name + ": " + str(active) + " active cycles ({:.1f}%)".format(utilization) + (" -- " + ops if ops else ""))
+        lines.append("SPM: " + str(self.spm_loads) + " line loads, " + str(self.spm_stores) + " line stores")
+        lines.append("SRF: " + str(self.srf_reads) + " reads, " + str(self.srf_writes) + " writes")
+        lines.append("VWR writes per row: " + str(self.vwr_writes))
+        lines.append("Branches: " + str(self.branches_taken) + " taken, " + str(self.branches_not_taken) + " not taken")
+        if self.shuffles:
+            lines.append("Shuffles: " + ", ".join(mode + " " + str(n) for mode, n in self.shuffles.items()))
+        return "\n".join(lines)
@@ -0,0 +1,135 @@
+"""stream.py: Layout of the kernels that process signals longer than the SPM, and staging of the inputs of streamed runs"""
+
+import threading
+from queue import Queue, Full
+
+import numpy as np
+
+from .params import *
+from .spm import copyWords
+
+class TILED_KERNEL:
+    '''Layout of the SPM of a kernel that processes a long signal one tile at a time (see SIMULATOR.run_tiled):
+
+       -   in_first_line, in_n_lines: SPM lines that get each tile of the signal, SPM_NWORDS samples per line. A tile
+           has in_n_lines*SPM_NWORDS samples, the last one is completed with pad
+       -   out_first_line, out_n_lines: SPM lines with the outputs of a tile
+       -   srf: values of the SRF line of the SPM (the rest of the line is zero), None to keep the line as it is
+       -   spm: constant SPM lines, {line: values}, for example the taps of a filter
+       -   overlap: number of samples of each tile repeated from the end of the previous one, for kernels that need
+           the history of the signal
+       -   out_offset, out_size: values of the output lines (one after the other) that are the outputs of a tile, by
+           default all of them. For example, a filter with one output per input sample keeps the last
+           tile_size - overlap values, from out_offset = overlap on
+    '''
+    def __init__(self, in_first_line, in_n_lines, out_first_line, out_n_lines, srf=None, spm=None, overlap=0, out_offset=0, out_size=None, pad=0):
+        for first_line, n_lines in ((in_first_line, in_n_lines), (out_first_line, out_n_lines)):
+            if n_lines < 1 or first_line < 0 or first_line + n_lines > SPM_NLINES:
+                raise ValueError("Lines " + str(first_line) + " to " + str(first_line + n_lines - 1) + " of a tiled kernel out of the SPM. They should be >= 0 and < " + str(SPM_NLINES) + ".")
+        self.in_first_line = in_first_line
+        self.in_n_lines = in_n_lines
+        self.out_first_line = out_first_line
+        self.out_n_lines = out_n_lines
+        self.srf = srf
+        self.spm = spm if spm is not None else {}
+        self.tile_size = in_n_lines*SPM_NWORDS
+        if overlap < 0 or overlap >= self.tile_size:
+            raise ValueError("The overlap of a tiled kernel should be >= 0 and < " + str(self.tile_size) + " (the tile size), not " + str(overlap) + ".")
+        self.overlap = overlap
+        # Samples of the signal between the starts of two tiles
+        self.step = self.tile_size - overlap
+        self.out_offset = out_offset
+        self.out_size = out_size if out_size is not None else out_n_lines*SPM_NWORDS - out_offset
+        if out_offset < 0 or self.out_size < 1 or out_offset + self.out_size > out_n_lines*SPM_NWORDS:
+            raise ValueError("The outputs of a tiled kernel should be in its " + str(out_n_lines*SPM_NWORDS) + " output values.")
+        self.pad = pad
+
+    def n_tiles(self, n_samples):
+        '''Number of tiles that cover a signal of n_samples samples'''
+        if n_samples == 0:
+            return 0
+        return max(1, -(-(n_samples - self.tile_size) // self.step) + 1)
+
+    def tile(self, signal, i):
+        '''Lines of tile i of a signal, an int32 array of shape (in_n_lines, SPM_NWORDS)'''
+        samples = signal[i*self.step:i*self.step + self.tile_size]
+        lines = np.full(self.tile_size, self.pad, dtype=np.int32)
+        copyWords(lines[:len(samples)], samples)
+        return lines.reshape(self.in_n_lines, SPM_NWORDS)
+
+    def tile_input(self, signal, i):
+        '''SPM blocks of tile i of a signal, as SIMULATOR.run_instances takes them'''
+        return ((self.in_first_line, self.tile(signal, i)),)
+
+    def load_constants(self, spm, srf_line):
+        '''Write the constant lines and the SRF line (srf_line, given by the KMEM) into an SPM'''
+        for line, values in self.spm.items():
+            spm.setLine(int(line), values)
+        if self.srf is not None:
+            values = np.zeros(SPM_NWORDS, dtype=np.int64)
+            values[:len(self.srf)] = self.srf
+            spm.setLine(srf_line, values)
+
+def staged(executor, jobs):
+    '''Generator of the results of jobs (functions without arguments) in order. Each job runs on the executor
+    while the caller uses the result of the previous one, so that at most two results are in memory'''
+    future = None
+    for job in jobs:
+        next_future = executor.submit(job)
+        if future is not None:
+            yield future.result()
+        future = next_future
+    if future is not None:
+        yield future.result()
+
+def frame_blocks(frame, first_line=0):
+    '''SPM blocks of an input frame, as SIMULATOR.run_instances takes them. The frame is either {line: values} or
+    an array of lines (for example with the SRF line and the data lines of a kernel) written from first_line on'''
+    if isinstance(frame, dict):
+        blocks = []
+        for line, values in frame.items():
+            lines = np.zeros((1, SPM_NWORDS), dtype=np.int32)
+            copyWords(lines[0], values)
+            blocks.append((int(line), lines))
+        return tuple(blocks)
+    frame = np.asarray(frame)
+    if frame.ndim != 2 or frame.shape[1] != SPM_NWORDS:
+        raise ValueError("Frame should have shape (m, " + str(SPM_NWORDS) + "), not " + str(frame.shape) + ".")
+    lines = np.zeros(frame.shape, dtype=np.int32)
+    copyWords(lines, frame)
+    return ((first_line, lines),)
+
+def read_ahead(items, size):
+    '''Generator of the items of an iterable, which a background thread reads up to size items ahead of the
+    caller. The thread waits while size items are pending, and the caller gets the errors of the iterable'''
+    queue = Queue(maxsize=size)
+    stop = threading.Event()
+    def put(entry):
+        '''Wait until the queue has room for entry, unless the caller stopped reading. Return whether it was put'''
+        while not stop.is_set():
+            try:
+                queue.put(entry, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+    def produce():
+        try:
+            for item in items:
+                if not put((True, item)):
+                    return
+            put((False, None))
+        except BaseException as e:
+            put((False, e))
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            more, item = queue.get()
+            if not more:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,85 @@
+"""trace.py: Trace levels, events and sinks to observe the execution of kernels in the DISCO-CGRA simulator"""
+
+import sys
+from enum import Enum
+
+class TRACE_LEVEL(int, Enum):
+    '''Amount of information reported while running a kernel'''
+    NONE = 0    # Silent execution
+    SUMMARY = 1 # One event at the end of the run
+    CYCLE = 2   # One event at the start of each cycle plus one per executed unit
+
+class TRACE_EVENT:
+    '''Something that happened while running a kernel:
+
+       -   kind: "cycle" at the start of a cycle, "unit" after a unit executes its instruction or "summary" at the end of the run
+       -   cycle: cycle number
+       -   pc: program counter of the cycle (for "summary", the pc after the last cycle)
+       -   col: column of the unit (-1 if it does not apply)
+       -   unit: name of the unit (LCU, LSU, MXCU, RC0, ..., RCN)
+       -   alu_res: result of the ALU of the unit in this cycle
+       -   asm: disassembly of the executed instruction, only built if the sink asks for it (disasm = True)
+       -   max_iter_reached: for "summary", whether the run stopped because it reached max_iter
+    '''
+    def __init__(self, kind, cycle, pc, col=-1, unit="", alu_res=0, asm=None, max_iter_reached=False):
+        self.kind = kind
+        self.cycle = cycle
+        self.pc = pc
+        self.col = col
+        self.unit = unit
+        self.alu_res = alu_res
+        self.asm = asm
+        self.max_iter_reached = max_iter_reached
+
+    def __str__(self):
+        if self.kind == "cycle":
+            return "---------------------\n       PC: " + str(self.pc) + "\n---------------------"
+        if self.kind == "unit":
+            asm = self.asm if self.asm is not None else "-"
+            return self.unit + ": " + asm + " --> ALU res = " + str(self.alu_res)
+        if self.max_iter_reached:
+            return "Max number of iterations reached."
+        return "End..."
+
+class TRACE_SINK:
+    '''Destination of the trace events. Subclasses implement emit().
+    Set disasm to True to receive the disassembly of each executed instruction in the events.'''
+    def __init__(self, disasm=False):
+        self.disasm = disasm
+
+    def emit(self, event):
+        raise NotImplementedError(self.__class__.__name__ + ": emit() not implemented")
+
+class LIST_SINK(TRACE_SINK):
+    '''Keep the trace events in a list'''
+    def __init__(self, disasm=False):
+        super().__init__(disasm)
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+class FILE_SINK(TRACE_SINK):
+    '''Write one line per trace event to a file, given either by its path or as an open file object'''
+    def __init__(self, file=None, disasm=True):
+        super().__init__(disasm)
+        if file is None:
+            file = sys.stdout
+        self.own_file = isinstance(file, str)
+        self.file = open(file, "w") if self.own_file else file
+
+    def emit(self, event):
+        self.file.write(str(event) + "\n")
+
+    def close(self):
+        if self.own_file:
+            self.file.close()
+
+class CALLBACK_SINK(TRACE_SINK):
+    '''Call a function with each trace event'''
+    def __init__(self, callback, disasm=False):
+        super().__init__(disasm)
+        self.callback = callback
+
+    def emit(self, event):
+        self.callback(event)
@@ -1,10 +1,16 @@
+import numpy as np
 from .params import *
 
 class VWR():
     def __init__(self):
-        self.values = [0 for _ in range(N_ELEMS_PER_VWR)]
+        # The loads, stores and shuffles copy into this buffer, it is never replaced
+        self.values = np.zeros(N_ELEMS_PER_VWR, dtype=np.int32)
     
     def getIdx(self, idx):
         if idx < 0 or idx >= N_ELEMS_PER_VWR:
             raise Exception("The indexed accesed " + str(idx) + " should be >= 0 and < " + str(N_ELEMS_PER_VWR) + ".")
-        return self.values[idx]
\ No newline at end of file
+        return self.values.item(idx)
+
+    def setIdx(self, idx, value):
+        '''Write a value, wrapped to a 32-bit word'''
+        self.values[idx] = ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000